@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The importers are standalone scripts that import their siblings as
+# top-level modules, so make that work for `python -m data_fetcher` too
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from orchestrator import main  # noqa: E402
+
+raise SystemExit(main())
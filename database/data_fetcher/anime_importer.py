@@ -8,12 +8,19 @@ import os
 import json
 from datetime import datetime
 
+from budget import REQUEST_BUDGET, dry_run, pop_budget_flags
+from content_hash import replace_entity_image, upsert_entity
+from jikan_client import client_session, entity_deadline
+from log_pipeline import setup_logging
+from metrics import ENTITIES, instrument_connection
+from models import Anime, CastMember, as_record
+from ndjson_dump import DumpWriter, OfflineSession, RecordingSession, iter_dump
+from normalize import normalize_anime, parse_date
+from search_index import index_entity
+import profiling
+
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[logging.FileHandler("anime_importer.log"), logging.StreamHandler()],
-)
+setup_logging("anime_importer.log")
 
 # Database configuration
 DB_CONFIG = {
@@ -71,12 +78,11 @@ async def fetch_with_retry(session, url, retries=MAX_RETRIES):
     return None
 
 
-async def get_or_create_company(conn, studio):
+async def get_or_create_company(conn, company_name):
     """Get or create company in database"""
-    if not studio or not studio.get("name"):
+    if not company_name:
         return None
 
-    company_name = studio["name"]
     company_id = await conn.fetchval(
         "SELECT company_id FROM company WHERE name = $1", company_name
     )
@@ -92,10 +98,10 @@ async def get_or_create_company(conn, studio):
 
 async def get_or_create_genre(conn, genre):
     """Get or create genre in database"""
-    if not genre or not genre.get("name"):
+    if not genre or not genre.name:
         return None
 
-    genre_name = genre["name"]
+    genre_name = genre.name
     genre_id = await conn.fetchval(
         "SELECT genre_id FROM genre WHERE name = $1", genre_name
     )
@@ -111,10 +117,10 @@ async def get_or_create_genre(conn, genre):
 
 async def get_or_create_voice_actor(conn, person):
     """Get or create voice actor in database"""
-    if not person or not person.get("name"):
+    if not person or not person.name:
         return None
 
-    va_name = person["name"]
+    va_name = person.name
     va_id = await conn.fetchval(
         "SELECT voice_actor_id FROM voice_actor WHERE name = $1", va_name
     )
@@ -122,19 +128,12 @@ async def get_or_create_voice_actor(conn, person):
     if va_id:
         return va_id
 
-    # Extract birth date if available
-    birth_date = None
-    if person.get("birthday"):
-        try:
-            birth_date = datetime.strptime(person["birthday"], "%Y-%m-%d").date()
-        except:
-            pass
-
     va_id = await conn.fetchval(
         "INSERT INTO voice_actor (name, birth_date) VALUES ($1, $2) RETURNING voice_actor_id",
         va_name,
-        birth_date,
+        parse_date(person.birthday),
     )
+    await index_entity(conn, "voice_actor", va_id, {"name": va_name})
     return va_id
 
 
@@ -145,150 +144,142 @@ async def check_anime_exists(conn, mal_id):
     return False  # Always process for now, but you can enhance this
 
 
-async def process_anime_from_data(conn, session, anime_data):
-    """Process anime from already fetched data"""
-    if not anime_data or not anime_data.get("approved") or not anime_data.get("title"):
+async def process_anime_from_data(conn, session, anime_data, normalized=None):
+    """
+    Process anime from already fetched data (an Anime or the raw payload).
+
+    normalized is its (release_date, season) pair, when the caller already
+    normalized the whole page.
+    """
+    anime = as_record(Anime, anime_data)
+    anime_data = None  # Only the projected fields stay alive from here on
+    if not anime or not anime.approved or not anime.title:
         return False
 
-    mal_id = anime_data.get("mal_id")
+    mal_id = anime.mal_id
+    profiling.set_entity("anime", mal_id)
+    started = time.perf_counter()
     if mal_id in processed_anime_ids:
-        logging.info(f"Anime {mal_id} already processed, skipping")
+        logging.info("Anime %s already processed, skipping", mal_id)
         return False
 
     # Check if already exists in database
     if await check_anime_exists(conn, mal_id):
-        logging.info(f"Anime {mal_id} already in database, skipping")
+        logging.info("Anime %s already in database, skipping", mal_id)
         processed_anime_ids.add(mal_id)
         return False
 
     # Get or create company (studio)
-    company_id = None
-    if anime_data.get("studios") and anime_data["studios"]:
-        company_id = await get_or_create_company(conn, anime_data["studios"][0])
-
-    # Prepare anime data for insertion
-    alternative_title = anime_data.get("title_english") or anime_data.get(
-        "title_japanese"
-    )
-
-    # Parse release date
-    release_date = None
-    if anime_data.get("aired") and anime_data["aired"].get("from"):
-        try:
-            release_date = datetime.strptime(
-                anime_data["aired"]["from"], "%Y-%m-%dT%H:%M:%S%z"
-            ).date()
-        except:
-            pass
+    company_id = await get_or_create_company(conn, anime.studio)
+
+    with profiling.span("transform"):
+        release_date, season = normalized or normalize_anime([anime])[0]
+
+        # Calculate rating (convert 10-point scale to 5-point, and set as seed)
+        rating = None
+        if anime.score:
+            rating = anime.score / 2.0
+
+    with profiling.span("write"):
+        # One transaction for the row, its links and the fingerprint, so a failed
+        # link or image write can't leave a fingerprint that skips the repair.
+        async with conn.transaction():
+            # Insert the anime, or update only the columns whose content changed.
+            # rating is maintained by the review triggers after the first insert.
+            anime_db_id, changed = await upsert_entity(
+                conn,
+                "anime",
+                "anime_id",
+                "anime",
+                mal_id,
+                {
+                    "title": anime.title,
+                    "alternative_title": anime.alternative_title,
+                    "release_date": release_date,
+                    "season": season,
+                    "episodes": anime.episodes,
+                    "synopsis": anime.synopsis,
+                    "rank": anime.rank,
+                    "company_id": company_id,
+                    "seed_rating": rating or 0,
+                    "seed_count": 1 if rating else 0,
+                },
+                extra={
+                    "genres": sorted(g.name for g in anime.genres if g.name),
+                    "image_url": anime.image_url,
+                },
+                insert_only={"rating": rating},
+            )
 
-    # Create season string
-    season = None
-    if anime_data.get("season") and anime_data.get("year"):
-        season = f"{anime_data['season'].capitalize()} {anime_data['year']}"
-
-    # Calculate rating (convert 10-point scale to 5-point, and set as seed)
-    rating = None
-    if anime_data.get("score"):
-        rating = anime_data["score"] / 2.0
-
-    # Insert anime with seed rating
-    anime_db_id = await conn.fetchval(
-        """
-        INSERT INTO anime (
-            title, alternative_title, release_date, season, episodes, 
-            synopsis, rating, rank, company_id, seed_rating, seed_count
-        )
-        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
-        RETURNING anime_id
-        """,
-        anime_data["title"],
-        alternative_title,
-        release_date,
-        season,
-        anime_data.get("episodes"),
-        anime_data.get("synopsis"),
-        rating,
-        anime_data.get("rank"),
-        company_id,
-        rating or 0,  # seed_rating
-        1 if rating else 0,  # seed_count
-    )
+            if not changed:
+                logging.info("Anime %s unchanged, skipping writes", mal_id)
+            else:
+                # Add genres
+                if "genres" in changed:
+                    await conn.execute(
+                        "DELETE FROM anime_genre WHERE anime_id = $1", anime_db_id
+                    )
+                    for genre in anime.genres:
+                        genre_id = await get_or_create_genre(conn, genre)
+                        if genre_id:
+                            await conn.execute(
+                                "INSERT INTO anime_genre (anime_id, genre_id) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+                                anime_db_id,
+                                genre_id,
+                            )
 
-    # Add genres
-    all_genres = []
-    for genre_type in ["genres", "explicit_genres", "themes", "demographics"]:
-        if anime_data.get(genre_type):
-            all_genres.extend(anime_data[genre_type])
-
-    for genre in all_genres:
-        genre_id = await get_or_create_genre(conn, genre)
-        if genre_id:
-            await conn.execute(
-                "INSERT INTO anime_genre (anime_id, genre_id) VALUES ($1, $2) ON CONFLICT DO NOTHING",
-                anime_db_id,
-                genre_id,
-            )
+                # Add main image
+                if "image_url" in changed and anime.image_url:
+                    await replace_entity_image(conn, "anime", anime_db_id, anime.image_url)
 
-    # Add main image
-    if (
-        anime_data.get("images")
-        and anime_data["images"].get("jpg")
-        and anime_data["images"]["jpg"].get("image_url")
-    ):
-        await conn.execute(
-            """
-            INSERT INTO media (url, entity_type, entity_id, media_type)
-            VALUES ($1, 'anime', $2, 'image')
-            """,
-            anime_data["images"]["jpg"]["image_url"],
-            anime_db_id,
-        )
-
-    # Fetch and process characters (if we have the MAL ID)
-    if mal_id:
+    # Fetch and process characters (if we have the MAL ID). An anime whose
+    # fingerprint is unchanged keeps its cast; that saves a request per refresh.
+    if mal_id and changed:
         characters_url = f"{JIKAN_BASE_URL}/anime/{mal_id}/characters"
         characters_data = await fetch_with_retry(session, characters_url)
 
         if characters_data and "data" in characters_data:
-            for char_entry in characters_data["data"]:
-                character = char_entry["character"]
-                role = char_entry.get("role", "Supporting")
-
-                # Find Japanese voice actor
-                japanese_va = None
-                for va in char_entry.get("voice_actors", []):
-                    if va.get("language") == "Japanese":
-                        japanese_va = va
-                        break
-
-                # Create character
-                character_id = await conn.fetchval(
-                    "INSERT INTO characters (name, description) VALUES ($1, $2) RETURNING character_id",
-                    character["name"],
-                    character.get("about"),
+            cast = [CastMember.from_payload(entry) for entry in characters_data["data"]]
+            characters_data = None
+            for character in cast:
+                # Create voice actor (the Japanese one, if listed)
+                va_id = await get_or_create_voice_actor(conn, character.voice_actor)
+
+                # Create or refresh character. Only the fields this endpoint
+                # actually carries are diffed; the description belongs to
+                # character_importer once the character is known.
+                character_columns = {"name": character.name}
+                if va_id:
+                    character_columns["voice_actor_id"] = va_id
+                character_id, _ = await upsert_entity(
+                    conn,
+                    "characters",
+                    "character_id",
+                    "character",
+                    character.mal_id,
+                    character_columns,
+                    insert_only={"description": character.about},
                 )
 
-                # Create voice actor and link to character
-                if japanese_va and japanese_va.get("person"):
-                    va_id = await get_or_create_voice_actor(conn, japanese_va["person"])
-                    if va_id:
-                        await conn.execute(
-                            "UPDATE characters SET voice_actor_id = $1 WHERE character_id = $2",
-                            va_id,
-                            character_id,
-                        )
-
-                # Link character to anime
+                # Link character to anime (no-op when the link is unchanged)
                 await conn.execute(
-                    "INSERT INTO anime_character (anime_id, character_id, role) VALUES ($1, $2, $3)",
+                    """
+                    INSERT INTO anime_character (anime_id, character_id, role) VALUES ($1, $2, $3)
+                    ON CONFLICT (anime_id, character_id) DO UPDATE SET role = EXCLUDED.role
+                    WHERE anime_character.role IS DISTINCT FROM EXCLUDED.role
+                    """,
                     anime_db_id,
                     character_id,
-                    role,
+                    character.role,
                 )
 
     processed_anime_ids.add(mal_id)
     logging.info(
-        f"Processed anime MAL ID {mal_id} -> DB ID {anime_db_id} ({anime_data['title']})"
+        "Processed anime MAL ID %s -> DB ID %s (%s)",
+        mal_id,
+        anime_db_id,
+        anime.title,
+        extra={"elapsed_ms": round((time.perf_counter() - started) * 1000, 1)},
     )
     return True
 
@@ -341,23 +332,37 @@ async def save_state(page, processed_count, processed_ids):
         json.dump(state, f, indent=2)
 
 
-async def import_anime_data():
-    """Main function to import anime data using pagination"""
+async def import_anime_data(export_path=None, conn=None, session=None):
+    """
+    Main function to import anime data using pagination.
+
+    With export_path set, every payload fetched for a processed anime is also
+    appended to that NDJSON dump for later offline runs.
+    """
     global processed_anime_ids
 
     # Load state
     current_page, processed_count, processed_anime_ids = await load_state()
     logging.info(
-        f"Starting import from page {current_page}, already processed {processed_count} anime"
+        "Starting import from page %s, already processed %s anime",
+        current_page,
+        processed_count,
     )
 
-    conn = None
+    own_conn = conn is None
+    dump_writer = DumpWriter(export_path) if export_path else None
     try:
         # Connect to database
-        conn = await asyncpg.connect(**DB_CONFIG)
-        logging.info("Connected to database")
+        if own_conn:
+            conn = await asyncpg.connect(**DB_CONFIG)
+            await instrument_connection(conn)
+            logging.info("Connected to database")
+
+        async with client_session(session) as session:
+            if dump_writer:
+                dump_writer.open()
+                session = RecordingSession(session)
 
-        async with aiohttp.ClientSession() as session:
             consecutive_empty_pages = 0
             max_empty_pages = 3  # Stop if we get 3 consecutive empty pages
 
@@ -389,43 +394,72 @@ async def import_anime_data():
                 consecutive_empty_pages = 0  # Reset counter
                 page_processed_count = 0
 
+                # Release dates and seasons for the whole page in one pass
+                page_normalized = normalize_anime([Anime.from_payload(a) for a in anime_list])
+
                 # Process each anime in the page
-                for anime_data in anime_list:
+                for anime_data, normalized in zip(anime_list, page_normalized):
                     if processed_count >= TARGET_ANIME_COUNT:
                         break
+                    if REQUEST_BUDGET.exhausted():
+                        break
 
                     try:
-                        # Fetch full anime details
-                        mal_id = anime_data.get("mal_id")
-                        if not mal_id:
-                            continue
-
-                        # Get full anime data
-                        full_anime_url = f"{JIKAN_BASE_URL}/anime/{mal_id}/full"
-                        full_anime_data = await fetch_with_retry(
-                            session, full_anime_url
-                        )
-
-                        if full_anime_data and "data" in full_anime_data:
-                            success = await process_anime_from_data(
-                                conn, session, full_anime_data["data"]
+                        with entity_deadline():
+                            # Fetch full anime details
+                            mal_id = anime_data.get("mal_id")
+                            if not mal_id:
+                                continue
+                            profiling.set_entity("anime", mal_id)
+
+                            # Get full anime data
+                            full_anime_url = f"{JIKAN_BASE_URL}/anime/{mal_id}/full"
+                            if dump_writer:
+                                session.drain()
+                            full_anime_data = await fetch_with_retry(
+                                session, full_anime_url
                             )
-                            if success:
-                                processed_count += 1
-                                page_processed_count += 1
-                                logging.info(
-                                    f"Progress: {processed_count}/{TARGET_ANIME_COUNT} anime imported"
+
+                            if full_anime_data and "data" in full_anime_data:
+                                # The raw payload is only kept for the dump
+                                payload = full_anime_data["data"]
+                                anime = Anime.from_payload(payload)
+                                if not dump_writer:
+                                    full_anime_data = payload = None
+                                success = await process_anime_from_data(
+                                    conn, session, anime, normalized
+                                )
+                                ENTITIES.inc(
+                                    kind="anime", result="imported" if success else "skipped"
                                 )
+                                if success:
+                                    processed_count += 1
+                                    page_processed_count += 1
+                                    logging.info(
+                                        "Progress: %s/%s anime imported",
+                                        processed_count,
+                                        TARGET_ANIME_COUNT,
+                                    )
+
+                                if dump_writer:
+                                    related = session.drain()
+                                    related.pop(full_anime_url, None)
+                                    dump_writer.write("anime", payload, related)
 
                         # Small delay between anime processing
                         await asyncio.sleep(0.5)
 
                     except Exception as e:
+                        ENTITIES.inc(kind="anime", result="error")
                         logging.error(
                             f"Error processing anime {anime_data.get('title', 'Unknown')}: {str(e)}"
                         )
                         continue
 
+                # Out of budget
+                if REQUEST_BUDGET.exhausted():
+                    break
+
                 # Save progress after each page
                 await save_state(current_page, processed_count, processed_anime_ids)
 
@@ -449,19 +483,78 @@ async def import_anime_data():
 
     except Exception as e:
         logging.critical(f"Critical error: {str(e)}")
+        if not own_conn:
+            raise
     finally:
-        if conn:
+        if conn and own_conn:
             await conn.close()
             logging.info("Database connection closed")
 
+        if dump_writer:
+            dump_writer.close()
+
         # Final save
         await save_state(current_page, processed_count, processed_anime_ids)
         logging.info(f"Import completed. Total anime imported: {processed_count}")
 
 
+async def import_anime_from_dump(dump_path):
+    """Import anime from an NDJSON dump without touching the API"""
+    processed_count = 0
+    conn = None
+    try:
+        conn = await asyncpg.connect(**DB_CONFIG)
+        await instrument_connection(conn)
+        logging.info("Connected to database")
+
+        for record in iter_dump(dump_path, kind="anime"):
+            try:
+                success = await process_anime_from_data(
+                    conn, OfflineSession(record), record["data"]
+                )
+                if success:
+                    processed_count += 1
+            except Exception as e:
+                logging.error(
+                    f"Error processing anime {record['data'].get('title', 'Unknown')}: {str(e)}"
+                )
+                continue
+
+    except Exception as e:
+        logging.critical(f"Critical error: {str(e)}")
+    finally:
+        if conn:
+            await conn.close()
+            logging.info("Database connection closed")
+        logging.info(f"Dump import completed. Total anime imported: {processed_count}")
+
+
 if __name__ == "__main__":
-    logging.info("===== STARTING ANIME IMPORT (PAGINATED) =====")
-    start_time = time.time()
-    asyncio.run(import_anime_data())
-    duration = time.time() - start_time
-    logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
+    import sys
+
+    profile_mode = profiling.pop_profile_flag(sys.argv)
+    is_dry_run = pop_budget_flags(sys.argv)
+
+    if is_dry_run:
+        # Estimate requests and time without calling the API
+        asyncio.run(dry_run(["anime"], DB_CONFIG))
+    elif len(sys.argv) > 2 and sys.argv[1] == "load":
+        # Rebuild from a local dump instead of the API
+        logging.info("===== STARTING ANIME IMPORT (FROM DUMP) =====")
+        start_time = time.time()
+        profiling.run(import_anime_from_dump(sys.argv[2]), profile_mode, "anime_importer")
+        duration = time.time() - start_time
+        logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
+    elif len(sys.argv) > 2 and sys.argv[1] == "export":
+        # Regular import that also captures payloads into a dump
+        logging.info("===== STARTING ANIME IMPORT (PAGINATED, EXPORTING) =====")
+        start_time = time.time()
+        profiling.run(import_anime_data(export_path=sys.argv[2]), profile_mode, "anime_importer")
+        duration = time.time() - start_time
+        logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
+    else:
+        logging.info("===== STARTING ANIME IMPORT (PAGINATED) =====")
+        start_time = time.time()
+        profiling.run(import_anime_data(), profile_mode, "anime_importer")
+        duration = time.time() - start_time
+        logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
@@ -0,0 +1,129 @@
+import bisect
+import re
+
+# Keyword-based attribute inference over free text (about blurbs, names).
+# Every keyword of an extractor is compiled into a single alternation, so a
+# text is scanned once however many values and keywords there are, and a
+# whole page of texts can be scanned in one pass as well.
+
+_SEPARATOR = "\n\x00\n"  # Never part of a keyword, and a word boundary
+
+
+class AttributeExtractor:
+    """Map keywords found in text to attribute values, with a confidence"""
+
+    def __init__(self, vocabulary):
+        # vocabulary: value -> {keyword: weight}; earlier values win ties
+        self._keywords = {}
+        self._rank = {value: rank for rank, value in enumerate(vocabulary)}
+        for value, keywords in vocabulary.items():
+            for keyword, weight in keywords.items():
+                self._keywords[keyword.lower()] = (value, weight)
+        # Longest first so "united kingdom" wins over "united"
+        alternation = "|".join(
+            re.escape(keyword) for keyword in sorted(self._keywords, key=len, reverse=True)
+        )
+        self._pattern = re.compile(rf"\b(?:{alternation})\b", re.IGNORECASE)
+
+    def matches(self, text):
+        """(value, keyword, offset) for every keyword occurrence in text"""
+        hits = []
+        for match in self._pattern.finditer(text or ""):
+            value, _ = self._keywords[match.group().lower()]
+            hits.append((value, match.group(), match.start()))
+        return hits
+
+    def _score(self, keywords):
+        scores = {}
+        for keyword in keywords:
+            value, weight = self._keywords[keyword.lower()]
+            scores[value] = scores.get(value, 0.0) + weight
+        total = sum(scores.values())
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self._rank[item[0]]))
+        return [(value, score / total) for value, score in ranked]
+
+    def extract(self, text):
+        """Every value found, best first, as (value, confidence) pairs"""
+        return self._score(match.group() for match in self._pattern.finditer(text or ""))
+
+    def best(self, text, default=None):
+        """The most likely value and its confidence, or (default, 0.0)"""
+        found = self.extract(text)
+        return found[0] if found else (default, 0.0)
+
+    def extract_many(self, texts):
+        """extract() for each text, in one regex pass over all of them"""
+        texts = [text or "" for text in texts]
+        starts = []
+        offset = 0
+        for text in texts:
+            starts.append(offset)
+            offset += len(text) + len(_SEPARATOR)
+        keywords = [[] for _ in texts]
+        for match in self._pattern.finditer(_SEPARATOR.join(texts)):
+            keywords[bisect.bisect_right(starts, match.start()) - 1].append(match.group())
+        return [self._score(found) for found in keywords]
+
+
+# Countries as mentioned in company and person blurbs
+COUNTRIES = AttributeExtractor({
+    "Japan": {"japan": 1.0, "japanese": 1.0, "tokyo": 0.5, "osaka": 0.5, "kyoto": 0.5},
+    "United States": {
+        "usa": 1.0, "united states": 1.0, "american": 1.0,
+        "california": 0.5, "los angeles": 0.5, "new york": 0.5,
+    },
+    "South Korea": {"korea": 1.0, "korean": 1.0, "seoul": 0.5},
+    "China": {"china": 1.0, "chinese": 1.0, "beijing": 0.5, "shanghai": 0.5},
+    "France": {"france": 1.0, "french": 1.0, "paris": 0.5},
+    "Germany": {"germany": 1.0, "german": 1.0},
+    "United Kingdom": {
+        "uk": 1.0, "united kingdom": 1.0, "britain": 1.0, "british": 1.0, "london": 0.5,
+    },
+})
+
+# Company names that give away where a studio is based
+COMPANY_NAMES = AttributeExtractor({
+    "Japan": {
+        "studio": 1.0, "studios": 1.0, "animation": 1.0, "toei": 1.0, "madhouse": 1.0,
+        "bones": 1.0, "shaft": 1.0, "wit": 1.0, "mappa": 1.0,
+    },
+    "United States": {"disney": 1.0, "warner": 1.0, "fox": 1.0, "universal": 1.0},
+})
+
+NATIONALITIES = {
+    "Japan": "Japanese",
+    "United States": "American",
+    "South Korea": "Korean",
+    "China": "Chinese",
+    "France": "French",
+    "Germany": "German",
+    "United Kingdom": "British",
+}
+
+DEFAULT_COUNTRY = "Japan"  # Most anime companies are Japanese
+NAME_CONFIDENCE = 0.5  # A name match is weaker evidence than the about text
+
+
+def infer_country(about, name, name_guess=None, default=DEFAULT_COUNTRY):
+    """
+    Country of a company and a confidence in [0, 1]: from its about text,
+    else its name (name_guess, if already extracted), else the default.
+    """
+    country, confidence = COUNTRIES.best(about)
+    if country:
+        return country, confidence
+    country, confidence = name_guess or COMPANY_NAMES.best(name)
+    if country:
+        return country, confidence * NAME_CONFIDENCE
+    return default, 0.0
+
+
+def guess_countries_from_names(names):
+    """COMPANY_NAMES.best() for a whole page of company names in one pass"""
+    return [found[0] if found else (None, 0.0) for found in COMPANY_NAMES.extract_many(names)]
+
+
+def infer_nationality(about):
+    """Nationality of a person from their about text, or None"""
+    country, _ = COUNTRIES.best(about)
+    return NATIONALITIES.get(country)
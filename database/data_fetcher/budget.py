@@ -0,0 +1,444 @@
+import logging
+import math
+import os
+import time
+
+import asyncpg
+
+from jikan_client import DEFAULT_RATE
+from metrics import HTTP_ERRORS, HTTP_REQUESTS
+
+# Request budgets for importer runs.
+#
+# plan() estimates how many Jikan requests each stage will make, from the
+# importer targets, their resume state files and what is already in the
+# database, and projects the wall time under the rate limit. REQUEST_BUDGET
+# caps a real run: importers check it between entities and stop at the same
+# checkpoint they would resume from after a crash.
+
+RETRY_OVERHEAD = float(os.getenv("BUDGET_RETRY_OVERHEAD", 0.05))  # Extra requests for retries and 429s
+MEAN_REQUEST_SECONDS = float(os.getenv("BUDGET_MEAN_REQUEST_SECONDS", 0.4))  # Jikan response time
+ESTIMATED_GENRES = 80  # Anime + manga genres Jikan returns
+CHARACTERS_PER_ANIME = 10  # Rough new characters per imported anime
+SECONDS_PER_VARIANT = 0.05  # Resize and encode (or hash) of one poster-sized image
+FRESH_HOURS = float(os.getenv("BUDGET_FRESH_HOURS", 24 * 7))  # Fingerprints checked since count as unchanged
+
+
+def _requests_made():
+    return HTTP_REQUESTS.total() + HTTP_ERRORS.total()
+
+
+class RequestBudget:
+    """
+    Hard cap on requests and/or wall time for one run (None = unlimited).
+
+    Importers check it before each entity and stop once it is spent. The
+    paginated ones then break out of the page loop too; their final state
+    save keeps the current page, so a resumed run picks up the entities not
+    yet processed.
+    """
+
+    def __init__(self, max_requests=None, max_seconds=None):
+        self.configure(max_requests, max_seconds)
+
+    def configure(self, max_requests=None, max_seconds=None):
+        self.max_requests = max_requests
+        self.max_seconds = max_seconds
+        self._baseline = _requests_made()
+        self._started = time.monotonic()
+        self._reported = False
+
+    def used(self):
+        return _requests_made() - self._baseline
+
+    def elapsed(self):
+        return time.monotonic() - self._started
+
+    def exhausted(self):
+        over_requests = self.max_requests is not None and self.used() >= self.max_requests
+        over_time = self.max_seconds is not None and self.elapsed() >= self.max_seconds
+        if (over_requests or over_time) and not self._reported:
+            self._reported = True
+            logging.warning(
+                f"Request budget reached ({self.used()} requests, {self.elapsed():.0f}s); "
+                "stopping at the next checkpoint"
+            )
+        return over_requests or over_time
+
+
+REQUEST_BUDGET = RequestBudget()
+
+
+def pop_budget_flags(argv):
+    """
+    Remove --dry-run, --max-requests N and --max-minutes M from argv.
+
+    Configures REQUEST_BUDGET and returns whether a dry run was requested.
+    """
+    dry_run = False
+    max_requests = None
+    max_minutes = None
+    remaining = []
+    args = iter(argv)
+    for arg in args:
+        if arg == "--dry-run":
+            dry_run = True
+        elif arg == "--max-requests":
+            max_requests = int(next(args))
+        elif arg == "--max-minutes":
+            max_minutes = float(next(args))
+        else:
+            remaining.append(arg)
+    argv[:] = remaining
+    REQUEST_BUDGET.configure(max_requests, max_minutes * 60 if max_minutes else None)
+    return dry_run
+
+
+class StageEstimate:
+    """Projected requests per endpoint and wall time of one stage"""
+
+    def __init__(self, stage, entities, requests, pacing_seconds=0.0, concurrency=1):
+        self.stage = stage
+        self.entities = entities
+        self.requests = requests  # endpoint -> expected requests
+        self.pacing_seconds = pacing_seconds  # The importer's own sleeps
+        self.concurrency = concurrency
+
+    @property
+    def total_requests(self):
+        return math.ceil(sum(self.requests.values()) * (1 + RETRY_OVERHEAD))
+
+    def seconds(self, rate=DEFAULT_RATE):
+        """Whichever is slower: the rate limit or the importer's own pace"""
+        paced = self.total_requests * MEAN_REQUEST_SECONDS / self.concurrency + self.pacing_seconds
+        return max(self.total_requests / rate, paced)
+
+
+# The pacing figures mirror the fixed sleeps in each importer's loop.
+#
+# The paginated importers still fetch /full for every entity they walk, since
+# that is how they see whether it changed, but an entity whose fingerprint
+# was checked within FRESH_HOURS is expected to be unchanged: it is not
+# counted as an entity to write, and requests that only follow a change
+# (an anime's cast) are left out for it.
+
+FRESH_FINGERPRINTS = """
+    SELECT COUNT(*) FROM import_fingerprint
+    WHERE entity_type = ANY($1::text[]) AND checked_at > NOW() - $2 * INTERVAL '1 hour'
+"""
+
+
+async def _fresh(conn, *entity_types):
+    """Entities of these types fingerprinted and checked within FRESH_HOURS"""
+    return await conn.fetchval(FRESH_FINGERPRINTS, list(entity_types), FRESH_HOURS)
+
+
+async def estimate_reference_data(conn, planned):
+    # Local files only; no API requests
+    return StageEstimate("reference_data", 0, {})
+
+
+async def estimate_genres(conn, planned):
+    import genre_importer
+
+    processed_count, _ = await genre_importer.load_state()
+    known = max(processed_count, await _fresh(conn, "genre", "manga_genre"))
+    return StageEstimate(
+        "genres",
+        max(ESTIMATED_GENRES - known, 0),
+        {"/genres/anime": 1, "/genres/manga": 1},
+    )
+
+
+async def estimate_companies(conn, planned):
+    import company_importer
+
+    _, processed_count, _ = await company_importer.load_state()
+    remaining = max(company_importer.TARGET_COMPANY_COUNT - processed_count, 0)
+    pages = math.ceil(remaining / company_importer.COMPANIES_PER_PAGE)
+    changed = max(remaining - await _fresh(conn, "company"), 0)
+    return StageEstimate(
+        "companies",
+        changed,
+        {"/producers": pages, "/producers/{id}/full": remaining},
+        pacing_seconds=0.3 * remaining + company_importer.BASE_DELAY * pages,
+    )
+
+
+async def estimate_anime(conn, planned):
+    import anime_importer
+
+    _, processed_count, _ = await anime_importer.load_state()
+    remaining = max(anime_importer.TARGET_ANIME_COUNT - processed_count, 0)
+    pages = math.ceil(remaining / anime_importer.ANIME_PER_PAGE)
+    changed = max(remaining - await _fresh(conn, "anime"), 0)
+    return StageEstimate(
+        "anime",
+        changed,
+        {"/anime": pages, "/anime/{id}/full": remaining, "/anime/{id}/characters": changed},
+        pacing_seconds=0.5 * remaining + anime_importer.BASE_DELAY * pages,
+    )
+
+
+async def estimate_characters(conn, planned):
+    import character_importer
+
+    _, processed_count, _ = await character_importer.load_state()
+    remaining = max(character_importer.TARGET_CHARACTER_COUNT - processed_count, 0)
+    pages = math.ceil(remaining / character_importer.CHARACTERS_PER_PAGE)
+    changed = max(remaining - await _fresh(conn, "character"), 0)
+    return StageEstimate(
+        "characters",
+        changed,
+        {"/characters": pages, "/characters/{id}/full": remaining},
+        pacing_seconds=0.5 * remaining + character_importer.BASE_DELAY * pages,
+    )
+
+
+ANIME_WITHOUT_IMAGE_COUNT = """
+    SELECT COUNT(*) FROM anime a
+    WHERE NOT EXISTS (
+        SELECT 1 FROM live_media m
+        WHERE m.entity_type = 'anime' AND m.entity_id = a.anime_id AND m.media_type = 'image'
+    )
+"""
+ANIME_WITHOUT_TRAILER_COUNT = """
+    SELECT COUNT(*) FROM anime WHERE trailer_url_yt_id IS NULL OR trailer_url_yt_id = ''
+"""
+CHARACTERS_WITHOUT_IMAGE_COUNT = """
+    SELECT COUNT(*) FROM characters c
+    WHERE NOT EXISTS (
+        SELECT 1 FROM live_media m
+        WHERE m.entity_type = 'character' AND m.entity_id = c.character_id AND m.media_type = 'image'
+    )
+"""
+VOICE_ACTORS_WITHOUT_IMAGE_COUNT = """
+    SELECT COUNT(*) FROM voice_actor v
+    WHERE NOT EXISTS (
+        SELECT 1 FROM live_media m
+        WHERE m.entity_type = 'voice_actor' AND m.entity_id = v.voice_actor_id AND m.media_type = 'image'
+    )
+"""
+
+
+def _new_from(planned, stage, per_entity=1):
+    """Entities an upstream stage in the same plan is expected to add"""
+    estimate = planned.get(stage)
+    return estimate.entities * per_entity if estimate else 0
+
+
+async def estimate_search_index(conn, planned):
+    # One set-based statement per id range; no API requests
+    return StageEstimate("search_index", 0, {})
+
+
+async def estimate_similar_anime(conn, planned):
+    # Offline matrix work over anime_genre; no API requests
+    return StageEstimate("similar_anime", 0, {})
+
+
+DUE_LINKS_COUNT = """
+    SELECT COUNT(*) FROM media m
+    LEFT JOIN media_link_check c ON c.media_id = m.media_id AND c.url = m.url
+    WHERE m.entity_type = ANY($1::text[]) AND (c.media_id IS NULL OR c.next_check_at <= NOW())
+"""
+
+
+async def estimate_link_check(conn, planned):
+    import link_checker
+
+    # HEAD requests go to the image hosts, not Jikan
+    due = await conn.fetchval(DUE_LINKS_COUNT, list(link_checker.CHECKED_TYPES))
+    return StageEstimate(
+        "link_check",
+        due,
+        {},
+        pacing_seconds=max(
+            MEAN_REQUEST_SECONDS * due / link_checker.LINK_CHECK_CONCURRENCY,
+            due / link_checker.HOST_RATE,
+        ),
+    )
+
+
+async def estimate_anime_images(conn, planned):
+    import images_test
+
+    gaps = await conn.fetchval(ANIME_WITHOUT_IMAGE_COUNT) + _new_from(planned, "anime")
+    return StageEstimate(
+        "anime_images",
+        gaps,
+        {"/anime?q=": gaps, "/anime/{id}/pictures": gaps},
+        pacing_seconds=images_test.BASE_DELAY * 1.15 * gaps / images_test.CONCURRENT_REQUESTS,
+        concurrency=images_test.CONCURRENT_REQUESTS,
+    )
+
+
+async def estimate_trailers(conn, planned):
+    import trailer_importer
+
+    gaps = await conn.fetchval(ANIME_WITHOUT_TRAILER_COUNT) + _new_from(planned, "anime")
+    return StageEstimate(
+        "trailers",
+        gaps,
+        {"/anime?q=": gaps, "/anime/{id}": gaps},
+        pacing_seconds=trailer_importer.REQUEST_DELAY * gaps,
+    )
+
+
+async def estimate_character_images(conn, planned):
+    import character_image_fetcher
+
+    gaps = (
+        await conn.fetchval(CHARACTERS_WITHOUT_IMAGE_COUNT)
+        + _new_from(planned, "characters")
+        + _new_from(planned, "anime", CHARACTERS_PER_ANIME)
+    )
+    return StageEstimate(
+        "character_images",
+        gaps,
+        {"/characters?q=": gaps, "/characters/{id}/full": gaps},
+        pacing_seconds=character_image_fetcher.REQUEST_DELAY * gaps,
+    )
+
+
+async def estimate_voice_actor_images(conn, planned):
+    import voice_actor_importer
+
+    # New voice actors mostly repeat existing ones, so only current gaps count
+    gaps = await conn.fetchval(VOICE_ACTORS_WITHOUT_IMAGE_COUNT)
+    return StageEstimate(
+        "voice_actor_images",
+        gaps,
+        {"/people?q=": gaps, "/people/{id}/full": gaps},
+        pacing_seconds=voice_actor_importer.REQUEST_DELAY * gaps,
+    )
+
+
+MEDIA_WITHOUT_MIRROR_COUNT = """
+    SELECT COUNT(*) FROM media m
+    LEFT JOIN media_mirror mm ON mm.media_id = m.media_id
+    WHERE m.media_type = 'image' AND (mm.media_id IS NULL OR mm.url <> m.url)
+"""
+
+
+async def estimate_image_mirror(conn, planned):
+    import image_mirror
+
+    # Downloads hit the image CDN, not Jikan, so they cost no API requests
+    gaps = (
+        await conn.fetchval(MEDIA_WITHOUT_MIRROR_COUNT)
+        + _new_from(planned, "anime_images")
+        + _new_from(planned, "character_images")
+        + _new_from(planned, "voice_actor_images")
+    )
+    return StageEstimate(
+        "image_mirror",
+        gaps,
+        {},
+        pacing_seconds=MEAN_REQUEST_SECONDS * gaps / image_mirror.MIRROR_CONCURRENCY,
+    )
+
+
+FILES_WITHOUT_VARIANTS_COUNT = """
+    SELECT COUNT(*) FROM media_file f
+    WHERE (SELECT COUNT(*) FROM media_variant v WHERE v.sha256 = f.sha256 AND v.variant = ANY($1::text[]))
+        < cardinality($1::text[])
+"""
+
+
+async def estimate_image_variants(conn, planned):
+    import image_variants
+
+    # Local resizing only; upstream mirror downloads are at most one new file each
+    keys = [spec.key for spec in image_variants.parse_specs()]
+    files = await conn.fetchval(FILES_WITHOUT_VARIANTS_COUNT, keys) + _new_from(planned, "image_mirror")
+    return StageEstimate(
+        "image_variants",
+        files,
+        {},
+        pacing_seconds=SECONDS_PER_VARIANT * len(keys) * files / image_variants.VARIANT_WORKERS,
+    )
+
+
+async def estimate_image_dedup(conn, planned):
+    import image_dedup
+
+    files = await conn.fetchval("SELECT COUNT(*) FROM media_file WHERE phash IS NULL")
+    files += _new_from(planned, "image_mirror")
+    return StageEstimate(
+        "image_dedup",
+        files,
+        {},
+        pacing_seconds=SECONDS_PER_VARIANT * files / image_dedup.HASH_WORKERS,
+    )
+
+
+ESTIMATORS = {
+    "reference_data": estimate_reference_data,
+    "genres": estimate_genres,
+    "companies": estimate_companies,
+    "anime": estimate_anime,
+    "characters": estimate_characters,
+    "search_index": estimate_search_index,
+    "similar_anime": estimate_similar_anime,
+    "link_check": estimate_link_check,
+    "anime_images": estimate_anime_images,
+    "trailers": estimate_trailers,
+    "character_images": estimate_character_images,
+    "voice_actor_images": estimate_voice_actor_images,
+    "image_mirror": estimate_image_mirror,
+    "image_variants": estimate_image_variants,
+    "image_dedup": estimate_image_dedup,
+}
+
+
+async def plan(conn, stage_names):
+    """Estimate each stage, in order, so later stages see upstream additions"""
+    planned = {}
+    for name in stage_names:
+        planned[name] = await ESTIMATORS[name](conn, planned)
+    return list(planned.values())
+
+
+def format_plan(estimates, rate=DEFAULT_RATE):
+    lines = [f"{'stage':<20} {'entities':>8} {'requests':>9} {'hours':>7}  endpoints"]
+    total_requests = 0
+    total_seconds = 0.0
+    for estimate in estimates:
+        seconds = estimate.seconds(rate)
+        total_requests += estimate.total_requests
+        total_seconds += seconds
+        endpoints = ", ".join(
+            f"{endpoint} {math.ceil(count)}" for endpoint, count in estimate.requests.items() if count
+        )
+        lines.append(
+            f"{estimate.stage:<20} {estimate.entities:>8} {estimate.total_requests:>9} "
+            f"{seconds / 3600:>7.2f}  {endpoints}"
+        )
+    lines.append(
+        f"{'total (sequential)':<20} {'':>8} {total_requests:>9} {total_seconds / 3600:>7.2f}"
+        f"  at {rate:g} req/s, +{RETRY_OVERHEAD:.0%} retries"
+    )
+    return "\n".join(lines)
+
+
+async def dry_run(stage_names, db_config=None, conn=None, rate=DEFAULT_RATE):
+    """Log the request plan for the given stages without calling the API"""
+    own_conn = conn is None
+    if own_conn:
+        conn = await asyncpg.connect(**db_config)
+    try:
+        estimates = await plan(conn, stage_names)
+    finally:
+        if own_conn:
+            await conn.close()
+
+    logging.info("Dry run, no requests made. Estimated cost:\n" + format_plan(estimates, rate))
+    if REQUEST_BUDGET.max_requests is not None:
+        total = sum(estimate.total_requests for estimate in estimates)
+        if total > REQUEST_BUDGET.max_requests:
+            logging.info(
+                f"A budget of {REQUEST_BUDGET.max_requests} requests covers about "
+                f"{REQUEST_BUDGET.max_requests / total:.0%} of this plan"
+            )
+    return estimates
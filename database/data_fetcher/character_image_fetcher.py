@@ -7,17 +7,17 @@ import random
 import os
 from dotenv import load_dotenv
 
+from budget import REQUEST_BUDGET
+from content_hash import replace_entity_image
+from jikan_client import client_session, entity_deadline
+from log_pipeline import setup_logging
+from metrics import instrument_connection
+import profiling
+
 load_dotenv()
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('character_image_fetcher.log'),
-        logging.StreamHandler()
-    ]
-)
+setup_logging('character_image_fetcher.log')
 
 # Database configuration
 DB_CONFIG = {
@@ -58,12 +58,14 @@ async def fetch_with_retry(session, url, retries=MAX_RETRIES):
 
 async def process_character(pool, session, char_record, semaphore=None):
     """Process a single character to fetch and store their image"""
+    if REQUEST_BUDGET.exhausted():
+        return
     # If semaphore is provided, use it, otherwise just proceed
     if semaphore is not None:
-        async with semaphore, pool.acquire() as conn:
+        async with semaphore, pool.acquire() as conn, entity_deadline():
             return await _process_character_data(conn, session, char_record)
     else:
-        async with pool.acquire() as conn:
+        async with pool.acquire() as conn, entity_deadline():
             return await _process_character_data(conn, session, char_record)
 
 async def _process_character_data(conn, session, char_record):
@@ -75,7 +77,7 @@ async def _process_character_data(conn, session, char_record):
     # Check if image already exists
     existing_image = await conn.fetchval(
         """
-        SELECT 1 FROM media 
+        SELECT 1 FROM live_media 
         WHERE entity_type = 'character' 
         AND entity_id = $1 
         AND media_type = 'image'
@@ -118,14 +120,7 @@ async def _process_character_data(conn, session, char_record):
 
     # Insert into media table
     try:
-        await conn.execute(
-            """
-            INSERT INTO media (url, entity_type, entity_id, media_type)
-            VALUES ($1, 'character', $2, 'image')
-            ON CONFLICT DO NOTHING
-            """,
-            image_url, char_id
-        )
+        await replace_entity_image(conn, 'character', char_id, image_url)
         logging.info(f"Inserted image for character {char_name}: {image_url}")
     except Exception as e:
         logging.error(f"Error inserting image for character {char_name}: {str(e)}")
@@ -133,13 +128,14 @@ async def _process_character_data(conn, session, char_record):
     # Respect rate limits - ensure at least 2 seconds between requests
     await asyncio.sleep(REQUEST_DELAY)
 
-async def fetch_character_images():
-    """Main function to fetch images for all characters without images"""
-    pool = None
+async def fetch_character_images(pool=None, session=None):
+    """Main function to fetch images for all characters without images."""
+    own_pool = pool is None
     try:
-        # Create database connection pool with minimal connections
-        pool = await asyncpg.create_pool(**DB_CONFIG, min_size=1, max_size=1)
-        logging.info("Connected to database with connection pool")
+        if own_pool:
+            # Create database connection pool with minimal connections
+            pool = await asyncpg.create_pool(**DB_CONFIG, min_size=1, max_size=1, init=instrument_connection)
+            logging.info("Connected to database with connection pool")
 
         # Get all characters without images
         async with pool.acquire() as conn:
@@ -148,7 +144,7 @@ async def fetch_character_images():
                 SELECT c.character_id, c.name
                 FROM characters c
                 WHERE NOT EXISTS (
-                    SELECT 1 FROM media m
+                    SELECT 1 FROM live_media m
                     WHERE m.entity_type = 'character'
                     AND m.entity_id = c.character_id
                     AND m.media_type = 'image'
@@ -165,7 +161,7 @@ async def fetch_character_images():
         logging.info(f"Found {len(char_records)} characters without images")
 
         # Process characters one at a time to respect rate limits
-        async with aiohttp.ClientSession() as session:
+        async with client_session(session) as session:
             for char_record in char_records:
                 await process_character(pool, session, char_record, None)
                 # Add a small delay between starting each character to avoid bursts
@@ -173,14 +169,19 @@ async def fetch_character_images():
 
     except Exception as e:
         logging.critical(f"Critical error: {str(e)}", exc_info=True)
+        if not own_pool:
+            raise
     finally:
-        if pool:
+        if pool and own_pool:
             await pool.close()
             logging.info("Database connection pool closed")
 
 if __name__ == "__main__":
+    import sys
+
+    profile_mode = profiling.pop_profile_flag(sys.argv)
     start_time = time.time()
     logging.info("===== STARTING CHARACTER IMAGE FETCH =====")
-    asyncio.run(fetch_character_images())
+    profiling.run(fetch_character_images(), profile_mode, "character_image_fetcher")
     duration = time.time() - start_time
     logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
@@ -8,15 +8,20 @@ import os
 import json
 from datetime import datetime
 
+from attribute_extractor import infer_nationality
+from budget import REQUEST_BUDGET, dry_run, pop_budget_flags
+from content_hash import replace_entity_image, upsert_entity
+from jikan_client import client_session, entity_deadline
+from log_pipeline import setup_logging
+from metrics import ENTITIES, instrument_connection
+from models import Character, as_record
+from ndjson_dump import DumpWriter, OfflineSession, RecordingSession, iter_dump
+from normalize import parse_date
+from search_index import index_entity
+import profiling
+
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('character_importer.log'),
-        logging.StreamHandler()
-    ]
-)
+setup_logging('character_importer.log')
 
 # Database configuration
 DB_CONFIG = {
@@ -70,10 +75,10 @@ async def fetch_with_retry(session, url, retries=MAX_RETRIES):
 
 async def get_or_create_voice_actor(conn, person_data):
     """Get or create voice actor in database"""
-    if not person_data or not person_data.get('name'):
+    if not person_data or not person_data.name:
         return None
         
-    va_name = person_data['name']
+    va_name = person_data.name
     va_id = await conn.fetchval(
         "SELECT voice_actor_id FROM voice_actor WHERE name = $1", 
         va_name
@@ -82,33 +87,17 @@ async def get_or_create_voice_actor(conn, person_data):
     if va_id:
         return va_id
         
-    # Extract birth date if available
-    birth_date = None
-    if person_data.get('birthday'):
-        try:
-            birth_date = datetime.strptime(person_data['birthday'], "%Y-%m-%d").date()
-        except:
-            pass
+    birth_date = parse_date(person_data.birthday)
     
     # Extract nationality if available
-    nationality = None
-    if person_data.get('about'):
-        # Simple extraction - you might want to improve this
-        about_text = person_data['about'].lower()
-        if 'japanese' in about_text or 'japan' in about_text:
-            nationality = 'Japanese'
-        elif 'american' in about_text or 'usa' in about_text:
-            nationality = 'American'
-        elif 'korean' in about_text or 'korea' in about_text:
-            nationality = 'Korean'
-        elif 'chinese' in about_text or 'china' in about_text:
-            nationality = 'Chinese'
-            
+    nationality = infer_nationality(person_data.about)
+    
     va_id = await conn.fetchval(
         "INSERT INTO voice_actor (name, birth_date, nationality) VALUES ($1, $2, $3) RETURNING voice_actor_id",
         va_name, birth_date, nationality
     )
-    logging.info(f"Created voice actor: {va_name}")
+    await index_entity(conn, 'voice_actor', va_id, {'name': va_name})
+    logging.info('Created voice actor: %s', va_name)
     return va_id
 
 async def check_character_exists(conn, mal_id):
@@ -118,104 +107,108 @@ async def check_character_exists(conn, mal_id):
     return False  # Always process for now
 
 async def process_character_from_data(conn, session, character_data):
-    """Process character from already fetched data"""
-    if not character_data or not character_data.get('name'):
+    """Process character from already fetched data (a Character or the raw payload)"""
+    character = as_record(Character, character_data)
+    character_data = None  # Only the projected fields stay alive from here on
+    if not character or not character.name:
         return False
     
-    mal_id = character_data.get('mal_id')
+    mal_id = character.mal_id
+    profiling.set_entity('character', mal_id)
+    started = time.perf_counter()
     if mal_id in processed_character_ids:
-        logging.info(f"Character {mal_id} already processed, skipping")
+        logging.info('Character %s already processed, skipping', mal_id)
         return False
     
     # Check if already exists in database
     if await check_character_exists(conn, mal_id):
-        logging.info(f"Character {mal_id} already in database, skipping")
+        logging.info('Character %s already in database, skipping', mal_id)
         processed_character_ids.add(mal_id)
         return False
     
     # Extract character information
-    character_name = character_data['name']
-    character_description = character_data.get('about', '')
+    character_name = character.name
+    character_description = character.about
     
     # Truncate description if too long (adjust as needed)
     if len(character_description) > 5000:
         character_description = character_description[:5000] + "..."
     
-    # Get voice actor information
-    voice_actor_id = None
-    voice_actors = character_data.get('voices', [])
-    
-    # Look for Japanese voice actor first
-    japanese_va = None
-    for va in voice_actors:
-        if va.get('language') == 'Japanese':
-            japanese_va = va
-            break
+    # Create the voice actor (Japanese if listed, else the first one)
+    voice_actor_id = await get_or_create_voice_actor(conn, character.voice_actor)
     
-    # If no Japanese VA, take the first one
-    if not japanese_va and voice_actors:
-        japanese_va = voice_actors[0]
+    # One transaction for the row, its image, its anime links and the fingerprint,
+    # so a failed link write can't leave a fingerprint that skips the repair
+    async with conn.transaction():
+        # Insert character, or update only the columns that changed since the last import
+        with profiling.span('write'):
+            character_id, changed = await upsert_entity(
+                conn,
+                'characters',
+                'character_id',
+                'character',
+                mal_id,
+                {
+                    'name': character_name,
+                    'description': character_description,
+                    'voice_actor_id': voice_actor_id
+                },
+                extra={
+                    'image_url': character.image_url,
+                    'animeography': sorted(
+                        f"{entry.name}:{entry.role or ''}"
+                        for entry in character.animeography
+                    )
+                }
+            )
     
-    # Create voice actor if found
-    if japanese_va and japanese_va.get('person'):
-        voice_actor_id = await get_or_create_voice_actor(conn, japanese_va['person'])
+        if not changed:
+            processed_character_ids.add(mal_id)
+            logging.info('Character %s unchanged, skipping writes', mal_id)
+            return False
     
-    # Insert character
-    character_id = await conn.fetchval(
-        """
-        INSERT INTO characters (name, description, voice_actor_id)
-        VALUES ($1, $2, $3)
-        RETURNING character_id
-        """,
-        character_name,
-        character_description,
-        voice_actor_id
-    )
+        # Add character images
+        if 'image_url' in changed and character.image_url:
+            await replace_entity_image(conn, 'character', character_id, character.image_url)
     
-    # Add character images
-    if character_data.get('images') and character_data['images'].get('jpg'):
-        image_url = character_data['images']['jpg'].get('image_url')
-        if image_url:
+        # Sync the character's anime links with its animeography
+        if 'animeography' in changed:
+            roles = {}
+            for anime_entry in character.animeography:
+                if anime_entry.mal_id:
+                    # Check if this anime exists in our database
+                    anime_db_id = await conn.fetchval(
+                        """
+                        SELECT anime_id FROM anime 
+                        WHERE title = $1 OR alternative_title = $1
+                        LIMIT 1
+                        """,
+                        anime_entry.name
+                    )
+                
+                    if anime_db_id:
+                        # Determine role (default to Supporting if not specified)
+                        roles[anime_db_id] = anime_entry.role or 'Supporting'
+            
+            # Drop links the animeography no longer lists, then add or re-role the rest
             await conn.execute(
-                """
-                INSERT INTO media (url, entity_type, entity_id, media_type)
-                VALUES ($1, 'character', $2, 'image')
-                """,
-                image_url,
-                character_id
+                "DELETE FROM anime_character WHERE character_id = $1 AND NOT (anime_id = ANY($2::int[]))",
+                character_id, list(roles)
             )
-    
-    # Link character to anime (if animeography exists)
-    if character_data.get('animeography'):
-        for anime_entry in character_data['animeography']:
-            anime_mal_id = anime_entry.get('mal_id')
-            if anime_mal_id:
-                # Check if this anime exists in our database
-                anime_db_id = await conn.fetchval(
+            if roles:
+                await conn.execute(
                     """
-                    SELECT anime_id FROM anime 
-                    WHERE title = $1 OR alternative_title = $1
-                    LIMIT 1
+                    INSERT INTO anime_character (anime_id, character_id, role)
+                    SELECT u.anime_id, $1, u.role
+                    FROM unnest($2::int[], $3::text[]) AS u(anime_id, role)
+                    ON CONFLICT (anime_id, character_id) DO UPDATE SET role = EXCLUDED.role
+                    WHERE anime_character.role IS DISTINCT FROM EXCLUDED.role
                     """,
-                    anime_entry.get('name', '')
+                    character_id, list(roles), list(roles.values())
                 )
-                
-                if anime_db_id:
-                    # Determine role (default to Supporting if not specified)
-                    role = anime_entry.get('role', 'Supporting')
-                    
-                    # Insert anime-character relationship
-                    await conn.execute(
-                        """
-                        INSERT INTO anime_character (anime_id, character_id, role)
-                        VALUES ($1, $2, $3)
-                        ON CONFLICT (anime_id, character_id) DO NOTHING
-                        """,
-                        anime_db_id, character_id, role
-                    )
     
     processed_character_ids.add(mal_id)
-    logging.info(f"Processed character MAL ID {mal_id} -> DB ID {character_id} ({character_name})")
+    logging.info('Processed character MAL ID %s -> DB ID %s (%s)', mal_id, character_id, character_name, extra={'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)})
     return True
 
 async def fetch_character_list(session, page=1, order_by='favorites', sort='desc'):
@@ -261,21 +254,33 @@ async def save_state(page, processed_count, processed_ids):
     with open(STATE_FILE, 'w') as f:
         json.dump(state, f, indent=2)
 
-async def import_character_data():
-    """Main function to import character data using pagination"""
+async def import_character_data(export_path=None, conn=None, session=None):
+    """
+    Main function to import character data using pagination.
+    
+    With export_path set, every payload fetched for a processed character is
+    also appended to that NDJSON dump for later offline runs.
+    """
     global processed_character_ids
     
     # Load state
     current_page, processed_count, processed_character_ids = await load_state()
-    logging.info(f"Starting character import from page {current_page}, already processed {processed_count} characters")
+    logging.info('Starting character import from page %s, already processed %s characters', current_page, processed_count)
     
-    conn = None
+    own_conn = conn is None
+    dump_writer = DumpWriter(export_path) if export_path else None
     try:
         # Connect to database
-        conn = await asyncpg.connect(**DB_CONFIG)
-        logging.info("Connected to database")
+        if own_conn:
+            conn = await asyncpg.connect(**DB_CONFIG)
+            await instrument_connection(conn)
+            logging.info("Connected to database")
         
-        async with aiohttp.ClientSession() as session:
+        async with client_session(session) as session:
+            if dump_writer:
+                dump_writer.open()
+                session = RecordingSession(session)
+            
             consecutive_empty_pages = 0
             max_empty_pages = 3  # Stop if we get 3 consecutive empty pages
             
@@ -308,30 +313,52 @@ async def import_character_data():
                 for character_data in character_list:
                     if processed_count >= TARGET_CHARACTER_COUNT:
                         break
+                    if REQUEST_BUDGET.exhausted():
+                        break
                     
                     try:
-                        # Get character MAL ID
-                        mal_id = character_data.get('mal_id')
-                        if not mal_id:
-                            continue
+                        with entity_deadline():
+                            # Get character MAL ID
+                            mal_id = character_data.get('mal_id')
+                            if not mal_id:
+                                continue
+                            profiling.set_entity('character', mal_id)
+                                
+                            # Get full character data
+                            if dump_writer:
+                                session.drain()
+                            full_character_data = await fetch_character_full(session, mal_id)
                             
-                        # Get full character data
-                        full_character_data = await fetch_character_full(session, mal_id)
-                        
-                        if full_character_data and 'data' in full_character_data:
-                            success = await process_character_from_data(conn, session, full_character_data['data'])
-                            if success:
-                                processed_count += 1
-                                page_processed_count += 1
-                                logging.info(f"Progress: {processed_count}/{TARGET_CHARACTER_COUNT} characters imported")
+                            if full_character_data and 'data' in full_character_data:
+                                # The raw payload is only kept for the dump
+                                payload = full_character_data['data']
+                                character = Character.from_payload(payload)
+                                if not dump_writer:
+                                    full_character_data = payload = None
+                                success = await process_character_from_data(conn, session, character)
+                                ENTITIES.inc(kind='character', result='imported' if success else 'skipped')
+                                if success:
+                                    processed_count += 1
+                                    page_processed_count += 1
+                                    logging.info('Progress: %s/%s characters imported', processed_count, TARGET_CHARACTER_COUNT)
+                                
+                                if dump_writer:
+                                    related = session.drain()
+                                    related.pop(f"{JIKAN_BASE_URL}/characters/{mal_id}/full", None)
+                                    dump_writer.write('character', payload, related)
                         
                         # Small delay between character processing
                         await asyncio.sleep(0.5)
                         
                     except Exception as e:
+                        ENTITIES.inc(kind='character', result='error')
                         logging.error(f"Error processing character {character_data.get('name', 'Unknown')}: {str(e)}")
                         continue
                 
+                # Out of budget
+                if REQUEST_BUDGET.exhausted():
+                    break
+
                 # Save progress after each page
                 await save_state(current_page, processed_count, processed_character_ids)
                 
@@ -353,11 +380,16 @@ async def import_character_data():
                 
     except Exception as e:
         logging.critical(f"Critical error: {str(e)}")
+        if not own_conn:
+            raise
     finally:
-        if conn:
+        if conn and own_conn:
             await conn.close()
             logging.info("Database connection closed")
         
+        if dump_writer:
+            dump_writer.close()
+        
         # Final save
         await save_state(current_page, processed_count, processed_character_ids)
         logging.info(f"Character import completed. Total characters imported: {processed_count}")
@@ -371,9 +403,10 @@ async def import_top_characters():
     conn = None
     try:
         conn = await asyncpg.connect(**DB_CONFIG)
+        await instrument_connection(conn)
         logging.info("Connected to database")
         
-        async with aiohttp.ClientSession() as session:
+        async with client_session() as session:
             # You can also import specific popular characters by ID
             # Popular character IDs (you can find these from MAL or Jikan)
             popular_character_ids = [
@@ -409,20 +442,66 @@ async def import_top_characters():
             await conn.close()
         logging.info(f"Top characters import completed. Imported {processed_count} characters.")
 
+async def import_characters_from_dump(dump_path):
+    """Import characters from an NDJSON dump without touching the API"""
+    processed_count = 0
+    conn = None
+    try:
+        conn = await asyncpg.connect(**DB_CONFIG)
+        await instrument_connection(conn)
+        logging.info("Connected to database")
+        
+        for record in iter_dump(dump_path, kind='character'):
+            try:
+                success = await process_character_from_data(conn, OfflineSession(record), record['data'])
+                if success:
+                    processed_count += 1
+            except Exception as e:
+                logging.error(f"Error processing character {record['data'].get('name', 'Unknown')}: {str(e)}")
+                continue
+                
+    except Exception as e:
+        logging.critical(f"Critical error: {str(e)}")
+    finally:
+        if conn:
+            await conn.close()
+            logging.info("Database connection closed")
+        logging.info(f"Dump import completed. Total characters imported: {processed_count}")
+
 if __name__ == "__main__":
     import sys
     
-    if len(sys.argv) > 1 and sys.argv[1] == "top":
+    profile_mode = profiling.pop_profile_flag(sys.argv)
+    is_dry_run = pop_budget_flags(sys.argv)
+    
+    if is_dry_run:
+        # Estimate requests and time without calling the API
+        asyncio.run(dry_run(['characters'], DB_CONFIG))
+    elif len(sys.argv) > 2 and sys.argv[1] == "load":
+        # Rebuild from a local dump instead of the API
+        logging.info("===== STARTING CHARACTER IMPORT (FROM DUMP) =====")
+        start_time = time.time()
+        profiling.run(import_characters_from_dump(sys.argv[2]), profile_mode, "character_importer")
+        duration = time.time() - start_time
+        logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
+    elif len(sys.argv) > 2 and sys.argv[1] == "export":
+        # Regular paginated import that also captures payloads into a dump
+        logging.info("===== STARTING CHARACTER IMPORT (PAGINATED, EXPORTING) =====")
+        start_time = time.time()
+        profiling.run(import_character_data(export_path=sys.argv[2]), profile_mode, "character_importer")
+        duration = time.time() - start_time
+        logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
+    elif len(sys.argv) > 1 and sys.argv[1] == "top":
         # Run top characters import
         logging.info("===== STARTING TOP CHARACTERS IMPORT =====")
         start_time = time.time()
-        asyncio.run(import_top_characters())
+        profiling.run(import_top_characters(), profile_mode, "character_importer")
         duration = time.time() - start_time
         logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
     else:
         # Run regular paginated import
         logging.info("===== STARTING CHARACTER IMPORT (PAGINATED) =====")
         start_time = time.time()
-        asyncio.run(import_character_data())
+        profiling.run(import_character_data(), profile_mode, "character_importer")
         duration = time.time() - start_time
         logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
\ No newline at end of file
@@ -8,15 +8,20 @@ import os
 import json
 from datetime import datetime
 
+from attribute_extractor import guess_countries_from_names, infer_country
+from budget import REQUEST_BUDGET, dry_run, pop_budget_flags
+from content_hash import get_fingerprint, upsert_entity
+from jikan_client import client_session, entity_deadline
+from log_pipeline import setup_logging
+from metrics import ENTITIES, instrument_connection
+from models import Producer, as_record
+from ndjson_dump import DumpWriter, OfflineSession, RecordingSession, iter_dump
+from normalize import parse_date, parse_dates
+from reference_loader import load_reference_data
+import profiling
+
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('company_importer.log'),
-        logging.StreamHandler()
-    ]
-)
+setup_logging('company_importer.log')
 
 # Database configuration
 DB_CONFIG = {
@@ -76,21 +81,32 @@ async def check_company_exists(conn, mal_id, name):
     )
     return company_id is not None
 
-async def process_company_from_data(conn, session, company_data):
-    """Process company from fetched data"""
-    if not company_data or not company_data.get('name'):
+async def process_company_from_data(conn, session, company_data, name_guess=None, founded=None):
+    """
+    Process company from fetched data (a Producer or the raw list entry).
+    
+    name_guess is the country guessed from the company name and founded the
+    parsed established date, when the caller already extracted them for the
+    whole page.
+    """
+    company = as_record(Producer, company_data)
+    if not company or not company.name:
         return False
     
-    mal_id = company_data.get('mal_id')
-    company_name = company_data['name']
+    mal_id = company.mal_id
+    profiling.set_entity('company', mal_id)
+    started = time.perf_counter()
+    company_name = company.name
     
     if mal_id in processed_company_ids:
-        logging.info(f"Company {mal_id} ({company_name}) already processed, skipping")
+        logging.info('Company %s (%s) already processed, skipping', mal_id, company_name)
         return False
     
-    # Check if already exists in database
-    if await check_company_exists(conn, mal_id, company_name):
-        logging.info(f"Company {mal_id} ({company_name}) already in database, skipping")
+    # Companies we imported before are refreshed through their fingerprint;
+    # rows created elsewhere (anime studios, major studios) are left alone
+    fingerprint = await get_fingerprint(conn, 'company', mal_id) if mal_id else None
+    if not fingerprint and await check_company_exists(conn, mal_id, company_name):
+        logging.info('Company %s (%s) already in database, skipping', mal_id, company_name)
         processed_company_ids.add(mal_id)
         return False
     
@@ -100,76 +116,43 @@ async def process_company_from_data(conn, session, company_data):
         try:
             full_company_url = f"{JIKAN_BASE_URL}/producers/{mal_id}/full"
             full_company_data = await fetch_with_retry(session, full_company_url)
-            if full_company_data:
-                full_company_data = full_company_data.get('data', {})
+            if full_company_data and full_company_data.get('data'):
+                full_company_data = Producer.from_payload(full_company_data['data'])
+            else:
+                full_company_data = None
         except Exception as e:
             logging.warning(f"Could not fetch full data for company {mal_id}: {str(e)}")
     
-    # Extract company information
-    company_name = company_data['name']
-    
-    # Try to extract country and founded date from full data
-    country = None
-    founded_date = None
-    
-    if full_company_data:
-        # Extract country from about text (simple heuristic)
-        about_text = full_company_data.get('about', '').lower()
-        if 'japan' in about_text or 'japanese' in about_text:
-            country = 'Japan'
-        elif 'usa' in about_text or 'united states' in about_text or 'american' in about_text:
-            country = 'United States'
-        elif 'korea' in about_text or 'korean' in about_text:
-            country = 'South Korea'
-        elif 'china' in about_text or 'chinese' in about_text:
-            country = 'China'
-        elif 'france' in about_text or 'french' in about_text:
-            country = 'France'
-        elif 'germany' in about_text or 'german' in about_text:
-            country = 'Germany'
-        elif 'uk' in about_text or 'britain' in about_text or 'british' in about_text:
-            country = 'United Kingdom'
-        
-        # Try to extract founded date (this is quite basic, might need improvement)
-        established_text = full_company_data.get('established', '')
-        if established_text:
-            try:
-                # Try different date formats
-                for date_format in ['%Y-%m-%d', '%Y/%m/%d', '%Y-%m', '%Y']:
-                    try:
-                        founded_date = datetime.strptime(established_text[:len(date_format)], date_format).date()
-                        break
-                    except:
-                        continue
-            except:
-                pass
+    # Country from the about text, else the name, else Japan
+    country, country_confidence = infer_country(
+        full_company_data.about if full_company_data else '', company_name, name_guess
+    )
     
-    # If we don't have country from full data, make educated guesses based on name
-    if not country:
-        # Most anime companies are Japanese
-        if any(indicator in company_name.lower() for indicator in ['studio', 'animation', 'toei', 'madhouse', 'bones', 'shaft', 'wit', 'mappa']):
-            country = 'Japan'
-        elif any(indicator in company_name.lower() for indicator in ['disney', 'warner', 'fox', 'universal']):
-            country = 'United States'
+    # Founded date from the page, else the full data ("2001-04-03T00:00:00+00:00", "2001-04", ...)
+    founded_date = founded or (parse_date(full_company_data.established) if full_company_data else None)
     
-    # Default to Japan if still no country (most anime companies are Japanese)
-    if not country:
-        country = 'Japan'
+    # Insert company, or update only the columns that changed since the last import
+    with profiling.span('write'):
+        company_id, changed = await upsert_entity(
+            conn,
+            'company',
+            'company_id',
+            'company',
+            mal_id,
+            {
+                'name': company_name,
+                'country': country,
+                'founded': founded_date
+            }
+        )
     
-    # Insert company
-    company_id = await conn.fetchval(
-        """
-        INSERT INTO company (name, country, founded)
-        VALUES ($1, $2, $3)
-        RETURNING company_id
-        """,
-        company_name,
-        country,
-        founded_date
-    )
+    if not changed:
+        processed_company_ids.add(mal_id)
+        logging.info('Company %s (%s) unchanged, skipping writes', mal_id, company_name)
+        return False
     
     processed_company_ids.add(mal_id)
-    logging.info(f"Processed company MAL ID {mal_id} -> DB ID {company_id} ({company_name}, {country})")
+    logging.info('Processed company MAL ID %s -> DB ID %s (%s, %s)', mal_id, company_id, company_name, country, extra={'country_confidence': round(country_confidence, 2), 'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)})
     return True
 
 async def fetch_company_list(session, page=1):
@@ -210,21 +193,33 @@ async def save_state(page, processed_count, processed_ids):
     with open(STATE_FILE, 'w') as f:
         json.dump(state, f, indent=2)
 
-async def import_company_data():
-    """Main function to import company data using pagination"""
+async def import_company_data(export_path=None, conn=None, session=None):
+    """
+    Main function to import company data using pagination.
+    
+    With export_path set, every payload fetched for a processed company is
+    also appended to that NDJSON dump for later offline runs.
+    """
     global processed_company_ids
     
     # Load state
     current_page, processed_count, processed_company_ids = await load_state()
-    logging.info(f"Starting company import from page {current_page}, already processed {processed_count} companies")
+    logging.info('Starting company import from page %s, already processed %s companies', current_page, processed_count)
     
-    conn = None
+    own_conn = conn is None
+    dump_writer = DumpWriter(export_path) if export_path else None
     try:
         # Connect to database
-        conn = await asyncpg.connect(**DB_CONFIG)
-        logging.info("Connected to database")
+        if own_conn:
+            conn = await asyncpg.connect(**DB_CONFIG)
+            await instrument_connection(conn)
+            logging.info("Connected to database")
         
-        async with aiohttp.ClientSession() as session:
+        async with client_session(session) as session:
+            if dump_writer:
+                dump_writer.open()
+                session = RecordingSession(session)
+            
             consecutive_empty_pages = 0
             max_empty_pages = 3  # Stop if we get 3 consecutive empty pages
             
@@ -253,25 +248,46 @@ async def import_company_data():
                 consecutive_empty_pages = 0  # Reset counter
                 page_processed_count = 0
                 
+                # Name-based country guesses for the whole page in one scan
+                name_guesses = guess_countries_from_names(
+                    [company_data.get('name') for company_data in company_list]
+                )
+                
+                founded_dates = parse_dates([company_data.get('established') for company_data in company_list])
+                
                 # Process each company in the page
-                for company_data in company_list:
+                for company_data, name_guess, founded in zip(company_list, name_guesses, founded_dates):
                     if processed_count >= TARGET_COMPANY_COUNT:
                         break
+                    if REQUEST_BUDGET.exhausted():
+                        break
                     
                     try:
-                        success = await process_company_from_data(conn, session, company_data)
-                        if success:
-                            processed_count += 1
-                            page_processed_count += 1
-                            logging.info(f"Progress: {processed_count}/{TARGET_COMPANY_COUNT} companies imported")
+                        with entity_deadline():
+                            if dump_writer:
+                                session.drain()
+                            success = await process_company_from_data(conn, session, company_data, name_guess, founded)
+                            ENTITIES.inc(kind='company', result='imported' if success else 'skipped')
+                            if success:
+                                processed_count += 1
+                                page_processed_count += 1
+                                logging.info('Progress: %s/%s companies imported', processed_count, TARGET_COMPANY_COUNT)
+                            
+                            if dump_writer:
+                                dump_writer.write('company', company_data, session.drain())
                         
                         # Small delay between company processing
                         await asyncio.sleep(0.3)
                         
                     except Exception as e:
+                        ENTITIES.inc(kind='company', result='error')
                         logging.error(f"Error processing company {company_data.get('name', 'Unknown')}: {str(e)}")
                         continue
                 
+                # Out of budget
+                if REQUEST_BUDGET.exhausted():
+                    break
+
                 # Save progress after each page
                 await save_state(current_page, processed_count, processed_company_ids)
                 
@@ -293,117 +309,96 @@ async def import_company_data():
                 
     except Exception as e:
         logging.critical(f"Critical error: {str(e)}")
+        if not own_conn:
+            raise
     finally:
-        if conn:
+        if conn and own_conn:
             await conn.close()
             logging.info("Database connection closed")
         
+        if dump_writer:
+            dump_writer.close()
+        
         # Final save
         await save_state(current_page, processed_count, processed_company_ids)
         logging.info(f"Company import completed. Total companies imported: {processed_count}")
 
 async def import_major_studios():
-    """Import major well-known anime studios with predefined data"""
-    major_studios = [
-        {"name": "Studio Ghibli", "country": "Japan", "founded": "1985-06-15"},
-        {"name": "Toei Animation", "country": "Japan", "founded": "1948-01-23"},
-        {"name": "Madhouse", "country": "Japan", "founded": "1972-10-17"},
-        {"name": "Bones", "country": "Japan", "founded": "1998-10-01"},
-        {"name": "Shaft", "country": "Japan", "founded": "1975-09-01"},
-        {"name": "WIT Studio", "country": "Japan", "founded": "2012-06-01"},
-        {"name": "MAPPA", "country": "Japan", "founded": "2011-06-14"},
-        {"name": "Pierrot", "country": "Japan", "founded": "1979-05-08"},
-        {"name": "A-1 Pictures", "country": "Japan", "founded": "2005-05-09"},
-        {"name": "Production I.G", "country": "Japan", "founded": "1987-12-15"},
-        {"name": "Sunrise", "country": "Japan", "founded": "1972-09-01"},
-        {"name": "Trigger", "country": "Japan", "founded": "2011-08-22"},
-        {"name": "Kyoto Animation", "country": "Japan", "founded": "1981-07-12"},
-        {"name": "Gainax", "country": "Japan", "founded": "1984-12-24"},
-        {"name": "Gonzo", "country": "Japan", "founded": "1992-09-06"},
-        {"name": "J.C.Staff", "country": "Japan", "founded": "1986-01-18"},
-        {"name": "Lerche", "country": "Japan", "founded": "2011-08-17"},
-        {"name": "White Fox", "country": "Japan", "founded": "2007-04-01"},
-        {"name": "Ufotable", "country": "Japan", "founded": "2000-10-01"},
-        {"name": "CloverWorks", "country": "Japan", "founded": "2018-04-01"},
-        {"name": "Silver Link", "country": "Japan", "founded": "2007-12-01"},
-        {"name": "Bind", "country": "Japan", "founded": "2019-01-01"},
-        {"name": "8bit", "country": "Japan", "founded": "2008-09-01"},
-        {"name": "Doga Kobo", "country": "Japan", "founded": "1973-08-01"},
-        {"name": "Brain's Base", "country": "Japan", "founded": "1996-02-01"},
-        {"name": "Passione", "country": "Japan", "founded": "2011-01-01"},
-        {"name": "Orange", "country": "Japan", "founded": "2004-10-01"},
-        {"name": "Studio Deen", "country": "Japan", "founded": "1975-01-14"},
-        {"name": "TMS Entertainment", "country": "Japan", "founded": "1964-10-01"},
-        {"name": "Xebec", "country": "Japan", "founded": "1995-05-01"}
-    ]
-    
+    """Import major well-known anime studios (reference_data/studios.json)"""
     conn = None
     try:
         conn = await asyncpg.connect(**DB_CONFIG)
+        await instrument_connection(conn)
         logging.info("Connected to database for major studios import")
         
-        imported_count = 0
-        for studio_data in major_studios:
+        await load_reference_data(conn, ['studios'])
+        
+    except Exception as e:
+        logging.critical(f"Critical error in major studios import: {str(e)}")
+    finally:
+        if conn:
+            await conn.close()
+
+async def import_companies_from_dump(dump_path):
+    """Import companies from an NDJSON dump without touching the API"""
+    processed_count = 0
+    conn = None
+    try:
+        conn = await asyncpg.connect(**DB_CONFIG)
+        await instrument_connection(conn)
+        logging.info("Connected to database")
+        
+        for record in iter_dump(dump_path, kind='company'):
             try:
-                # Check if company already exists
-                exists = await conn.fetchval(
-                    "SELECT COUNT(*) FROM company WHERE name = $1",
-                    studio_data['name']
-                )
-                
-                if exists > 0:
-                    logging.info(f"Major studio '{studio_data['name']}' already exists, skipping")
-                    continue
-                
-                # Parse founded date
-                founded_date = None
-                if studio_data.get('founded'):
-                    try:
-                        founded_date = datetime.strptime(studio_data['founded'], '%Y-%m-%d').date()
-                    except:
-                        pass
-                
-                # Insert major studio
-                company_id = await conn.fetchval(
-                    """
-                    INSERT INTO company (name, country, founded)
-                    VALUES ($1, $2, $3)
-                    RETURNING company_id
-                    """,
-                    studio_data['name'],
-                    studio_data['country'],
-                    founded_date
-                )
-                
-                imported_count += 1
-                logging.info(f"Imported major studio: {studio_data['name']} (ID: {company_id})")
-                
+                success = await process_company_from_data(conn, OfflineSession(record), record['data'])
+                if success:
+                    processed_count += 1
             except Exception as e:
-                logging.error(f"Error importing major studio {studio_data['name']}: {str(e)}")
+                logging.error(f"Error processing company {record['data'].get('name', 'Unknown')}: {str(e)}")
                 continue
-        
-        logging.info(f"Major studios import completed. Imported {imported_count} major studios.")
-        
+                
     except Exception as e:
-        logging.critical(f"Critical error in major studios import: {str(e)}")
+        logging.critical(f"Critical error: {str(e)}")
     finally:
         if conn:
             await conn.close()
+            logging.info("Database connection closed")
+        logging.info(f"Dump import completed. Total companies imported: {processed_count}")
 
 if __name__ == "__main__":
     import sys
     
-    if len(sys.argv) > 1 and sys.argv[1] == "major":
+    profile_mode = profiling.pop_profile_flag(sys.argv)
+    is_dry_run = pop_budget_flags(sys.argv)
+    
+    if is_dry_run:
+        # Estimate requests and time without calling the API
+        asyncio.run(dry_run(['companies'], DB_CONFIG))
+    elif len(sys.argv) > 2 and sys.argv[1] == "load":
+        # Rebuild from a local dump instead of the API
+        logging.info("===== STARTING COMPANY IMPORT (FROM DUMP) =====")
+        start_time = time.time()
+        profiling.run(import_companies_from_dump(sys.argv[2]), profile_mode, "company_importer")
+        duration = time.time() - start_time
+        logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
+    elif len(sys.argv) > 2 and sys.argv[1] == "export":
+        # Regular company import that also captures payloads into a dump
+        logging.info("===== STARTING COMPANY IMPORT (PAGINATED, EXPORTING) =====")
+        start_time = time.time()
+        profiling.run(import_company_data(export_path=sys.argv[2]), profile_mode, "company_importer")
+        duration = time.time() - start_time
+        logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
+    elif len(sys.argv) > 1 and sys.argv[1] == "major":
         # Run major studios import
         logging.info("===== STARTING MAJOR STUDIOS IMPORT =====")
         start_time = time.time()
-        asyncio.run(import_major_studios())
+        profiling.run(import_major_studios(), profile_mode, "company_importer")
         duration = time.time() - start_time
         logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
     else:
         # Run regular company import
         logging.info("===== STARTING COMPANY IMPORT (PAGINATED) =====")
         start_time = time.time()
-        asyncio.run(import_company_data())
+        profiling.run(import_company_data(), profile_mode, "company_importer")
         duration = time.time() - start_time
         logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import logging
+
+from search_index import index_changed
+
+# Fingerprints are keyed by (entity_type, source_id) where source_id is the
+# Jikan/MAL id of the entity. Each importer only hashes the fields it writes,
+# so two importers persisting different subsets of the same entity (e.g. the
+# anime importer's character stubs and the character importer's full rows)
+# don't keep overwriting each other.
+
+
+def _hash_value(value):
+    """Stable short hash of a single normalized field value"""
+    encoded = json.dumps(value, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()[:16]
+
+
+def compute_field_hashes(fields):
+    """Hash every field of a normalized record"""
+    return {name: _hash_value(value) for name, value in fields.items()}
+
+
+def compute_content_hash(field_hashes):
+    """Combine per-field hashes into one hash for the whole entity"""
+    encoded = json.dumps(field_hashes, sort_keys=True)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+async def get_fingerprint(conn, entity_type, source_id):
+    """Load the stored fingerprint for an entity, or None if never imported"""
+    row = await conn.fetchrow(
+        """
+        SELECT entity_id, content_hash, field_hashes
+        FROM import_fingerprint
+        WHERE entity_type = $1 AND source_id = $2
+        """,
+        entity_type,
+        source_id,
+    )
+    if not row:
+        return None
+    field_hashes = row["field_hashes"]
+    if isinstance(field_hashes, str):
+        field_hashes = json.loads(field_hashes)
+    return {
+        "entity_id": row["entity_id"],
+        "content_hash": row["content_hash"],
+        "field_hashes": field_hashes or {},
+    }
+
+
+async def save_fingerprint(conn, entity_type, source_id, entity_id, field_hashes):
+    """Insert or replace the fingerprint of an entity"""
+    await conn.execute(
+        """
+        INSERT INTO import_fingerprint (entity_type, source_id, entity_id, content_hash, field_hashes)
+        VALUES ($1, $2, $3, $4, $5::jsonb)
+        ON CONFLICT (entity_type, source_id) DO UPDATE
+        SET entity_id = EXCLUDED.entity_id,
+            content_hash = EXCLUDED.content_hash,
+            field_hashes = EXCLUDED.field_hashes,
+            updated_at = NOW(),
+            checked_at = NOW()
+        """,
+        entity_type,
+        source_id,
+        entity_id,
+        compute_content_hash(field_hashes),
+        json.dumps(field_hashes, sort_keys=True),
+    )
+
+
+async def mark_checked(conn, entity_type, source_id):
+    """Record that an entity was re-fetched, whether or not it changed"""
+    await conn.execute(
+        """
+        UPDATE import_fingerprint SET checked_at = NOW()
+        WHERE entity_type = $1 AND source_id = $2
+        """,
+        entity_type,
+        source_id,
+    )
+
+
+async def upsert_entity(
+    conn,
+    table,
+    id_column,
+    entity_type,
+    source_id,
+    columns,
+    extra=None,
+    insert_only=None,
+    existing_id=None,
+):
+    """
+    Write an entity only if the fields we persist have changed.
+
+    `columns` maps table columns to their normalized values, `extra` holds
+    hashed values that live outside the row (genre names, image URL, ...) and
+    `insert_only` holds columns written on first insert but never diffed.
+    `existing_id` adopts a row created by something else (for example a
+    company created by name from an anime's studio) when no fingerprint exists.
+
+    Returns (entity_id, changed) where `changed` is the set of field names
+    that differ from the stored fingerprint - empty when the entity was
+    skipped, every field when it was inserted or adopted. Changed names and
+    titles are re-indexed for search.
+
+    The fingerprint already covers `extra`, so callers that write those
+    values elsewhere (links, images) run this and those writes in one
+    transaction; otherwise a failed link write is never retried.
+    """
+    extra = extra or {}
+    insert_only = insert_only or {}
+    new_hashes = compute_field_hashes({**columns, **extra})
+
+    fingerprint = None
+    if source_id is not None:
+        fingerprint = await get_fingerprint(conn, entity_type, source_id)
+
+    if fingerprint:
+        entity_id = fingerprint["entity_id"]
+        stored = fingerprint["field_hashes"]
+        changed = {name for name, h in new_hashes.items() if stored.get(name) != h}
+        if not changed:
+            return entity_id, changed
+
+        changed_columns = [name for name in columns if name in changed]
+        if changed_columns:
+            assignments = ", ".join(
+                f"{name} = ${i + 2}" for i, name in enumerate(changed_columns)
+            )
+            await conn.execute(
+                f"UPDATE {table} SET {assignments} WHERE {id_column} = $1",
+                entity_id,
+                *[columns[name] for name in changed_columns],
+            )
+        await save_fingerprint(
+            conn, entity_type, source_id, entity_id, {**stored, **new_hashes}
+        )
+        await index_changed(conn, entity_type, entity_id, columns, changed)
+        logging.debug(
+            f"Updated {entity_type} {source_id} columns: {', '.join(sorted(changed))}"
+        )
+        return entity_id, changed
+
+    if existing_id is not None:
+        entity_id = existing_id
+        names = list(columns)
+        assignments = ", ".join(f"{name} = ${i + 2}" for i, name in enumerate(names))
+        await conn.execute(
+            f"UPDATE {table} SET {assignments} WHERE {id_column} = $1",
+            entity_id,
+            *[columns[name] for name in names],
+        )
+    else:
+        row = {**columns, **insert_only}
+        names = list(row)
+        placeholders = ", ".join(f"${i + 1}" for i in range(len(names)))
+        entity_id = await conn.fetchval(
+            f"INSERT INTO {table} ({', '.join(names)}) VALUES ({placeholders}) "
+            f"RETURNING {id_column}",
+            *[row[name] for name in names],
+        )
+
+    if source_id is not None:
+        await save_fingerprint(conn, entity_type, source_id, entity_id, new_hashes)
+    await index_changed(conn, entity_type, entity_id, columns, new_hashes)
+    return entity_id, set(new_hashes)
+
+
+async def replace_entity_image(conn, entity_type, entity_id, url):
+    """
+    Point the entity's primary image at a new URL, inserting it if missing.
+
+    A row the link checker marked dead is updated in place: the dead mark
+    belongs to the old URL, so the row is back in live_media and the new URL
+    is checked from scratch.
+    """
+    updated = await conn.execute(
+        """
+        UPDATE media SET url = $3
+        WHERE media_id = (
+            SELECT media_id FROM media
+            WHERE entity_type = $1 AND entity_id = $2 AND media_type = 'image'
+            ORDER BY media_id
+            LIMIT 1
+        )
+        AND url IS DISTINCT FROM $3
+        """,
+        entity_type,
+        entity_id,
+        url,
+    )
+    if updated != "UPDATE 0":
+        return
+    exists = await conn.fetchval(
+        """
+        SELECT 1 FROM media
+        WHERE entity_type = $1 AND entity_id = $2 AND media_type = 'image'
+        LIMIT 1
+        """,
+        entity_type,
+        entity_id,
+    )
+    if not exists:
+        await conn.execute(
+            """
+            INSERT INTO media (url, entity_type, entity_id, media_type)
+            VALUES ($1, $2, $3, 'image')
+            """,
+            url,
+            entity_type,
+            entity_id,
+        )
@@ -0,0 +1,300 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import signal
+import time
+from datetime import timedelta
+
+import asyncpg
+
+from content_hash import mark_checked
+from jikan_client import (
+    InstrumentedSession,
+    RateLimitedSession,
+    RateLimiter,
+    entity_deadline,
+    open_session,
+)
+from metrics import ENTITIES, METRICS_PORT, QUEUE_DEPTH, instrument_connection, metrics_server
+from models import Anime
+from orchestrator import DB_CONFIG
+
+# Steady request budget, well under Jikan's burst limit so the daemon can
+# run next to ad-hoc imports
+DAEMON_RATE = 1.0  # Requests per second
+DAEMON_WORKERS = 2
+POOL_MAX_SIZE = 4
+
+DISCOVERY_INTERVAL = 600  # Seconds between scans for new work
+DISCOVERY_BATCH = 200  # Max items queued per kind per scan
+REFRESH_AFTER_HOURS = 24 * 7  # Anime older than this are due for a refresh
+POPULARITY_WEIGHT = 4.0  # How much a top rank multiplies urgency
+GAP_PRIORITY = 10.0  # Base urgency of missing images/trailers
+GAP_RETRY_AFTER = 24 * 3600  # Don't re-try a gap that found nothing for a day
+
+
+def popularity(rank):
+    """Map rank to 0..1, 1 being the most popular title"""
+    if not rank or rank < 1:
+        return 0.0
+    return 1.0 / math.log2(rank + 1)
+
+
+def refresh_priority(age_hours, rank):
+    """Urgency of refreshing an entity: staleness boosted by popularity"""
+    return (age_hours / REFRESH_AFTER_HOURS) * (1 + POPULARITY_WEIGHT * popularity(rank))
+
+
+def gap_priority(rank=None):
+    """Urgency of a backfill gap, popular titles first"""
+    return GAP_PRIORITY * (1 + POPULARITY_WEIGHT * popularity(rank))
+
+
+class WorkQueue:
+    """Priority queue of (kind, key) work items, each queued at most once"""
+
+    def __init__(self):
+        self._heap = []
+        self._queued = set()
+        self._counter = itertools.count()
+        self._available = asyncio.Event()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, priority, kind, key, record):
+        if (kind, key) in self._queued:
+            return False
+        self._queued.add((kind, key))
+        heapq.heappush(self._heap, (-priority, next(self._counter), kind, key, record))
+        QUEUE_DEPTH.inc(queue=kind)
+        self._available.set()
+        return True
+
+    async def pop(self):
+        while not self._heap:
+            self._available.clear()
+            await self._available.wait()
+        _, _, kind, key, record = heapq.heappop(self._heap)
+        self._queued.discard((kind, key))
+        QUEUE_DEPTH.dec(queue=kind)
+        return kind, key, record
+
+
+# Discovery queries: each returns the rows to queue for one kind of work
+
+STALE_ANIME_QUERY = """
+    SELECT f.source_id AS mal_id, a.anime_id, a.title, a.rank,
+           EXTRACT(EPOCH FROM NOW() - f.checked_at) / 3600 AS age_hours
+    FROM import_fingerprint f
+    JOIN anime a ON a.anime_id = f.entity_id
+    WHERE f.entity_type = 'anime' AND f.checked_at < NOW() - $1::interval
+    ORDER BY f.checked_at
+    LIMIT $2
+"""
+
+ANIME_WITHOUT_IMAGE_QUERY = """
+    SELECT a.anime_id, a.title, a.rank
+    FROM anime a
+    WHERE NOT EXISTS (
+        SELECT 1 FROM live_media m
+        WHERE m.entity_type = 'anime'
+        AND m.entity_id = a.anime_id
+        AND m.media_type = 'image'
+    )
+    ORDER BY a.rank NULLS LAST
+    LIMIT $1
+"""
+
+ANIME_WITHOUT_TRAILER_QUERY = """
+    SELECT anime_id, title, rank
+    FROM anime
+    WHERE trailer_url_yt_id IS NULL OR trailer_url_yt_id = ''
+    ORDER BY rank NULLS LAST
+    LIMIT $1
+"""
+
+CHARACTERS_WITHOUT_IMAGE_QUERY = """
+    SELECT c.character_id, c.name
+    FROM characters c
+    WHERE NOT EXISTS (
+        SELECT 1 FROM live_media m
+        WHERE m.entity_type = 'character'
+        AND m.entity_id = c.character_id
+        AND m.media_type = 'image'
+    )
+    ORDER BY c.character_id
+    LIMIT $1
+"""
+
+VOICE_ACTORS_WITHOUT_IMAGE_QUERY = """
+    SELECT v.voice_actor_id, v.name
+    FROM voice_actor v
+    WHERE NOT EXISTS (
+        SELECT 1 FROM live_media m
+        WHERE m.entity_type = 'voice_actor'
+        AND m.entity_id = v.voice_actor_id
+        AND m.media_type = 'image'
+    )
+    ORDER BY v.voice_actor_id
+    LIMIT $1
+"""
+
+
+class ImporterDaemon:
+    """Keeps one pool, one session and warm importer state between refreshes"""
+
+    def __init__(self, pool, session, workers=DAEMON_WORKERS):
+        self.pool = pool
+        self.session = session
+        self.workers = workers
+        self.queue = WorkQueue()
+        self.stopping = asyncio.Event()
+        # (kind, key) -> monotonic time before which a gap isn't re-queued
+        self._gap_retry_at = {}
+        self._image_semaphore = asyncio.Semaphore(1)
+        self.completed = 0
+
+    def _queue_gap(self, kind, key, record, priority):
+        if self._gap_retry_at.get((kind, key), 0) > time.monotonic():
+            return False
+        return self.queue.push(priority, kind, key, record)
+
+    async def discover(self):
+        """Scan the database for stale entities and backfill gaps"""
+        queued = 0
+        async with self.pool.acquire() as conn:
+            for row in await conn.fetch(
+                STALE_ANIME_QUERY, timedelta(hours=REFRESH_AFTER_HOURS), DISCOVERY_BATCH
+            ):
+                priority = refresh_priority(float(row["age_hours"]), row["rank"])
+                queued += self.queue.push(priority, "anime_refresh", row["mal_id"], dict(row))
+
+            for row in await conn.fetch(ANIME_WITHOUT_IMAGE_QUERY, DISCOVERY_BATCH):
+                queued += self._queue_gap(
+                    "anime_image", row["anime_id"], dict(row), gap_priority(row["rank"])
+                )
+
+            for row in await conn.fetch(ANIME_WITHOUT_TRAILER_QUERY, DISCOVERY_BATCH):
+                queued += self._queue_gap(
+                    "trailer", row["anime_id"], dict(row), gap_priority(row["rank"])
+                )
+
+            for row in await conn.fetch(CHARACTERS_WITHOUT_IMAGE_QUERY, DISCOVERY_BATCH):
+                queued += self._queue_gap(
+                    "character_image", row["character_id"], dict(row), gap_priority()
+                )
+
+            for row in await conn.fetch(VOICE_ACTORS_WITHOUT_IMAGE_QUERY, DISCOVERY_BATCH):
+                queued += self._queue_gap(
+                    "voice_actor_image", row["voice_actor_id"], dict(row), gap_priority()
+                )
+
+        logging.info(f"Discovery queued {queued} new items ({len(self.queue)} pending)")
+
+    async def refresh_anime(self, record):
+        import anime_importer
+
+        mal_id = record["mal_id"]
+        full_anime_data = await anime_importer.fetch_with_retry(
+            self.session, f"{anime_importer.JIKAN_BASE_URL}/anime/{mal_id}/full"
+        )
+        if not full_anime_data or "data" not in full_anime_data:
+            return
+        anime = Anime.from_payload(full_anime_data["data"])
+        full_anime_data = None
+        # The importer skips ids it has seen in this process; a refresh must not
+        anime_importer.processed_anime_ids.discard(mal_id)
+        async with self.pool.acquire() as conn:
+            await anime_importer.process_anime_from_data(conn, self.session, anime)
+            await mark_checked(conn, "anime", mal_id)
+
+    async def fill_anime_image(self, record):
+        import images_test
+
+        await images_test.process_anime(self.pool, self.session, record, self._image_semaphore)
+
+    async def fill_trailer(self, record):
+        import trailer_importer
+
+        await trailer_importer.process_anime_trailer(self.pool, self.session, record)
+
+    async def fill_character_image(self, record):
+        import character_image_fetcher
+
+        await character_image_fetcher.process_character(self.pool, self.session, record)
+
+    async def fill_voice_actor_image(self, record):
+        import voice_actor_importer
+
+        await voice_actor_importer.process_voice_actor(self.pool, self.session, record)
+
+    async def handle(self, kind, key, record):
+        handlers = {
+            "anime_refresh": self.refresh_anime,
+            "anime_image": self.fill_anime_image,
+            "trailer": self.fill_trailer,
+            "character_image": self.fill_character_image,
+            "voice_actor_image": self.fill_voice_actor_image,
+        }
+        await handlers[kind](record)
+        if kind != "anime_refresh":
+            # If the gap is still open next scan, the source had nothing for it
+            self._gap_retry_at[(kind, key)] = time.monotonic() + GAP_RETRY_AFTER
+
+    async def worker(self, worker_id):
+        while not self.stopping.is_set():
+            kind, key, record = await self.queue.pop()
+            try:
+                with entity_deadline():
+                    await self.handle(kind, key, record)
+                self.completed += 1
+                ENTITIES.inc(kind=kind, result="ok")
+            except Exception as e:
+                ENTITIES.inc(kind=kind, result="error")
+                logging.error(f"Worker {worker_id} failed on {kind} {key}: {str(e)}")
+
+    async def discovery_loop(self):
+        while not self.stopping.is_set():
+            try:
+                await self.discover()
+            except Exception as e:
+                logging.error(f"Discovery failed: {str(e)}")
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=DISCOVERY_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        tasks = [asyncio.create_task(self.discovery_loop())]
+        tasks += [asyncio.create_task(self.worker(i)) for i in range(self.workers)]
+        await self.stopping.wait()
+        logging.info(f"Stopping daemon after {self.completed} completed items")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def run_daemon(rate=DAEMON_RATE, workers=DAEMON_WORKERS, metrics_port=METRICS_PORT):
+    """Run the importer daemon until SIGINT/SIGTERM"""
+    async with metrics_server(metrics_port):
+        pool = await asyncpg.create_pool(
+            **DB_CONFIG, min_size=1, max_size=POOL_MAX_SIZE, init=instrument_connection
+        )
+        logging.info("Connected to database with connection pool")
+        try:
+            async with open_session(workers) as session:
+                limited = RateLimitedSession(InstrumentedSession(session), RateLimiter(rate))
+                daemon = ImporterDaemon(pool, limited, workers)
+                loop = asyncio.get_running_loop()
+                for sig in (signal.SIGINT, signal.SIGTERM):
+                    try:
+                        loop.add_signal_handler(sig, daemon.stopping.set)
+                    except NotImplementedError:  # Windows
+                        pass
+                await daemon.run()
+        finally:
+            await pool.close()
+            logging.info("Database connection pool closed")
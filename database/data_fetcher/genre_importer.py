@@ -8,15 +8,18 @@ import os
 import json
 from datetime import datetime
 
+from budget import dry_run, pop_budget_flags
+from content_hash import compute_content_hash, compute_field_hashes
+from jikan_client import client_session
+from log_pipeline import setup_logging
+from metrics import ENTITIES, instrument_connection
+from models import Genre, as_record
+from ndjson_dump import DumpWriter, iter_dump
+from reference_loader import load_reference_data
+import profiling
+
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('genre_importer.log'),
-        logging.StreamHandler()
-    ]
-)
+setup_logging('genre_importer.log')
 
 # Database configuration
 DB_CONFIG = {
@@ -66,52 +69,77 @@ async def fetch_with_retry(session, url, retries=MAX_RETRIES):
     logging.error(f"Failed after {retries} attempts for {url}")
     return None
 
-async def check_genre_exists(conn, mal_id, name):
-    """Check if genre already exists in database"""
-    # Check by name since we don't store MAL ID for genres
-    genre_id = await conn.fetchval(
-        "SELECT genre_id FROM genre WHERE name = $1", 
-        name
-    )
-    return genre_id is not None
-
-async def process_genre_from_data(conn, genre_data):
-    """Process genre from fetched data"""
-    if not genre_data or not genre_data.get('name'):
-        return False
-    
-    mal_id = genre_data.get('mal_id')
-    genre_name = genre_data['name']
-    
-    if mal_id in processed_genre_ids:
-        logging.info(f"Genre {mal_id} ({genre_name}) already processed, skipping")
-        return False
-    
-    # Check if already exists in database
-    if await check_genre_exists(conn, mal_id, genre_name):
-        logging.info(f"Genre {mal_id} ({genre_name}) already in database, skipping")
-        processed_genre_ids.add(mal_id)
-        return False
-    
-    # Create description from available data
-    description = f"Genre with {genre_data.get('count', 0)} anime entries"
-    if genre_data.get('url'):
-        description += f". MAL URL: {genre_data['url']}"
-    
-    # Insert genre
-    genre_id = await conn.fetchval(
-        """
+# One statement applies the whole genre list: new names are inserted and
+# every existing genre of the same name - including rows created by the anime
+# importer or seeded from reference data - gets its description, which
+# carries the entry count, refreshed when it changed. Fingerprints of every
+# written row are saved in the same round trip, so those rows are adopted.
+SYNC_GENRES = """
+    WITH incoming AS (
+        SELECT *
+        FROM unnest($1::text[], $2::int[], $3::text[], $4::text[], $5::text[], $6::text[])
+            AS t(entity_type, source_id, name, description, content_hash, field_hashes)
+    ),
+    written AS (
         INSERT INTO genre (name, description)
-        VALUES ($1, $2)
-        RETURNING genre_id
-        """,
-        genre_name,
-        description
+        SELECT name, description FROM incoming
+        ON CONFLICT (name) DO UPDATE SET description = EXCLUDED.description
+        WHERE genre.description IS DISTINCT FROM EXCLUDED.description
+        RETURNING genre_id, name, xmax = 0 AS inserted
+    ),
+    fingerprinted AS (
+        INSERT INTO import_fingerprint (entity_type, source_id, entity_id, content_hash, field_hashes)
+        SELECT i.entity_type, i.source_id, w.genre_id, i.content_hash, i.field_hashes::jsonb
+        FROM written w
+        JOIN incoming i ON i.name = w.name
+        WHERE i.source_id IS NOT NULL
+        ON CONFLICT (entity_type, source_id) DO UPDATE
+        SET entity_id = EXCLUDED.entity_id,
+            content_hash = EXCLUDED.content_hash,
+            field_hashes = EXCLUDED.field_hashes,
+            updated_at = NOW(),
+            checked_at = NOW()
     )
+    SELECT genre_id, name, inserted FROM written
+"""
+
+def merge_genres(anime_genres, manga_genres):
+    """
+    Anime genres plus the manga genres whose name no anime genre has, as
+    (entity_type, Genre) pairs with one entry per name.
+    """
+    merged = {}
+    # Anime and manga genre ids overlap, so fingerprints are kept apart
+    for entity_type, genres in (('genre', anime_genres), ('manga_genre', manga_genres)):
+        for genre_data in genres or []:
+            genre = as_record(Genre, genre_data)
+            if genre and genre.name and genre.name not in merged:
+                merged[genre.name] = (entity_type, genre)
+    return list(merged.values())
+
+async def sync_genres(conn, merged):
+    """Write merged genres in one round trip; returns the written (genre_id, name, inserted) rows"""
+    columns = ([], [], [], [], [], [])
+    for entity_type, genre in merged:
+        # Create description from available data
+        description = f"Genre with {genre.count} anime entries"
+        if genre.url:
+            description += f". MAL URL: {genre.url}"
+        
+        # Same hashes upsert_entity would store for these columns
+        field_hashes = compute_field_hashes({'name': genre.name, 'description': description})
+        for column, value in zip(columns, (
+            entity_type,
+            genre.mal_id,
+            genre.name,
+            description,
+            compute_content_hash(field_hashes),
+            json.dumps(field_hashes, sort_keys=True),
+        )):
+            column.append(value)
     
-    processed_genre_ids.add(mal_id)
-    logging.info(f"Processed genre MAL ID {mal_id} -> DB ID {genre_id} ({genre_name})")
-    return True
+    with profiling.span('write'):
+        return await conn.fetch(SYNC_GENRES, *columns)
 
 async def fetch_anime_genres(session):
     """Fetch anime genres from Jikan API"""
@@ -144,145 +172,86 @@ async def save_state(processed_count, processed_ids):
     with open(STATE_FILE, 'w') as f:
         json.dump(state, f, indent=2)
 
-async def import_genre_data():
-    """Main function to import genre data"""
+async def import_genre_data(export_path=None, conn=None, session=None):
+    """
+    Main function to import genre data.
+    
+    With export_path set, the fetched genre lists are also appended to that
+    NDJSON dump for later offline runs.
+    """
     global processed_genre_ids
     
     # Load state
     processed_count, processed_genre_ids = await load_state()
-    logging.info(f"Starting genre import, already processed {processed_count} genres")
+    logging.info('Starting genre import, already processed %s genres', processed_count)
     
-    conn = None
+    own_conn = conn is None
+    dump_writer = DumpWriter(export_path) if export_path else None
     try:
         # Connect to database
-        conn = await asyncpg.connect(**DB_CONFIG)
-        logging.info("Connected to database")
+        if own_conn:
+            conn = await asyncpg.connect(**DB_CONFIG)
+            await instrument_connection(conn)
+            logging.info("Connected to database")
         
-        async with aiohttp.ClientSession() as session:
-            total_processed = processed_count
-            
-            # Fetch anime genres
-            logging.info("Fetching anime genres...")
-            anime_genres_data = await fetch_anime_genres(session)
-            
-            if anime_genres_data and 'data' in anime_genres_data:
-                anime_genres = anime_genres_data['data']
-                logging.info(f"Found {len(anime_genres)} anime genres")
-                
-                for genre_data in anime_genres:
-                    try:
-                        success = await process_genre_from_data(conn, genre_data)
-                        if success:
-                            total_processed += 1
-                            logging.info(f"Progress: {total_processed} genres imported")
-                        
-                        # Small delay between genre processing
-                        await asyncio.sleep(0.2)
-                        
-                    except Exception as e:
-                        logging.error(f"Error processing genre {genre_data.get('name', 'Unknown')}: {str(e)}")
-                        continue
-            
-            # Add a delay between anime and manga genres
-            await asyncio.sleep(1)
-            
-            # Fetch manga genres (some might be unique and relevant)
-            logging.info("Fetching manga genres...")
-            manga_genres_data = await fetch_manga_genres(session)
-            
-            if manga_genres_data and 'data' in manga_genres_data:
-                manga_genres = manga_genres_data['data']
-                logging.info(f"Found {len(manga_genres)} manga genres")
-                
-                for genre_data in manga_genres:
-                    try:
-                        # Add a prefix to distinguish manga-specific genres if needed
-                        genre_name = genre_data.get('name', '')
-                        
-                        # Skip if this genre name already exists (likely imported from anime genres)
-                        if await check_genre_exists(conn, genre_data.get('mal_id'), genre_name):
-                            continue
-                        
-                        success = await process_genre_from_data(conn, genre_data)
-                        if success:
-                            total_processed += 1
-                            logging.info(f"Progress: {total_processed} genres imported")
-                        
-                        # Small delay between genre processing
-                        await asyncio.sleep(0.2)
-                        
-                    except Exception as e:
-                        logging.error(f"Error processing manga genre {genre_data.get('name', 'Unknown')}: {str(e)}")
-                        continue
-            
-            # Save final state
-            await save_state(total_processed, processed_genre_ids)
+        if dump_writer:
+            dump_writer.open()
+        
+        async with client_session(session) as session:
+            # Both lists at once; the genre stage is only these two requests
+            logging.info("Fetching anime and manga genres...")
+            anime_genres_data, manga_genres_data = await asyncio.gather(
+                fetch_anime_genres(session), fetch_manga_genres(session)
+            )
+        
+        anime_genres = (anime_genres_data or {}).get('data') or []
+        manga_genres = (manga_genres_data or {}).get('data') or []
+        logging.info(f"Found {len(anime_genres)} anime genres and {len(manga_genres)} manga genres")
+        
+        if dump_writer:
+            for genre_data in anime_genres:
+                dump_writer.write('genre', genre_data)
+            for genre_data in manga_genres:
+                dump_writer.write('manga_genre', genre_data)
+        
+        merged = merge_genres(anime_genres, manga_genres)
+        written = await sync_genres(conn, merged)
+        
+        inserted = sum(1 for row in written if row['inserted'])
+        ENTITIES.inc(inserted, kind='genre', result='imported')
+        ENTITIES.inc(len(written) - inserted, kind='genre', result='updated')
+        ENTITIES.inc(len(merged) - len(written), kind='genre', result='skipped')
+        logging.info(f"Genre sync: {inserted} inserted, {len(written) - inserted} updated, {len(merged) - len(written)} unchanged")
+        
+        total_processed = processed_count + inserted
+        processed_genre_ids.update(genre.mal_id for _, genre in merged if genre.mal_id)
+        
+        # Save final state
+        await save_state(total_processed, processed_genre_ids)
             
     except Exception as e:
         logging.critical(f"Critical error: {str(e)}")
+        if not own_conn:
+            raise
     finally:
-        if conn:
+        if conn and own_conn:
             await conn.close()
             logging.info("Database connection closed")
         
+        if dump_writer:
+            dump_writer.close()
+        
         logging.info(f"Genre import completed. Total genres imported: {len(processed_genre_ids)}")
 
 async def import_custom_genres():
-    """Import additional custom genres that might not be in MAL but are common in anime"""
-    custom_genres = [
-        {"name": "Isekai", "description": "Stories involving characters transported to another world"},
-        {"name": "Mecha", "description": "Anime featuring giant robots or mechanical suits"},
-        {"name": "Magical Girl", "description": "Stories featuring girls with magical powers"},
-        {"name": "Idol", "description": "Anime about pop idols and their careers"},
-        {"name": "CGDCT", "description": "Cute Girls Doing Cute Things"},
-        {"name": "Battle Royale", "description": "Survival competitions with multiple participants"},
-        {"name": "Time Loop", "description": "Stories involving repeated time periods"},
-        {"name": "Reverse Harem", "description": "One female character surrounded by multiple male characters"},
-        {"name": "Otome", "description": "Stories targeted at young women, often romantic"},
-        {"name": "Josei", "description": "Anime targeted at adult women"},
-        {"name": "Seinen", "description": "Anime targeted at adult men"},
-        {"name": "Shoujo", "description": "Anime targeted at young girls"},
-        {"name": "Shounen", "description": "Anime targeted at young boys"},
-        {"name": "Kodomomuke", "description": "Anime targeted at children"}
-    ]
-    
+    """Import custom genres (reference_data/custom_genres.json) that might not be in MAL but are common in anime"""
     conn = None
     try:
         conn = await asyncpg.connect(**DB_CONFIG)
+        await instrument_connection(conn)
         logging.info("Connected to database for custom genres import")
         
-        imported_count = 0
-        for genre_data in custom_genres:
-            try:
-                # Check if genre already exists
-                exists = await conn.fetchval(
-                    "SELECT COUNT(*) FROM genre WHERE name = $1",
-                    genre_data['name']
-                )
-                
-                if exists > 0:
-                    logging.info(f"Custom genre '{genre_data['name']}' already exists, skipping")
-                    continue
-                
-                # Insert custom genre
-                genre_id = await conn.fetchval(
-                    """
-                    INSERT INTO genre (name, description)
-                    VALUES ($1, $2)
-                    RETURNING genre_id
-                    """,
-                    genre_data['name'],
-                    genre_data['description']
-                )
-                
-                imported_count += 1
-                logging.info(f"Imported custom genre: {genre_data['name']} (ID: {genre_id})")
-                
-            except Exception as e:
-                logging.error(f"Error importing custom genre {genre_data['name']}: {str(e)}")
-                continue
-        
-        logging.info(f"Custom genres import completed. Imported {imported_count} custom genres.")
+        await load_reference_data(conn, ['custom_genres'])
         
     except Exception as e:
         logging.critical(f"Critical error in custom genres import: {str(e)}")
@@ -290,20 +259,68 @@ async def import_custom_genres():
         if conn:
             await conn.close()
 
+async def import_genres_from_dump(dump_path):
+    """Import anime and manga genres from an NDJSON dump without touching the API"""
+    processed_count = 0
+    conn = None
+    try:
+        conn = await asyncpg.connect(**DB_CONFIG)
+        await instrument_connection(conn)
+        logging.info("Connected to database")
+        
+        anime_genres = []
+        manga_genres = []
+        for record in iter_dump(dump_path):
+            if record.get('kind') == 'genre':
+                anime_genres.append(record['data'])
+            elif record.get('kind') == 'manga_genre':
+                manga_genres.append(record['data'])
+        
+        written = await sync_genres(conn, merge_genres(anime_genres, manga_genres))
+        processed_count = sum(1 for row in written if row['inserted'])
+                
+    except Exception as e:
+        logging.critical(f"Critical error: {str(e)}")
+    finally:
+        if conn:
+            await conn.close()
+            logging.info("Database connection closed")
+        logging.info(f"Dump import completed. Total genres imported: {processed_count}")
+
 if __name__ == "__main__":
     import sys
     
-    if len(sys.argv) > 1 and sys.argv[1] == "custom":
+    profile_mode = profiling.pop_profile_flag(sys.argv)
+    is_dry_run = pop_budget_flags(sys.argv)
+    
+    if is_dry_run:
+        # Estimate requests and time without calling the API
+        asyncio.run(dry_run(['genres'], DB_CONFIG))
+    elif len(sys.argv) > 2 and sys.argv[1] == "load":
+        # Rebuild from a local dump instead of the API
+        logging.info("===== STARTING GENRE IMPORT (FROM DUMP) =====")
+        start_time = time.time()
+        profiling.run(import_genres_from_dump(sys.argv[2]), profile_mode, "genre_importer")
+        duration = time.time() - start_time
+        logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
+    elif len(sys.argv) > 2 and sys.argv[1] == "export":
+        # Regular genre import that also captures payloads into a dump
+        logging.info("===== STARTING GENRE IMPORT (EXPORTING) =====")
+        start_time = time.time()
+        profiling.run(import_genre_data(export_path=sys.argv[2]), profile_mode, "genre_importer")
+        duration = time.time() - start_time
+        logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
+    elif len(sys.argv) > 1 and sys.argv[1] == "custom":
         # Run custom genres import
         logging.info("===== STARTING CUSTOM GENRES IMPORT =====")
         start_time = time.time()
-        asyncio.run(import_custom_genres())
+        profiling.run(import_custom_genres(), profile_mode, "genre_importer")
         duration = time.time() - start_time
         logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
     else:
         # Run regular genre import
         logging.info("===== STARTING GENRE IMPORT =====")
         start_time = time.time()
-        asyncio.run(import_genre_data())
+        profiling.run(import_genre_data(), profile_mode, "genre_importer")
         duration = time.time() - start_time
         logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import asyncpg
+
+from image_mirror import MIRROR_DIR
+from metrics import IMAGE_DUPLICATES, instrument_connection
+
+try:
+    from PIL import Image
+except ImportError:  # Only the hashing step needs Pillow
+    Image = None
+
+# Near-duplicate image detection across media rows.
+#
+# images_test adds the first /pictures image of an anime that may already
+# have a poster from anime_importer, and characters reached by several
+# importers can collect the same picture more than once, often re-encoded or
+# resized so the files differ. Each mirrored file gets a 64-bit difference
+# hash (dHash), computed in a process pool and stored in media_file.phash
+# (a BIGINT). Images of one entity whose hashes are within HAMMING_THRESHOLD
+# bits of each other are collapsed to the oldest media row. An entity only
+# has a handful of images, so they are compared pairwise in Python; no index
+# is involved, since a btree can't answer Hamming-distance queries.
+
+HAMMING_THRESHOLD = int(os.getenv("IMAGE_DEDUP_THRESHOLD", 6))  # Differing bits out of 64
+HASH_WORKERS = int(os.getenv("IMAGE_DEDUP_WORKERS", os.cpu_count() or 1))
+HASH_BATCH_SIZE = 500  # Files hashed and recorded per round trip
+HASH_SIZE = 8  # 8x8 gradient bits
+
+UNHASHED_FILES = """
+    SELECT sha256, local_path
+    FROM media_file
+    WHERE phash IS NULL AND sha256 > $1
+    ORDER BY sha256
+    LIMIT $2
+"""
+
+SAVE_HASHES = """
+    UPDATE media_file f
+    SET phash = u.phash
+    FROM unnest($1::text[], $2::bigint[]) AS u(sha256, phash)
+    WHERE f.sha256 = u.sha256
+"""
+
+# Hashed images of every entity that has more than one image
+ENTITY_IMAGES = """
+    SELECT m.entity_type, m.entity_id, m.media_id, f.phash
+    FROM media m
+    JOIN media_mirror mm ON mm.media_id = m.media_id AND mm.url = m.url
+    JOIN media_file f ON f.sha256 = mm.sha256
+    WHERE m.media_type = 'image'
+    AND f.phash IS NOT NULL
+    AND (m.entity_type, m.entity_id) IN (
+        SELECT entity_type, entity_id FROM media
+        WHERE media_type = 'image'
+        GROUP BY entity_type, entity_id
+        HAVING COUNT(*) > 1
+    )
+    ORDER BY m.entity_type, m.entity_id, m.media_id
+"""
+
+
+def dhash(path, size=HASH_SIZE):
+    """
+    64-bit difference hash of an image (runs in a worker process).
+
+    Each bit says whether a pixel of the grayscale image, shrunk to
+    (size + 1) x size, is brighter than its right neighbour. Returned as a
+    signed int so it fits a BIGINT column.
+    """
+    with Image.open(path) as image:
+        pixels = list(image.convert("L").resize((size + 1, size), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def hash_file(sha256, local_path, mirror_dir=MIRROR_DIR):
+    """(sha256, hash or None, error) for one mirrored file"""
+    try:
+        return sha256, dhash(os.path.join(mirror_dir, local_path)), None
+    except (OSError, ValueError) as e:
+        return sha256, None, str(e)
+
+
+def hamming(a, b):
+    """Number of differing bits between two 64-bit hashes"""
+    return ((a ^ b) & 0xFFFFFFFFFFFFFFFF).bit_count()
+
+
+def near_duplicates(images, threshold=HAMMING_THRESHOLD):
+    """
+    media_ids to drop from one entity's (media_id, phash) list, oldest first.
+
+    Every image within `threshold` bits of an image that is kept is a
+    duplicate of it; an entity rarely has more than a handful of images, so
+    comparing against the kept ones is enough.
+    """
+    kept = []
+    duplicates = []
+    for media_id, phash in images:
+        if any(hamming(phash, kept_hash) <= threshold for kept_hash in kept):
+            duplicates.append(media_id)
+        else:
+            kept.append(phash)
+    return duplicates
+
+
+async def hash_files(conn, workers=HASH_WORKERS, mirror_dir=MIRROR_DIR):
+    """Hash every mirrored file that has no phash yet; returns how many were stored"""
+    loop = asyncio.get_running_loop()
+    last_sha256 = ""
+    total = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            files = await conn.fetch(UNHASHED_FILES, last_sha256, HASH_BATCH_SIZE)
+            if not files:
+                break
+            last_sha256 = files[-1]["sha256"]
+            results = await asyncio.gather(
+                *(
+                    loop.run_in_executor(executor, hash_file, f["sha256"], f["local_path"], mirror_dir)
+                    for f in files
+                )
+            )
+            hashed = [(sha256, phash) for sha256, phash, _ in results if phash is not None]
+            for sha256, _, error in results:
+                if error:
+                    logging.warning(f"Could not hash {sha256}: {error}")
+            if hashed:
+                await conn.execute(SAVE_HASHES, *(list(column) for column in zip(*hashed)))
+            total += len(hashed)
+            logging.info(f"Hashed {total} mirrored images")
+    return total
+
+
+async def find_duplicates(conn, threshold=HAMMING_THRESHOLD):
+    """media_ids of near-duplicate images, across every entity"""
+    duplicates = []
+    group_key = None
+    group = []
+    for record in await conn.fetch(ENTITY_IMAGES):
+        key = (record["entity_type"], record["entity_id"])
+        if key != group_key:
+            duplicates.extend(near_duplicates(group, threshold))
+            group_key, group = key, []
+        group.append((record["media_id"], record["phash"]))
+    duplicates.extend(near_duplicates(group, threshold))
+    return duplicates
+
+
+async def dedup_images(pool=None, db_config=None, collapse=True, threshold=HAMMING_THRESHOLD):
+    """Hash new mirrored files, then collapse near-duplicate images per entity"""
+    if Image is None:
+        raise RuntimeError("Pillow is required to hash images (pip install Pillow)")
+    own_pool = pool is None
+    if own_pool:
+        pool = await asyncpg.create_pool(**db_config, min_size=1, max_size=2, init=instrument_connection)
+    start_time = time.time()
+    try:
+        async with pool.acquire() as conn:
+            await hash_files(conn)
+            duplicates = await find_duplicates(conn, threshold)
+            IMAGE_DUPLICATES.inc(len(duplicates))
+            if duplicates and collapse:
+                # Cascades to the mirror and link check rows; the files stay
+                await conn.execute("DELETE FROM media WHERE media_id = ANY($1::int[])", duplicates)
+    finally:
+        if own_pool:
+            await pool.close()
+    action = "removed" if collapse else "found"
+    logging.info(
+        f"Image dedup: {len(duplicates)} near-duplicate images {action} in {time.time() - start_time:.2f}s"
+    )
+    return duplicates
+
+
+async def main(collapse=True, threshold=HAMMING_THRESHOLD):
+    from orchestrator import DB_CONFIG
+
+    await dedup_images(db_config=DB_CONFIG, collapse=collapse, threshold=threshold)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import profiling
+    from log_pipeline import setup_logging
+
+    parser = argparse.ArgumentParser(description="Collapse near-duplicate images per entity")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the duplicates")
+    parser.add_argument(
+        "--threshold", type=int, default=HAMMING_THRESHOLD, help="Max differing bits of a duplicate"
+    )
+    args = parser.parse_args()
+
+    setup_logging("image_dedup.log")
+    profiling.run(main(collapse=not args.dry_run, threshold=args.threshold), name="image_dedup")
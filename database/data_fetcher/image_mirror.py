@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import struct
+import time
+
+import aiohttp
+import asyncpg
+
+from jikan_client import open_session
+from metrics import MIRROR_BYTES, MIRRORED_IMAGES, instrument_connection
+
+# Local mirror of the images the `media` rows point at.
+#
+# Files are stored content-addressed under MIRROR_DIR as
+# ab/cd/abcd...<sha256>.jpg, so the same picture referenced by several media
+# rows (or several URLs) is kept once. media_file holds one row per stored
+# file (path, size, format, dimensions) and media_mirror maps each media row
+# to its file, together with the URL it was mirrored from: rows without a
+# mirror, or whose URL has changed since, are picked up by the next run.
+
+MIRROR_DIR = os.getenv("IMAGE_MIRROR_DIR", "image_mirror")
+MIRROR_CONCURRENCY = int(os.getenv("IMAGE_MIRROR_CONCURRENCY", 8))  # Connections per image host
+MIRROR_BATCH_SIZE = 200  # Media rows read and recorded per round trip
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+MAX_RETRIES = 3
+
+PENDING_MEDIA = """
+    SELECT m.media_id, m.url
+    FROM media m
+    LEFT JOIN media_mirror mm ON mm.media_id = m.media_id
+    WHERE m.media_type = 'image'
+    AND m.media_id > $1
+    AND (mm.media_id IS NULL OR mm.url <> m.url)
+    ORDER BY m.media_id
+    LIMIT $2
+"""
+
+# URLs another media row already mirrored need no download
+MIRRORED_URLS = """
+    SELECT DISTINCT ON (url) url, sha256
+    FROM media_mirror
+    WHERE url = ANY($1::text[])
+    ORDER BY url, mirrored_at DESC
+"""
+
+SAVE_FILES = """
+    INSERT INTO media_file (sha256, local_path, byte_size, format, width, height)
+    SELECT * FROM unnest($1::text[], $2::text[], $3::int[], $4::text[], $5::int[], $6::int[])
+    ON CONFLICT (sha256) DO NOTHING
+"""
+
+SAVE_MIRRORS = """
+    INSERT INTO media_mirror (media_id, url, sha256)
+    SELECT * FROM unnest($1::int[], $2::text[], $3::text[])
+    ON CONFLICT (media_id) DO UPDATE
+    SET url = EXCLUDED.url,
+        sha256 = EXCLUDED.sha256,
+        mirrored_at = NOW()
+"""
+
+_JPEG_FRAME_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def image_info(data):
+    """(format, width, height) read from an image's header; unknown parts are None"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        width, height = struct.unpack(">II", data[16:24])
+        return "png", width, height
+    if data[:6] in (b"GIF87a", b"GIF89a") and len(data) >= 10:
+        width, height = struct.unpack("<HH", data[6:10])
+        return "gif", width, height
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP" and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b"VP8 ":
+            width, height = struct.unpack("<HH", data[26:30])
+            return "webp", width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L":
+            bits = int.from_bytes(data[21:25], "little")
+            return "webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":
+            width = int.from_bytes(data[24:27], "little") + 1
+            height = int.from_bytes(data[27:30], "little") + 1
+            return "webp", width, height
+        return "webp", None, None
+    if data[:2] == b"\xff\xd8":
+        offset = 2
+        while offset + 9 <= len(data):
+            if data[offset] != 0xFF:
+                break
+            marker = data[offset + 1]
+            if marker == 0xFF:  # Fill byte
+                offset += 1
+                continue
+            length = struct.unpack(">H", data[offset + 2 : offset + 4])[0]
+            if marker in _JPEG_FRAME_MARKERS:
+                height, width = struct.unpack(">HH", data[offset + 5 : offset + 9])
+                return "jpeg", width, height
+            offset += 2 + length
+        return "jpeg", None, None
+    return None, None, None
+
+
+def file_path(sha256, image_format):
+    """Path of a stored file, relative to MIRROR_DIR"""
+    extension = {"jpeg": "jpg"}.get(image_format, image_format or "bin")
+    return os.path.join(sha256[:2], sha256[2:4], f"{sha256}.{extension}")
+
+
+def store(data, mirror_dir=MIRROR_DIR):
+    """
+    Write an image under its content hash unless that file exists already.
+
+    Returns (sha256, relative path, size, format, width, height) and whether
+    the file was new.
+    """
+    sha256 = hashlib.sha256(data).hexdigest()
+    image_format, width, height = image_info(data)
+    relative = file_path(sha256, image_format)
+    path = os.path.join(mirror_dir, relative)
+    if os.path.exists(path):
+        return (sha256, relative, len(data), image_format, width, height), False
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.{os.getpid()}.part"
+    with open(partial, "wb") as f:
+        f.write(data)
+    os.replace(partial, path)  # Readers never see half a file
+    return (sha256, relative, len(data), image_format, width, height), True
+
+
+async def download(session, url, retries=MAX_RETRIES):
+    """The image body, or None if it can't be fetched"""
+    for attempt in range(retries):
+        try:
+            async with session.get(url) as response:
+                if response.status == 429 or response.status >= 500:
+                    wait_time = min(2 * (2 ** attempt), 30) * random.uniform(0.8, 1.2)
+                    logging.warning(f"HTTP {response.status} for {url}, retrying in {wait_time:.1f}s")
+                    await asyncio.sleep(wait_time)
+                    continue
+                if response.status != 200:
+                    logging.warning(f"HTTP {response.status} for {url}")
+                    return None
+                if (response.content_length or 0) > MAX_IMAGE_BYTES:
+                    logging.warning(f"Skipping {url}: {response.content_length} bytes")
+                    return None
+                return await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning(f"Network error (attempt {attempt + 1}/{retries}) for {url}: {str(e)}")
+            await asyncio.sleep(2 ** attempt)
+    logging.error(f"Failed after {retries} attempts for {url}")
+    return None
+
+
+async def mirror_url(session, url, semaphore, mirror_dir=MIRROR_DIR):
+    """Download one URL into the mirror; returns its media_file row or None"""
+    async with semaphore:
+        data = await download(session, url)
+    if data is None:
+        MIRRORED_IMAGES.inc(result="failed")
+        return None
+    row, new = await asyncio.to_thread(store, data, mirror_dir)
+    if new:
+        MIRROR_BYTES.inc(len(data))
+    MIRRORED_IMAGES.inc(result="downloaded" if new else "duplicate")
+    return row
+
+
+async def mirror_batch(conn, session, rows, semaphore, mirror_dir=MIRROR_DIR):
+    """Mirror one batch of (media_id, url) rows; returns how many were recorded"""
+    urls = list({row["url"] for row in rows})
+    known = {record["url"]: record["sha256"] for record in await conn.fetch(MIRRORED_URLS, urls)}
+    MIRRORED_IMAGES.inc(len(known), result="reused")
+
+    missing = [url for url in urls if url not in known]
+    files = await asyncio.gather(*(mirror_url(session, url, semaphore, mirror_dir) for url in missing))
+    new_files = {}
+    for url, file_row in zip(missing, files):
+        if file_row is not None:
+            known[url] = file_row[0]
+            new_files[file_row[0]] = file_row
+
+    mirrored = [row for row in rows if row["url"] in known]
+    async with conn.transaction():
+        if new_files:
+            await conn.execute(SAVE_FILES, *(list(column) for column in zip(*new_files.values())))
+        if mirrored:
+            await conn.execute(
+                SAVE_MIRRORS,
+                [row["media_id"] for row in mirrored],
+                [row["url"] for row in mirrored],
+                [known[row["url"]] for row in mirrored],
+            )
+    return len(mirrored)
+
+
+async def mirror_images(pool=None, db_config=None, mirror_dir=MIRROR_DIR, concurrency=MIRROR_CONCURRENCY):
+    """
+    Mirror every image media row that has no (current) local copy.
+
+    Walks the pending rows in media_id order, one batch at a time, so a
+    stopped run resumes where the mirror left off.
+    """
+    own_pool = pool is None
+    if own_pool:
+        pool = await asyncpg.create_pool(**db_config, min_size=1, max_size=2, init=instrument_connection)
+    start_time = time.time()
+    semaphore = asyncio.Semaphore(concurrency)
+    last_id = 0
+    total = 0
+    try:
+        async with open_session(concurrency) as session, pool.acquire() as conn:
+            while True:
+                rows = await conn.fetch(PENDING_MEDIA, last_id, MIRROR_BATCH_SIZE)
+                if not rows:
+                    break
+                last_id = rows[-1]["media_id"]
+                total += await mirror_batch(conn, session, rows, semaphore, mirror_dir)
+                logging.info(f"Mirrored {total} images (up to media_id {last_id})")
+    finally:
+        if own_pool:
+            await pool.close()
+    logging.info(f"Image mirror: {total} media rows mirrored in {time.time() - start_time:.2f}s")
+    return total
+
+
+async def main():
+    from orchestrator import DB_CONFIG
+
+    await mirror_images(db_config=DB_CONFIG)
+
+
+if __name__ == "__main__":
+    import profiling
+    from log_pipeline import setup_logging
+
+    setup_logging("image_mirror.log")
+    profiling.run(main(), name="image_mirror")
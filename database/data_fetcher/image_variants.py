@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import asyncpg
+
+from image_mirror import MIRROR_DIR
+from metrics import IMAGE_VARIANTS, instrument_connection
+
+try:
+    from PIL import Image
+except ImportError:  # Only this stage needs Pillow
+    Image = None
+
+# Resized copies of the mirrored images for the frontend (list thumbnails,
+# detail-page sizes), rendered ahead of time so the backend serves a file
+# instead of resizing a full poster per request.
+#
+# Variants are made per media_file, so an image shared by several media rows
+# is resized once, and stored next to the mirror as
+# variants/ab/cd/<sha256>.<name>.<max_width>.<ext>. media_variant records
+# each one; a file only goes back to the workers for the variants it is
+# missing. The width is part of the key, so changing a configured size
+# renders new files, and variants no longer configured are pruned.
+
+# name:max_width:format, comma separated
+VARIANT_SPECS = os.getenv("IMAGE_VARIANTS", "thumb:160:webp,thumb:160:jpeg,medium:480:webp,medium:480:jpeg")
+VARIANT_WORKERS = int(os.getenv("IMAGE_VARIANT_WORKERS", os.cpu_count() or 1))
+VARIANT_BATCH_SIZE = 100  # Files read and recorded per round trip
+QUALITY = {"jpeg": 85, "webp": 80}
+EXTENSIONS = {"jpeg": "jpg", "webp": "webp", "png": "png"}
+
+
+class VariantSpec:
+    """One output size and format; its key (name, width, extension) names it in media_variant"""
+
+    __slots__ = ("name", "max_width", "format")
+
+    def __init__(self, name, max_width, image_format):
+        if image_format not in EXTENSIONS:
+            raise ValueError(f"Unsupported variant format '{image_format}'")
+        self.name = name
+        self.max_width = max_width
+        self.format = image_format
+
+    @property
+    def key(self):
+        return f"{self.name}.{self.max_width}.{EXTENSIONS[self.format]}"
+
+    def __repr__(self):
+        return f"VariantSpec({self.name!r}, {self.max_width}, {self.format!r})"
+
+
+def parse_specs(value=VARIANT_SPECS):
+    specs = []
+    for item in value.split(","):
+        name, max_width, image_format = item.strip().split(":")
+        specs.append(VariantSpec(name, int(max_width), image_format.lower()))
+    return specs
+
+
+PENDING_FILES = """
+    SELECT f.sha256, f.local_path, array_remove(array_agg(v.variant), NULL) AS done
+    FROM media_file f
+    LEFT JOIN media_variant v ON v.sha256 = f.sha256 AND v.variant = ANY($3::text[])
+    WHERE f.sha256 > $1
+    GROUP BY f.sha256, f.local_path
+    HAVING COUNT(v.variant) < cardinality($3::text[])
+    ORDER BY f.sha256
+    LIMIT $2
+"""
+
+SAVE_VARIANTS = """
+    INSERT INTO media_variant (sha256, variant, local_path, format, width, height, byte_size)
+    SELECT * FROM unnest($1::text[], $2::text[], $3::text[], $4::text[], $5::int[], $6::int[], $7::int[])
+    ON CONFLICT (sha256, variant) DO UPDATE
+    SET local_path = EXCLUDED.local_path,
+        format = EXCLUDED.format,
+        width = EXCLUDED.width,
+        height = EXCLUDED.height,
+        byte_size = EXCLUDED.byte_size,
+        created_at = NOW()
+"""
+
+
+STALE_VARIANTS = """
+    DELETE FROM media_variant
+    WHERE NOT (variant = ANY($1::text[]))
+    RETURNING local_path
+"""
+
+
+def variant_path(sha256, spec):
+    """Path of a variant, relative to the mirror directory"""
+    return os.path.join("variants", sha256[:2], sha256[2:4], f"{sha256}.{spec.key}")
+
+
+def render_variants(sha256, source_path, specs, mirror_dir=MIRROR_DIR):
+    """
+    Write the given variants of one mirrored file (runs in a worker process).
+
+    Returns (sha256, [media_variant row, ...], error). A variant already on
+    disk is measured instead of rendered again.
+    """
+    rows = []
+    try:
+        with Image.open(os.path.join(mirror_dir, source_path)) as original:
+            original.load()
+            for spec in specs:
+                relative = variant_path(sha256, spec)
+                path = os.path.join(mirror_dir, relative)
+                if os.path.exists(path):
+                    with Image.open(path) as existing:
+                        width, height = existing.size
+                else:
+                    image = original.copy()
+                    image.thumbnail((spec.max_width, spec.max_width * 4), Image.LANCZOS)  # Never upscales
+                    if spec.format == "jpeg" and image.mode not in ("RGB", "L"):
+                        image = image.convert("RGB")
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    partial = f"{path}.{os.getpid()}.part"
+                    image.save(partial, spec.format.upper(), quality=QUALITY.get(spec.format), optimize=True)
+                    os.replace(partial, path)
+                    width, height = image.size
+                rows.append((sha256, spec.key, relative, spec.format, width, height, os.path.getsize(path)))
+    except (OSError, ValueError) as e:  # Missing, truncated or unreadable file
+        return sha256, rows, str(e)
+    return sha256, rows, None
+
+
+async def render_batch(conn, executor, files, specs, mirror_dir=MIRROR_DIR):
+    """Render the missing variants of one batch of files; returns variants recorded"""
+    loop = asyncio.get_running_loop()
+    jobs = []
+    for record in files:
+        done = set(record["done"])
+        missing = [spec for spec in specs if spec.key not in done]
+        jobs.append(
+            loop.run_in_executor(
+                executor, render_variants, record["sha256"], record["local_path"], missing, mirror_dir
+            )
+        )
+
+    rows = []
+    for sha256, file_rows, error in await asyncio.gather(*jobs):
+        if error:
+            logging.warning(f"Variants of {sha256}: {error}")
+            IMAGE_VARIANTS.inc(result="failed")
+        rows.extend(file_rows)
+    IMAGE_VARIANTS.inc(len(rows), result="rendered")
+
+    if rows:
+        await conn.execute(SAVE_VARIANTS, *(list(column) for column in zip(*rows)))
+    return len(rows)
+
+
+async def prune_stale(conn, keys, mirror_dir=MIRROR_DIR):
+    """Drop the rows and files of variants that are no longer configured"""
+    removed = 0
+    for record in await conn.fetch(STALE_VARIANTS, keys):
+        try:
+            os.remove(os.path.join(mirror_dir, record["local_path"]))
+        except FileNotFoundError:
+            pass
+        removed += 1
+    if removed:
+        logging.info(f"Removed {removed} image variants that are no longer configured")
+    return removed
+
+
+async def generate_variants(pool=None, db_config=None, specs=None, workers=VARIANT_WORKERS, mirror_dir=MIRROR_DIR):
+    """
+    Render every configured variant that media_variant doesn't have yet.
+
+    Files are streamed from media_file in sha256 order, one batch at a time,
+    and resized in a process pool so the work spreads over every core.
+    """
+    if Image is None:
+        raise RuntimeError("Pillow is required to generate image variants (pip install Pillow)")
+    specs = specs or parse_specs()
+    keys = [spec.key for spec in specs]
+
+    own_pool = pool is None
+    if own_pool:
+        pool = await asyncpg.create_pool(**db_config, min_size=1, max_size=2, init=instrument_connection)
+    start_time = time.time()
+    last_sha256 = ""
+    total = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            async with pool.acquire() as conn:
+                await prune_stale(conn, keys, mirror_dir)
+                while True:
+                    files = await conn.fetch(PENDING_FILES, last_sha256, VARIANT_BATCH_SIZE, keys)
+                    if not files:
+                        break
+                    last_sha256 = files[-1]["sha256"]
+                    total += await render_batch(conn, executor, files, specs, mirror_dir)
+                    logging.info(f"Recorded {total} image variants")
+    finally:
+        if own_pool:
+            await pool.close()
+    logging.info(f"Image variants: {total} recorded in {time.time() - start_time:.2f}s")
+    return total
+
+
+async def main():
+    from orchestrator import DB_CONFIG
+
+    await generate_variants(db_config=DB_CONFIG)
+
+
+if __name__ == "__main__":
+    import profiling
+    from log_pipeline import setup_logging
+
+    setup_logging("image_variants.log")
+    profiling.run(main(), name="image_variants")
@@ -7,17 +7,17 @@ import random
 import os
 from dotenv import load_dotenv
 
+from budget import REQUEST_BUDGET
+from content_hash import replace_entity_image
+from jikan_client import client_session, entity_deadline
+from log_pipeline import setup_logging
+from metrics import instrument_connection
+import profiling
+
 load_dotenv()
 
 # Logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('image_fetch.log'),
-        logging.StreamHandler()
-    ]
-)
+setup_logging('image_fetch.log')
 
 # Environment config
 DB_CONFIG = {
@@ -56,7 +56,9 @@ async def fetch_with_retry(session, url, retries=MAX_RETRIES):
 
 async def process_anime(pool, session, anime_record, semaphore):
     async with semaphore:
-        async with pool.acquire() as conn:
+        if REQUEST_BUDGET.exhausted():
+            return
+        async with pool.acquire() as conn, entity_deadline():
             anime_id = anime_record['anime_id']
             title = anime_record['title']
             logging.info(f"Processing: {title}")
@@ -93,31 +95,26 @@ async def process_anime(pool, session, anime_record, semaphore):
 
             # Insert into media table
             try:
-                await conn.execute(
-                    "INSERT INTO media (url, entity_type, entity_id, media_type) "
-                    "VALUES ($1, 'anime', $2, 'image')",
-                    image_url, anime_id
-                )
+                await replace_entity_image(conn, 'anime', anime_id, image_url)
                 logging.info(f"Inserted image for {title}: {image_url}")
-            except asyncpg.UniqueViolationError:
-                logging.warning(f"Image already exists for {title}. Skipping.")
             except Exception as e:
                 logging.error(f"Database error for {title}: {str(e)}")
 
             await asyncio.sleep(BASE_DELAY * random.uniform(0.8, 1.5))
 
-async def fetch_anime_images():
-    pool = None
+async def fetch_anime_images(pool=None, session=None):
+    own_pool = pool is None
     try:
-        pool = await asyncpg.create_pool(**DB_CONFIG, min_size=1, max_size=10)
-        logging.info("Connected to Supabase with connection pool")
+        if own_pool:
+            pool = await asyncpg.create_pool(**DB_CONFIG, min_size=1, max_size=10, init=instrument_connection)
+            logging.info("Connected to Supabase with connection pool")
 
         async with pool.acquire() as conn:
             anime_records = await conn.fetch("""
                 SELECT a.anime_id, a.title
                 FROM anime a
                 WHERE NOT EXISTS (
-                    SELECT 1 FROM media m
+                    SELECT 1 FROM live_media m
                     WHERE m.entity_type = 'anime'
                     AND m.entity_id = a.anime_id
                     AND m.media_type = 'image'
@@ -129,7 +126,7 @@ async def fetch_anime_images():
 
         semaphore = asyncio.Semaphore(CONCURRENT_REQUESTS)
 
-        async with aiohttp.ClientSession() as session:
+        async with client_session(session, CONCURRENT_REQUESTS) as session:
             tasks = [
                 process_anime(pool, session, anime, semaphore)
                 for anime in anime_records
@@ -138,14 +135,19 @@ async def fetch_anime_images():
 
     except Exception as e:
         logging.critical(f"Critical error: {str(e)}")
+        if not own_pool:
+            raise
     finally:
-        if pool:
+        if pool and own_pool:
             await pool.close()
             logging.info("Database connection pool closed")
 
 if __name__ == "__main__":
+    import sys
+
+    profile_mode = profiling.pop_profile_flag(sys.argv)
     start_time = time.time()
     logging.info("===== STARTING IMAGE FETCH =====")
-    asyncio.run(fetch_anime_images())
+    profiling.run(fetch_anime_images(), profile_mode, "image_fetch")
     duration = time.time() - start_time
     logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
@@ -0,0 +1,374 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib parser if orjson isn't installed
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # Streaming decode is optional
+    ijson = None
+
+import profiling
+from metrics import (
+    DNS_LOOKUPS,
+    ENTITY_DEADLINES,
+    HTTP_CONNECTIONS,
+    HTTP_ERRORS,
+    HTTP_LATENCY,
+    HTTP_REQUESTS,
+    STALLED_ENTITIES,
+    endpoint_label,
+)
+from models import Anime, Character, Person, Producer
+
+# Jikan allows roughly 3 requests per second and 60 per minute
+DEFAULT_RATE = 3
+DEFAULT_PERIOD = 1.0
+
+# Timeouts in seconds. aiohttp's default is a 5 minute total and no read
+# timeout, long enough for one stalled connection to park a serial import.
+CONNECT_TIMEOUT = float(os.getenv("JIKAN_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.getenv("JIKAN_READ_TIMEOUT", 15))  # Max gap between received chunks
+TOTAL_TIMEOUT = float(os.getenv("JIKAN_TOTAL_TIMEOUT", 30))
+ENTITY_DEADLINE = float(os.getenv("JIKAN_ENTITY_DEADLINE", 120))  # All requests for one entity
+STALL_THRESHOLD = float(os.getenv("JIKAN_STALL_THRESHOLD", 60))  # Watchdog warns past this
+WATCHDOG_INTERVAL = 10
+
+# Connection pooling. Every request should go out on an already open TLS
+# connection: idle connections are kept well past the importers' sleeps,
+# and the host is resolved once rather than per connection.
+DEFAULT_CONCURRENCY = 4  # Per-host connections for the serial importers
+CONNECTION_LIMIT = 100
+KEEPALIVE_TIMEOUT = float(os.getenv("JIKAN_KEEPALIVE_TIMEOUT", 75))
+DNS_CACHE_TTL = int(os.getenv("JIKAN_DNS_CACHE_TTL", 600))
+
+# JSON decoding. Bodies are decoded with orjson when it is installed. With
+# JIKAN_STREAM_DECODE=1 (and ijson installed) the large /full payloads are
+# instead parsed incrementally and only the keys the records read are built;
+# relations, staff, external links and the like are never materialised.
+# Dumps recorded in that mode hold the projected payloads only.
+STREAM_DECODE = os.getenv("JIKAN_STREAM_DECODE", "0") == "1"
+STREAMED_ENDPOINTS = {
+    "/anime/{id}/full": Anime.PAYLOAD_KEYS,
+    "/characters/{id}/full": Character.PAYLOAD_KEYS,
+    "/people/{id}/full": Person.PAYLOAD_KEYS,
+    "/producers/{id}/full": Producer.PAYLOAD_KEYS,
+}
+
+
+def client_timeout(total=TOTAL_TIMEOUT):
+    return aiohttp.ClientTimeout(total=total, connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+
+
+def client_connector(concurrency=DEFAULT_CONCURRENCY):
+    return aiohttp.TCPConnector(
+        limit=max(CONNECTION_LIMIT, concurrency),
+        limit_per_host=concurrency,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        use_dns_cache=True,
+        ttl_dns_cache=DNS_CACHE_TTL,
+    )
+
+
+def _connection_trace(stats):
+    """Count new vs reused connections and cached vs resolved lookups"""
+
+    def counting(metric, key, result):
+        async def callback(session, context, params):
+            metric.inc(result=result)
+            stats[key] += 1
+
+        return callback
+
+    trace = aiohttp.TraceConfig()
+    trace.on_connection_create_end.append(counting(HTTP_CONNECTIONS, "new", "new"))
+    trace.on_connection_reuseconn.append(counting(HTTP_CONNECTIONS, "reused", "reused"))
+    trace.on_dns_cache_hit.append(counting(DNS_LOOKUPS, "dns_cached", "cached"))
+    trace.on_dns_cache_miss.append(counting(DNS_LOOKUPS, "dns_resolved", "resolved"))
+    return trace
+
+
+@asynccontextmanager
+async def open_session(concurrency=DEFAULT_CONCURRENCY):
+    """
+    Shared aiohttp session factory: tuned connector, timeouts, connection
+    stats and the stall watchdog. Logs connection reuse when closed.
+    """
+    stats = dict.fromkeys(("new", "reused", "dns_cached", "dns_resolved"), 0)
+    async with aiohttp.ClientSession(
+        connector=client_connector(concurrency),
+        timeout=client_timeout(),
+        trace_configs=[_connection_trace(stats)],
+    ) as session, watchdog():
+        yield session
+
+    used = stats["new"] + stats["reused"]
+    if used:
+        logging.info(
+            f"HTTP connections: {stats['new']} opened, {stats['reused']} reused "
+            f"({stats['reused'] / used:.0%} reuse), {stats['dns_resolved']} DNS lookups"
+        )
+
+
+@asynccontextmanager
+async def client_session(session=None, concurrency=DEFAULT_CONCURRENCY):
+    """Use the given session as-is, or open (and later close) an instrumented one"""
+    if session is not None:
+        yield session
+        return
+    async with open_session(concurrency) as new_session:
+        yield InstrumentedSession(new_session)
+
+
+class DeadlineExceeded(Exception):
+    """An entity ran out of time; not retried by fetch_with_retry"""
+
+
+class _InFlight:
+    __slots__ = ("started", "deadline", "url", "reported")
+
+    def __init__(self, started, deadline):
+        self.started = started
+        self.deadline = deadline
+        self.url = None
+        self.reported = False
+
+
+_current_entity = contextvars.ContextVar("entity_deadline", default=None)
+_in_flight = {}  # task -> _InFlight, read by the watchdog
+
+
+class entity_deadline:
+    """
+    Deadline shared by every request made while processing one entity.
+
+    Usable as `with` or `async with` (so it can join an `async with
+    pool.acquire()` line). Requests started after the deadline raise
+    DeadlineExceeded, and earlier ones get a total timeout no later than it.
+    Nested deadlines reuse the outer one.
+    """
+
+    def __init__(self, seconds=ENTITY_DEADLINE):
+        self.seconds = seconds
+
+    def __enter__(self):
+        self._nested = _current_entity.get() is not None
+        if self._nested:
+            return self
+        now = time.monotonic()
+        self._entry = _InFlight(now, now + self.seconds if self.seconds else None)
+        self._token = _current_entity.set(self._entry)
+        self._task = asyncio.current_task()
+        if self._task is not None:
+            _in_flight[self._task] = self._entry
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._nested:
+            return False
+        _current_entity.reset(self._token)
+        if self._task is not None:
+            _in_flight.pop(self._task, None)
+        if exc_type is DeadlineExceeded:
+            ENTITY_DEADLINES.inc()
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+def _request_timeout(url):
+    """Timeout for a request made now, bounded by the current entity's deadline"""
+    entry = _current_entity.get()
+    if entry is None:
+        return None
+    entry.url = url
+    if entry.deadline is None:
+        return None
+    remaining = entry.deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded(
+            f"Entity deadline of {entry.deadline - entry.started:.0f}s exceeded before {url}"
+        )
+    return client_timeout(total=min(remaining, TOTAL_TIMEOUT))
+
+
+async def _watch(threshold, interval):
+    while True:
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        for task, entry in list(_in_flight.items()):
+            stuck_for = now - entry.started
+            if entry.reported or stuck_for < threshold:
+                continue
+            entry.reported = True
+            STALLED_ENTITIES.inc()
+            frames = task.get_stack(limit=1)
+            where = (
+                f"{frames[-1].f_code.co_name}:{frames[-1].f_lineno}" if frames else "unknown"
+            )
+            logging.warning(
+                f"Watchdog: task {task.get_name()} stuck for {stuck_for:.0f}s "
+                f"in {where}, last request {entry.url or 'none'}"
+            )
+
+
+@asynccontextmanager
+async def watchdog(threshold=STALL_THRESHOLD, interval=WATCHDOG_INTERVAL):
+    """Warn about entities in flight for longer than `threshold` while the block runs"""
+    task = asyncio.create_task(_watch(threshold, interval))
+    try:
+        yield
+    finally:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+def decode_json(body):
+    """Decode a JSON body (bytes), or None for an empty one"""
+    if not body.strip():
+        return None
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+async def stream_json_fields(stream, keys):
+    """
+    Incrementally parse a Jikan response, building only `keys` of its `data`.
+
+    Returns {"data": {...}} like the full decode would, minus the skipped keys.
+    """
+    data = {}
+    key = builder = None
+    async for prefix, event, value in ijson.parse_async(stream, use_float=True):
+        if prefix == "data" and event in ("map_key", "end_map"):
+            if builder is not None:
+                data[key] = builder.value
+                builder = None
+            if event == "map_key" and value in keys:
+                key, builder = value, ijson.ObjectBuilder()
+        elif builder is not None:
+            builder.event(event, value)
+    return {"data": data}
+
+
+class _InstrumentedResponse:
+    """Response proxy timing JSON decoding as the 'parse' stage"""
+
+    def __init__(self, response, endpoint):
+        self._response = response
+        self._endpoint = endpoint
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    async def json(self, **kwargs):
+        with profiling.span("parse"):
+            if kwargs:
+                return await self._response.json(**kwargs)
+            keys = STREAMED_ENDPOINTS.get(self._endpoint) if STREAM_DECODE and ijson else None
+            if keys:
+                return await stream_json_fields(self._response.content, keys)
+            return decode_json(await self._response.read())
+
+
+class _InstrumentedRequest:
+    """Times a request up to its response headers and counts its status"""
+
+    def __init__(self, url, context):
+        self._endpoint = endpoint_label(url)
+        self._context = context
+
+    async def __aenter__(self):
+        start = time.perf_counter()
+        try:
+            response = await self._context.__aenter__()
+        except Exception as e:
+            HTTP_ERRORS.inc(endpoint=self._endpoint, error=type(e).__name__)
+            raise
+        elapsed = time.perf_counter() - start
+        HTTP_LATENCY.observe(elapsed, endpoint=self._endpoint)
+        HTTP_REQUESTS.inc(endpoint=self._endpoint, status=str(response.status))
+        profiling.record_span("fetch", start, elapsed)
+        return _InstrumentedResponse(response, self._endpoint)
+
+    async def __aexit__(self, *exc):
+        return await self._context.__aexit__(*exc)
+
+
+class InstrumentedSession:
+    """Session wrapper feeding request counts and latency into metrics"""
+
+    def __init__(self, session):
+        self._session = session
+
+    def get(self, url, **kwargs):
+        if "timeout" not in kwargs:
+            timeout = _request_timeout(url)
+            if timeout is not None:
+                kwargs["timeout"] = timeout
+        return _InstrumentedRequest(url, self._session.get(url, **kwargs))
+
+
+class RateLimiter:
+    """Spaces request starts so that at most `rate` begin per `period` seconds"""
+
+    def __init__(self, rate=DEFAULT_RATE, period=DEFAULT_PERIOD):
+        self.interval = period / rate
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            if wait > 0:
+                await asyncio.sleep(wait)
+                now = time.monotonic()
+            self._next_slot = max(now, self._next_slot) + self.interval
+
+
+class _LimitedRequest:
+    """Waits for a rate limit slot before starting the wrapped request"""
+
+    def __init__(self, limiter, start_request):
+        self._limiter = limiter
+        self._start_request = start_request
+        self._context = None
+
+    async def __aenter__(self):
+        with profiling.span("limiter"):
+            await self._limiter.acquire()
+        self._context = self._start_request()
+        return await self._context.__aenter__()
+
+    async def __aexit__(self, *exc):
+        return await self._context.__aexit__(*exc)
+
+
+class RateLimitedSession:
+    """Session wrapper sharing one request budget between all its users"""
+
+    def __init__(self, session, limiter):
+        self._session = session
+        self.limiter = limiter
+
+    def get(self, url, **kwargs):
+        return _LimitedRequest(self.limiter, lambda: self._session.get(url, **kwargs))
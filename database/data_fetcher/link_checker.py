@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import aiohttp
+import asyncpg
+
+from jikan_client import RateLimiter, open_session
+from metrics import LINK_CHECKS, instrument_connection
+
+# Liveness checks for the image URLs stored in `media`.
+#
+# Due rows are streamed in media_id order and checked with HEAD requests
+# (a one-byte ranged GET where HEAD isn't allowed) over a pooled session,
+# with a rate limit per host. Every result goes into media_link_check.
+#
+# Re-checks follow the age of a link: a URL that has answered for a long
+# time is checked rarely, a new one more often, so a full sweep only touches
+# a small part of the table. A failing URL (404/410 included, CDNs return
+# those for a while too) is retried with backoff and only marked dead_since
+# after DEAD_AFTER failures in a row spanning at least DEAD_MIN_AGE. The
+# media row stays: the live_media view leaves dead links out, so the image
+# fetchers and the daemon treat the entity as having no image and replace
+# the URL in place. Dead links are still checked now and then, and one that
+# answers again is simply alive. Deleting dead rows instead is opt-in
+# (--delete-dead).
+
+CHECKED_TYPES = ("anime", "character", "voice_actor")
+LINK_CHECK_CONCURRENCY = int(os.getenv("LINK_CHECK_CONCURRENCY", 20))
+HOST_RATE = float(os.getenv("LINK_CHECK_HOST_RATE", 10))  # Requests per second per host
+LINK_CHECK_BATCH_SIZE = 500
+MIN_RECHECK = 24 * 3600  # Seconds; a link is checked at least this far apart
+MAX_RECHECK = 60 * 24 * 3600
+RECHECK_AGE_FACTOR = 0.5  # Next check after this fraction of the link's healthy age
+RETRY_AFTER = 3600  # First re-check of a failing link, doubled per failure
+DEAD_AFTER = 3  # Consecutive failures before a link counts as dead
+DEAD_MIN_AGE = 3 * 24 * 3600  # Seconds those failures must span
+GONE_STATUSES = {404, 410}
+
+DUE_LINKS = """
+    SELECT m.media_id, m.url, c.first_ok_at, c.failures, c.first_failed_at, c.dead_since
+    FROM media m
+    LEFT JOIN media_link_check c ON c.media_id = m.media_id AND c.url = m.url
+    WHERE m.entity_type = ANY($3::text[])
+    AND m.media_id > $1
+    AND (c.media_id IS NULL OR c.next_check_at <= NOW())
+    ORDER BY m.media_id
+    LIMIT $2
+"""
+
+SAVE_CHECKS = """
+    INSERT INTO media_link_check (
+        media_id, url, status, error, failures, first_ok_at, first_failed_at, dead_since,
+        checked_at, next_check_at
+    )
+    SELECT u.media_id, u.url, u.status, u.error, u.failures, u.first_ok_at, u.first_failed_at,
+           u.dead_since, NOW(), NOW() + make_interval(secs => u.recheck)
+    FROM unnest(
+        $1::int[], $2::text[], $3::int[], $4::text[], $5::int[],
+        $6::timestamptz[], $7::timestamptz[], $8::timestamptz[], $9::float8[]
+    ) AS u(media_id, url, status, error, failures, first_ok_at, first_failed_at, dead_since, recheck)
+    ON CONFLICT (media_id) DO UPDATE
+    SET url = EXCLUDED.url,
+        status = EXCLUDED.status,
+        error = EXCLUDED.error,
+        failures = EXCLUDED.failures,
+        first_ok_at = EXCLUDED.first_ok_at,
+        first_failed_at = EXCLUDED.first_failed_at,
+        dead_since = EXCLUDED.dead_since,
+        checked_at = EXCLUDED.checked_at,
+        next_check_at = EXCLUDED.next_check_at
+"""
+
+
+class HostLimiters:
+    """One RateLimiter per host, created on first use"""
+
+    def __init__(self, rate=HOST_RATE):
+        self.rate = rate
+        self._limiters = {}
+
+    async def acquire(self, url):
+        host = urlsplit(url).hostname or ""
+        limiter = self._limiters.get(host)
+        if limiter is None:
+            limiter = self._limiters[host] = RateLimiter(self.rate)
+        await limiter.acquire()
+
+
+async def probe(session, url, limiters):
+    """(status, error) of a URL; status is None when no response came back"""
+    try:
+        await limiters.acquire(url)
+        async with session.head(url, allow_redirects=True) as response:
+            if response.status not in (403, 405, 501):
+                return response.status, None
+        # Some hosts refuse HEAD; ask for a single byte instead
+        await limiters.acquire(url)
+        async with session.get(url, headers={"Range": "bytes=0-0"}) as response:
+            return response.status, None
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return None, type(e).__name__
+
+
+def classify(status):
+    """'alive', 'gone' or 'failed' for a probe's status"""
+    if status is not None and 200 <= status < 400:
+        return "alive"
+    if status in GONE_STATUSES:
+        return "gone"
+    return "failed"
+
+
+def recheck_after(result, first_ok_at, failures, dead_since, now):
+    """Seconds until the next check of a link, from its age or failure count"""
+    if result == "alive":
+        age = (now - first_ok_at).total_seconds() if first_ok_at else 0
+        return float(min(max(age * RECHECK_AGE_FACTOR, MIN_RECHECK), MAX_RECHECK))
+    if dead_since:
+        return float(MAX_RECHECK)  # Only to notice a URL that came back
+    return float(min(RETRY_AFTER * 2 ** (failures - 1), MIN_RECHECK))
+
+
+def next_state(result, record, now):
+    """(failures, first_ok_at, first_failed_at, dead_since) after one check"""
+    if result == "alive":
+        return 0, record["first_ok_at"] or now, None, None
+    failures = (record["failures"] or 0) + 1
+    first_failed_at = record["first_failed_at"] or now
+    dead_since = record["dead_since"]
+    if (
+        dead_since is None
+        and failures >= DEAD_AFTER
+        and (now - first_failed_at).total_seconds() >= DEAD_MIN_AGE
+    ):
+        dead_since = now
+    return failures, None, first_failed_at, dead_since
+
+
+async def check_link(session, record, limiters, semaphore):
+    """Probe one media row; returns its media_link_check row and whether it just died"""
+    async with semaphore:
+        status, error = await probe(session, record["url"], limiters)
+    result = classify(status)
+    LINK_CHECKS.inc(result=result)
+
+    now = datetime.now(timezone.utc)
+    failures, first_ok_at, first_failed_at, dead_since = next_state(result, record, now)
+    recheck = recheck_after(result, first_ok_at, failures, dead_since, now)
+    row = (
+        record["media_id"], record["url"], status, error, failures,
+        first_ok_at, first_failed_at, dead_since, recheck,
+    )
+    return row, dead_since is not None and record["dead_since"] is None
+
+
+async def check_batch(conn, session, records, limiters, semaphore, delete_dead=False):
+    """Check one batch and record the results; returns the number of newly dead links"""
+    results = await asyncio.gather(
+        *(check_link(session, record, limiters, semaphore) for record in records)
+    )
+    rows = [row for row, _ in results]
+    async with conn.transaction():
+        await conn.execute(SAVE_CHECKS, *(list(column) for column in zip(*rows)))
+        dead = [row[0] for row in rows if row[7] is not None]
+        if dead and delete_dead:
+            # Cascades to the check and mirror rows; the fetchers refill the gap
+            await conn.execute("DELETE FROM media WHERE media_id = ANY($1::int[])", dead)
+    newly_dead = [row for row, died in results if died]
+    for row in newly_dead:
+        logging.warning(
+            f"Dead link for media {row[0]} after {row[4]} failed checks since {row[6]:%Y-%m-%d}: "
+            f"{row[2] or row[3]} {row[1]}"
+        )
+    return len(newly_dead)
+
+
+async def check_links(pool=None, db_config=None, delete_dead=False, concurrency=LINK_CHECK_CONCURRENCY):
+    """Check every media URL that is due and mark the ones that stay broken as dead"""
+    own_pool = pool is None
+    if own_pool:
+        pool = await asyncpg.create_pool(**db_config, min_size=1, max_size=2, init=instrument_connection)
+    start_time = time.time()
+    limiters = HostLimiters()
+    semaphore = asyncio.Semaphore(concurrency)
+    last_id = 0
+    checked = dead = 0
+    try:
+        async with open_session(concurrency) as session, pool.acquire() as conn:
+            while True:
+                records = await conn.fetch(DUE_LINKS, last_id, LINK_CHECK_BATCH_SIZE, list(CHECKED_TYPES))
+                if not records:
+                    break
+                last_id = records[-1]["media_id"]
+                dead += await check_batch(conn, session, records, limiters, semaphore, delete_dead)
+                checked += len(records)
+                logging.info(f"Checked {checked} media links, {dead} dead")
+    finally:
+        if own_pool:
+            await pool.close()
+    action = "deleted" if delete_dead else "marked for re-fetch"
+    logging.info(
+        f"Link check: {checked} links checked, {dead} dead ({action}) in {time.time() - start_time:.2f}s"
+    )
+    return checked, dead
+
+
+async def main(delete_dead=False):
+    from orchestrator import DB_CONFIG
+
+    await check_links(db_config=DB_CONFIG, delete_dead=delete_dead)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import profiling
+    from log_pipeline import setup_logging
+
+    parser = argparse.ArgumentParser(description="Check media URLs and mark dead ones for re-fetch")
+    parser.add_argument(
+        "--delete-dead", action="store_true", help="Delete the media rows of dead links instead"
+    )
+    args = parser.parse_args()
+
+    setup_logging("link_checker.log")
+    profiling.run(main(delete_dead=args.delete_dead), name="link_checker")
@@ -0,0 +1,159 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+import profiling
+
+# Logging for the importers without blocking the event loop. Records are put
+# on a queue as-is and a background thread formats them and writes them to
+# the console and log file, so the loop only pays for creating the record.
+#
+# Per-entity lines should use %-style arguments ("Processed anime %s", mal_id)
+# rather than f-strings: the message is then only built if the line is
+# actually written, and the template doubles as the key for sampling.
+#
+#   LOG_FORMAT=json        write the log file as JSON lines (entity, extras)
+#   LOG_SAMPLE_RATE=5      INFO lines per template per second (0 = keep all)
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 5))
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "entity"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the entity and any extra= fields"""
+
+    def format(self, record):
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "entity", None):
+            entry["entity"] = record.entity
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class EntityFilter(logging.Filter):
+    """Stamp records with the entity the current task is working on"""
+
+    def filter(self, record):
+        record.entity = profiling.current_entity()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Rate-limit repetitive INFO/DEBUG lines per message template.
+
+    Each template gets a token bucket of `rate` lines per second; lines over
+    the budget are dropped and the next line that gets through carries the
+    number of lines suppressed in between. Warnings and errors always pass.
+    """
+
+    def __init__(self, rate=LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+        self._buckets = {}  # template -> [tokens, last refill, suppressed]
+
+    def filter(self, record):
+        if not self.rate or record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        key = (record.name, record.msg)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.rate, now, 0]
+        tokens = min(self.rate, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            bucket[2] += 1
+            return False
+        bucket[0] = tokens - 1
+        if bucket[2]:
+            record.suppressed = bucket[2]
+            bucket[2] = 0
+        return True
+
+
+class _SuppressedCountFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{line} (+{suppressed} similar suppressed)" if suppressed else line
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread"""
+
+    def prepare(self, record):
+        if record.exc_info:
+            # Tracebacks reference live frames; render them while they are valid
+            return super().prepare(record)
+        return record
+
+
+def setup_logging(log_file, level=logging.INFO, log_format=LOG_FORMAT, sample_rate=LOG_SAMPLE_RATE):
+    """
+    Route logging through a queue to a background writer thread.
+
+    Like logging.basicConfig, only the first call in a process configures
+    anything, so an importer imported by the orchestrator keeps using the
+    orchestrator's log file.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    file_handler = logging.FileHandler(log_file)
+    file_handler.setFormatter(
+        JsonFormatter() if log_format == "json" else _SuppressedCountFormatter(TEXT_FORMAT)
+    )
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(_SuppressedCountFormatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(EntityFilter())
+    if sample_rate:
+        queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, file_handler, stream_handler, respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    if listener._thread is not None and threading.current_thread() is not listener._thread:
+        listener.stop()
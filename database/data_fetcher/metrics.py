@@ -0,0 +1,364 @@
+import asyncio
+import bisect
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import asynccontextmanager
+
+# Small in-process metrics registry. It renders the Prometheus text format
+# itself so the importers don't need prometheus_client installed.
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))  # 0 disables the HTTP endpoint
+METRICS_SUMMARY_FILE = os.getenv("METRICS_SUMMARY_FILE", "metrics_summary.json")
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0,
+)
+
+_lock = threading.Lock()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def total(self, **labels):
+        """Sum over every label set that includes the given labels"""
+        wanted = set(labels.items())
+        return sum(value for key, value in self._values.items() if wanted.issubset(key))
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+    def summary(self):
+        return {_format_labels(key) or "total": value for key, value in sorted(self._values.items())}
+
+
+class Gauge(Counter):
+    def set(self, value, **labels):
+        with _lock:
+            self._values[_label_key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        # label key -> [bucket counts..., +Inf count], sum
+        self._counts = {}
+        self._sums = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[index] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def time(self, **labels):
+        """Context manager observing the duration of its block"""
+        return _Timer(self, labels)
+
+    def percentile(self, q, **labels):
+        """Estimate a percentile by interpolating inside the bucket it falls in"""
+        counts = self._counts.get(_label_key(labels))
+        return _bucket_percentile(self.buckets, counts, q) if counts else None
+
+    def combined_percentile(self, q):
+        """percentile() over the observations of every label set together"""
+        combined = [0] * (len(self.buckets) + 1)
+        for counts in self._counts.values():
+            combined = [a + b for a, b in zip(combined, counts)]
+        return _bucket_percentile(self.buckets, combined, q)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, counts in sorted(self._counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {self._sums[key]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+    def summary(self):
+        result = {}
+        for key, counts in sorted(self._counts.items()):
+            total = sum(counts)
+            result[_format_labels(key) or "total"] = {
+                "count": total,
+                "mean": self._sums[key] / total if total else None,
+                "p50": _bucket_percentile(self.buckets, counts, 0.50),
+                "p95": _bucket_percentile(self.buckets, counts, 0.95),
+                "p99": _bucket_percentile(self.buckets, counts, 0.99),
+            }
+        return result
+
+
+def _bucket_percentile(buckets, counts, q):
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    lower = 0.0
+    for bound, count in zip(buckets, counts):
+        if count and cumulative + count >= rank:
+            return lower + (bound - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    return buckets[-1]  # Falls in +Inf; report the largest finite bound
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start, **self._labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.started_at = time.time()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation):
+        return self.register(Counter(name, documentation))
+
+    def gauge(self, name, documentation):
+        return self.register(Gauge(name, documentation))
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        return {
+            "uptime_seconds": time.time() - self.started_at,
+            "metrics": {metric.name: metric.summary() for metric in self.metrics},
+        }
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "importer_http_requests_total", "Jikan HTTP responses by endpoint and status"
+)
+HTTP_LATENCY = REGISTRY.histogram(
+    "importer_http_request_seconds", "Jikan request latency up to response headers"
+)
+HTTP_ERRORS = REGISTRY.counter(
+    "importer_http_errors_total", "Jikan requests that failed without a response"
+)
+DB_QUERIES = REGISTRY.counter("importer_db_queries_total", "Database statements by kind")
+DB_LATENCY = REGISTRY.histogram("importer_db_query_seconds", "Database statement latency")
+DB_ERRORS = REGISTRY.counter("importer_db_errors_total", "Database statements that raised")
+STAGE_RUNS = REGISTRY.counter("importer_stage_runs_total", "Pipeline stage attempts by result")
+STAGE_LATENCY = REGISTRY.histogram(
+    "importer_stage_seconds", "Pipeline stage duration",
+    buckets=(1, 10, 60, 300, 900, 1800, 3600, 7200, 14400, 28800),
+)
+STAGES_RUNNING = REGISTRY.gauge("importer_stages_running", "Pipeline stages currently running")
+ENTITIES = REGISTRY.counter("importer_entities_total", "Entities processed by kind and result")
+QUEUE_DEPTH = REGISTRY.gauge("importer_queue_depth", "Pending work items by queue")
+ENTITY_DEADLINES = REGISTRY.counter(
+    "importer_entity_deadlines_total", "Entities abandoned at their request deadline"
+)
+STALLED_ENTITIES = REGISTRY.counter(
+    "importer_stalled_entities_total", "Entities flagged by the watchdog as stuck"
+)
+HTTP_CONNECTIONS = REGISTRY.counter(
+    "importer_http_connections_total", "Connections used for requests, new or reused"
+)
+DNS_LOOKUPS = REGISTRY.counter("importer_dns_lookups_total", "Host lookups, cached or resolved")
+MIRRORED_IMAGES = REGISTRY.counter(
+    "importer_mirrored_images_total", "Image URLs mirrored: downloaded, duplicate, reused or failed"
+)
+MIRROR_BYTES = REGISTRY.counter("importer_mirror_bytes_total", "Bytes of new files written to the image mirror")
+LINK_CHECKS = REGISTRY.counter(
+    "importer_link_checks_total", "Media URL checks by result: alive, gone or failed"
+)
+IMAGE_VARIANTS = REGISTRY.counter(
+    "importer_image_variants_total", "Image variants recorded, and files that failed to render"
+)
+SEARCH_ENTRIES = REGISTRY.counter(
+    "importer_search_entries_total", "Search index entries written by the backfill"
+)
+SIMILARITY_ROWS = REGISTRY.counter(
+    "importer_similarity_rows_total", "Precomputed similar-anime neighbours written"
+)
+IMAGE_DUPLICATES = REGISTRY.counter(
+    "importer_image_duplicates_total", "Near-duplicate images found among an entity's media"
+)
+
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def endpoint_label(url):
+    """Collapse a request URL into a low-cardinality endpoint label"""
+    path = url.split("?", 1)[0]
+    if "://" in path:
+        path = "/" + path.split("://", 1)[1].split("/", 1)[-1]
+    path = path.replace("/v4", "", 1)
+    return _ID_SEGMENT.sub("/{id}", path)
+
+
+def statement_kind(query):
+    """First SQL keyword of a statement (SELECT, INSERT, ...)"""
+    stripped = query.lstrip()
+    return stripped.split(None, 1)[0].upper() if stripped else "UNKNOWN"
+
+
+def _log_query(record):
+    kind = statement_kind(record.query)
+    DB_QUERIES.inc(kind=kind)
+    DB_LATENCY.observe(record.elapsed, kind=kind)
+    if record.exception is not None:
+        DB_ERRORS.inc(kind=kind)
+
+
+async def instrument_connection(conn):
+    """
+    Record latency of every statement run on an asyncpg connection.
+
+    Usable directly after asyncpg.connect() or as a pool's init= callback.
+    Query loggers need asyncpg >= 0.29 (pinned in requirements.txt).
+    """
+    conn.add_query_logger(_log_query)
+
+
+async def _handle_http(reader, writer):
+    try:
+        request_line = await reader.readline()
+        # Drain the headers; we only care about the path
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        path = parts[1] if len(parts) > 1 else "/"
+        if path.startswith("/metrics.json"):
+            body = json.dumps(run_summary(), indent=2).encode("utf-8")
+            content_type = "application/json"
+        elif path.startswith("/metrics"):
+            body = REGISTRY.render().encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        else:
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            return
+        writer.write(
+            f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1")
+            + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+def run_summary():
+    """Registry summary plus the headline numbers we tune concurrency with"""
+    summary = REGISTRY.summary()
+    uptime = summary["uptime_seconds"] or 1.0
+    requests = HTTP_REQUESTS.total()
+    rate_limited = HTTP_REQUESTS.total(status="429")
+    summary["headline"] = {
+        "http_requests": requests,
+        "http_requests_per_second": requests / uptime,
+        "http_429_ratio": rate_limited / requests if requests else 0.0,
+        "http_p95_seconds": HTTP_LATENCY.combined_percentile(0.95),
+        "db_statements": DB_QUERIES.total(),
+        "db_p95_seconds": DB_LATENCY.combined_percentile(0.95),
+    }
+    return summary
+
+
+def standalone_summary_path(name):
+    """Summary file of a single-module run, prefixed with its name so parallel runs don't collide"""
+    directory, filename = os.path.split(METRICS_SUMMARY_FILE)
+    return os.path.join(directory, f"{name}_{filename}")
+
+
+def write_summary(path=METRICS_SUMMARY_FILE):
+    """Dump the JSON summary of every metric to a file"""
+    with open(path, "w") as f:
+        json.dump(run_summary(), f, indent=2)
+    logging.info(f"Metrics summary written to {path}")
+
+
+@asynccontextmanager
+async def metrics_server(port=METRICS_PORT, summary_path=METRICS_SUMMARY_FILE):
+    """Serve /metrics (Prometheus) and /metrics.json while the block runs, then write a summary"""
+    server = None
+    if port:
+        server = await asyncio.start_server(_handle_http, "127.0.0.1", port)
+        logging.info(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+    try:
+        yield REGISTRY
+    finally:
+        if server:
+            server.close()
+            await server.wait_closed()
+        if summary_path:
+            write_summary(summary_path)
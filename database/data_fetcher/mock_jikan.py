@@ -0,0 +1,361 @@
+import asyncio
+import logging
+import random
+import re
+
+from aiohttp import web
+
+from ndjson_dump import iter_dump
+
+# Local stand-in for the Jikan v4 API used by the benchmark suite. It serves
+# either payloads recorded with an importer's `export` mode or a synthetic,
+# seeded dataset, and can add latency and inject 429s so runs are repeatable
+# without touching the real API.
+
+DEFAULT_PAGE_SIZE = 25
+DEFAULT_SEED = 1234
+
+GENRE_NAMES = [
+    "Action", "Adventure", "Comedy", "Drama", "Fantasy", "Horror", "Mystery",
+    "Romance", "Sci-Fi", "Slice of Life", "Sports", "Supernatural", "Suspense",
+]
+THEME_NAMES = ["Isekai", "Mecha", "Music", "School", "Space", "Time Travel"]
+DEMOGRAPHIC_NAMES = ["Shounen", "Shoujo", "Seinen", "Josei"]
+STUDIO_NAMES = [
+    "Madhouse", "Bones", "Toei Animation", "Kyoto Animation", "MAPPA", "Wit Studio",
+    "Production I.G", "Sunrise", "Shaft", "A-1 Pictures", "CloverWorks", "Trigger",
+]
+SEASONS = ["winter", "spring", "summer", "fall"]
+
+
+class Fixtures:
+    """Jikan-shaped payloads indexed the way the API exposes them"""
+
+    def __init__(self):
+        self.anime = {}  # mal_id -> full anime payload
+        self.anime_characters = {}  # anime mal_id -> /anime/{id}/characters entries
+        self.characters = {}  # mal_id -> full character payload
+        self.producers = {}  # mal_id -> full producer payload
+        self.people = {}  # mal_id -> full person payload
+        self.genres = {"anime": [], "manga": []}
+
+    def counts(self):
+        return {
+            "anime": len(self.anime),
+            "characters": len(self.characters),
+            "producers": len(self.producers),
+            "people": len(self.people),
+            "genres": len(self.genres["anime"]) + len(self.genres["manga"]),
+        }
+
+
+def _image(kind, mal_id):
+    url = f"https://cdn.example.invalid/images/{kind}/{mal_id}.jpg"
+    return {"jpg": {"image_url": url}, "webp": {"image_url": url.replace(".jpg", ".webp")}}
+
+
+def synthetic_fixtures(anime_count=200, characters_per_anime=6, seed=DEFAULT_SEED):
+    """Generate a deterministic dataset with realistic payload shapes and sizes"""
+    rng = random.Random(seed)
+    fixtures = Fixtures()
+
+    genre_id = 0
+    genre_sets = {}
+    for group, names in (("genres", GENRE_NAMES), ("themes", THEME_NAMES), ("demographics", DEMOGRAPHIC_NAMES)):
+        genre_sets[group] = []
+        for name in names:
+            genre_id += 1
+            entry = {"mal_id": genre_id, "type": "anime", "name": name,
+                     "url": f"https://myanimelist.net/anime/genre/{genre_id}"}
+            genre_sets[group].append(entry)
+            fixtures.genres["anime"].append(dict(entry, count=rng.randint(50, 5000)))
+            fixtures.genres["manga"].append(dict(entry, type="manga", count=rng.randint(50, 5000)))
+
+    for producer_id, name in enumerate(STUDIO_NAMES, 1):
+        fixtures.producers[producer_id] = {
+            "mal_id": producer_id,
+            "titles": [{"type": "Default", "title": name}],
+            "name": name,
+            "established": f"{rng.randint(1950, 2015)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T00:00:00+00:00",
+            "about": f"{name} is a Japanese animation studio. " + "Lorem ipsum dolor sit amet. " * rng.randint(5, 30),
+            "images": _image("producers", producer_id),
+        }
+
+    person_count = max(1, anime_count * characters_per_anime // 3)
+    for person_id in range(1, person_count + 1):
+        fixtures.people[person_id] = {
+            "mal_id": person_id,
+            "name": f"Seiyuu {person_id}",
+            "birthday": f"{rng.randint(1960, 2000)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T00:00:00+00:00",
+            "about": "Japanese voice actress. " + "Filler biography text. " * rng.randint(2, 20),
+            "images": _image("people", person_id),
+        }
+
+    character_id = 0
+    for mal_id in range(1, anime_count + 1):
+        year = rng.randint(1990, 2023)
+        studio = fixtures.producers[rng.randint(1, len(STUDIO_NAMES))]
+        title = f"Benchmark Anime {mal_id}"
+        score = round(rng.uniform(5.0, 9.5), 2)
+        anime = {
+            "mal_id": mal_id,
+            "approved": True,
+            "title": title,
+            "title_english": f"{title} (EN)" if rng.random() < 0.7 else None,
+            "title_japanese": f"ベンチマーク {mal_id}",
+            "type": "TV",
+            "status": "Finished Airing",
+            "episodes": rng.randint(1, 64),
+            "aired": {"from": f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T00:00:00+00:00"},
+            "season": rng.choice(SEASONS),
+            "year": year,
+            "score": score,
+            "rank": mal_id,
+            "popularity": mal_id,
+            "synopsis": "A synthetic synopsis sentence. " * rng.randint(10, 60),
+            "studios": [{"mal_id": studio["mal_id"], "type": "anime", "name": studio["name"]}],
+            "genres": rng.sample(genre_sets["genres"], rng.randint(1, 4)),
+            "explicit_genres": [],
+            "themes": rng.sample(genre_sets["themes"], rng.randint(0, 2)),
+            "demographics": rng.sample(genre_sets["demographics"], 1),
+            "images": _image("anime", mal_id),
+            "trailer": {"youtube_id": f"yt{mal_id:09d}" if rng.random() < 0.8 else None},
+        }
+        fixtures.anime[mal_id] = anime
+
+        entries = []
+        for position in range(characters_per_anime):
+            character_id += 1
+            person = fixtures.people[rng.randint(1, person_count)]
+            voices = [{"language": "Japanese", "person": {
+                "mal_id": person["mal_id"], "name": person["name"], "images": person["images"],
+            }}]
+            role = "Main" if position < 2 else "Supporting"
+            character = {
+                "mal_id": character_id,
+                "name": f"Character {character_id}",
+                "about": "Character biography text. " * rng.randint(3, 40),
+                "favorites": rng.randint(0, 100000),
+                "images": _image("characters", character_id),
+                "animeography": [{"anime": {"mal_id": mal_id, "title": title}, "role": role,
+                                  "mal_id": mal_id, "name": title}],
+                "voices": [dict(voice, person=person) for voice in voices],
+            }
+            fixtures.characters[character_id] = character
+            entries.append({
+                "character": {key: character[key] for key in ("mal_id", "name", "images")},
+                "role": role,
+                "voice_actors": voices,
+            })
+        fixtures.anime_characters[mal_id] = entries
+
+    return fixtures
+
+
+_ANIME_CHARACTERS = re.compile(r"/anime/(\d+)/characters$")
+_PRODUCER_FULL = re.compile(r"/producers/(\d+)/full$")
+
+
+def load_fixtures(dump_path):
+    """Build fixtures from an NDJSON dump written by an importer's export mode"""
+    fixtures = Fixtures()
+    for record in iter_dump(dump_path):
+        kind = record.get("kind")
+        data = record.get("data") or {}
+        if kind == "anime":
+            fixtures.anime[data["mal_id"]] = data
+        elif kind == "character":
+            fixtures.characters[data["mal_id"]] = data
+        elif kind == "company":
+            fixtures.producers[data["mal_id"]] = data
+        elif kind in ("genre", "manga_genre"):
+            fixtures.genres["anime" if kind == "genre" else "manga"].append(data)
+
+        for url, payload in (record.get("related") or {}).items():
+            if not payload or "data" not in payload:
+                continue
+            path = url.split("?", 1)[0]
+            match = _ANIME_CHARACTERS.search(path)
+            if match:
+                fixtures.anime_characters[int(match.group(1))] = payload["data"]
+                continue
+            match = _PRODUCER_FULL.search(path)
+            if match:
+                fixtures.producers[int(match.group(1))] = payload["data"]
+
+    # People only appear nested in recorded payloads
+    for character in fixtures.characters.values():
+        for voice in character.get("voices") or []:
+            person = voice.get("person") or {}
+            if person.get("mal_id"):
+                fixtures.people.setdefault(person["mal_id"], person)
+    for entries in fixtures.anime_characters.values():
+        for entry in entries:
+            for voice in entry.get("voice_actors") or []:
+                person = voice.get("person") or {}
+                if person.get("mal_id"):
+                    fixtures.people.setdefault(person["mal_id"], person)
+    return fixtures
+
+
+def _page(items, query, page_size=DEFAULT_PAGE_SIZE):
+    try:
+        page = max(1, int(query.get("page", 1)))
+        limit = max(1, min(int(query.get("limit", page_size)), page_size))
+    except ValueError:
+        page, limit = 1, page_size
+    start = (page - 1) * limit
+    chunk = items[start:start + limit]
+    return {
+        "pagination": {
+            "last_visible_page": max(1, -(-len(items) // limit)),
+            "has_next_page": start + limit < len(items),
+            "current_page": page,
+            "items": {"count": len(chunk), "total": len(items), "per_page": limit},
+        },
+        "data": chunk,
+    }
+
+
+def _search(items, query, field):
+    """Case-insensitive substring search like Jikan's ?q="""
+    needle = query.get("q", "").lower()
+    if not needle:
+        return None
+    exact = [item for item in items if (item.get(field) or "").lower() == needle]
+    return exact or [item for item in items if needle in (item.get(field) or "").lower()]
+
+
+class MockJikan:
+    """aiohttp application serving fixtures with configurable latency and 429s"""
+
+    def __init__(self, fixtures, latency=0.0, jitter=0.0, rate_limit_ratio=0.0, seed=DEFAULT_SEED):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.requests = 0
+        self.rate_limited = 0
+        self._rng = random.Random(seed)
+        self._runner = None
+        self._anime_list = sorted(fixtures.anime.values(), key=lambda a: a.get("rank") or a["mal_id"])
+        self._character_list = sorted(
+            fixtures.characters.values(), key=lambda c: c.get("favorites") or 0, reverse=True
+        )
+        self._producer_list = [fixtures.producers[key] for key in sorted(fixtures.producers)]
+        self._people_list = [fixtures.people[key] for key in sorted(fixtures.people)]
+
+    def reset_counters(self):
+        self.requests = 0
+        self.rate_limited = 0
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/v4/{path:.*}", self.handle)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start serving and return the base URL to use in place of the real API"""
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        logging.info(f"Mock Jikan serving {self.fixtures.counts()} on port {bound_port}")
+        return f"http://{host}:{bound_port}/v4"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle(self, request):
+        self.requests += 1
+        delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.rate_limit_ratio and self._rng.random() < self.rate_limit_ratio:
+            self.rate_limited += 1
+            return web.json_response(
+                {"status": 429, "type": "RateLimitException", "message": "Too many requests"},
+                status=429,
+            )
+        payload = self.route("/" + request.match_info["path"].rstrip("/"), request.query)
+        if payload is None:
+            return web.json_response({"status": 404, "message": "Resource does not exist"}, status=404)
+        return web.json_response(payload)
+
+    def route(self, path, query):
+        fixtures = self.fixtures
+        parts = path.strip("/").split("/")
+        resource = parts[0]
+        mal_id = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+        sub = parts[2] if len(parts) > 2 else None
+
+        if resource == "anime":
+            if mal_id is None:
+                found = _search(self._anime_list, query, "title")
+                return _page(self._anime_list if found is None else found, query)
+            if mal_id not in fixtures.anime:
+                return None
+            if sub in (None, "full"):
+                return {"data": fixtures.anime[mal_id]}
+            if sub == "characters":
+                return {"data": fixtures.anime_characters.get(mal_id, [])}
+            if sub == "pictures":
+                return {"data": [fixtures.anime[mal_id].get("images") or {}]}
+        elif resource == "characters":
+            if mal_id is None:
+                found = _search(self._character_list, query, "name")
+                return _page(self._character_list if found is None else found, query)
+            if mal_id in fixtures.characters and sub in (None, "full"):
+                return {"data": fixtures.characters[mal_id]}
+        elif resource == "producers":
+            if mal_id is None:
+                return _page(self._producer_list, query)
+            if mal_id in fixtures.producers and sub in (None, "full"):
+                return {"data": fixtures.producers[mal_id]}
+        elif resource == "people":
+            if mal_id is None:
+                found = _search(self._people_list, query, "name")
+                return _page(self._people_list if found is None else found, query)
+            if mal_id in fixtures.people and sub in (None, "full"):
+                return {"data": fixtures.people[mal_id]}
+        elif resource == "genres" and mal_id is None and len(parts) == 2:
+            return {"data": fixtures.genres.get(parts[1], [])}
+        return None
+
+
+async def serve_forever(fixtures, port, **options):
+    """Run the mock on a fixed port until interrupted"""
+    mock = MockJikan(fixtures, **options)
+    base_url = await mock.start(port=port)
+    logging.info(f"Point JIKAN_BASE_URL at {base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await mock.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Serve Jikan fixtures locally")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--fixtures", help="NDJSON dump to serve (default: synthetic data)")
+    parser.add_argument("--anime", type=int, default=200, help="Synthetic anime count")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency, up to this many seconds")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else synthetic_fixtures(args.anime, seed=args.seed)
+    try:
+        asyncio.run(serve_forever(
+            fixtures, args.port, latency=args.latency, jitter=args.jitter,
+            rate_limit_ratio=args.rate_limit_ratio, seed=args.seed,
+        ))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,279 @@
+from abc import ABC, abstractmethod
+
+# Slotted records for the Jikan payloads the importers persist.
+#
+# A /full response carries far more than we store (relations, external
+# links, every voice actor in every language, ...). Projecting it into one of
+# these records right after decoding lets the decoded dict be freed before
+# the entity's database writes start, so an in-flight entity holds a dozen
+# fields instead of the whole nested payload.
+#
+# PAYLOAD_KEYS lists the top-level keys of `data` a record reads, so a
+# streaming decoder can skip everything else (see jikan_client).
+
+
+def _image_url(data):
+    return ((data.get("images") or {}).get("jpg") or {}).get("image_url")
+
+
+class Record(ABC):
+    __slots__ = ()
+
+    @classmethod
+    @abstractmethod
+    def from_payload(cls, data):
+        """Build the record from the `data` object of a Jikan response"""
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+
+def as_record(cls, data):
+    """Project a raw payload into `cls`, passing records (and None) through"""
+    if data is None or isinstance(data, cls):
+        return data
+    return cls.from_payload(data)
+
+
+class Genre(Record):
+    """Entry of /genres/anime or /genres/manga, or a genre tag on an anime"""
+
+    __slots__ = ("mal_id", "name", "count", "url")
+
+    def __init__(self, mal_id, name, count=0, url=None):
+        self.mal_id = mal_id
+        self.name = name
+        self.count = count
+        self.url = url
+
+    @classmethod
+    def from_payload(cls, data):
+        return cls(data.get("mal_id"), data.get("name"), data.get("count", 0), data.get("url"))
+
+
+class Producer(Record):
+    """Entry of /producers, optionally merged with /producers/{id}/full"""
+
+    __slots__ = ("mal_id", "name", "about", "established")
+    PAYLOAD_KEYS = ("mal_id", "name", "about", "established")
+
+    def __init__(self, mal_id, name, about="", established=""):
+        self.mal_id = mal_id
+        self.name = name
+        self.about = about
+        self.established = established
+
+    @classmethod
+    def from_payload(cls, data):
+        return cls(
+            data.get("mal_id"),
+            data.get("name"),
+            data.get("about") or "",
+            data.get("established") or "",
+        )
+
+
+class Person(Record):
+    """A voice actor, from /people/{id}/full or nested in a voices entry"""
+
+    __slots__ = ("mal_id", "name", "birthday", "about", "image_url")
+    PAYLOAD_KEYS = ("mal_id", "name", "birthday", "about", "images")
+
+    def __init__(self, mal_id, name, birthday=None, about=None, image_url=None):
+        self.mal_id = mal_id
+        self.name = name
+        self.birthday = birthday
+        self.about = about
+        self.image_url = image_url
+
+    @classmethod
+    def from_payload(cls, data):
+        return cls(
+            data.get("mal_id"),
+            data.get("name"),
+            data.get("birthday"),
+            data.get("about"),
+            _image_url(data),
+        )
+
+
+def _voice_actor(voices, japanese_only):
+    """The Japanese voice actor, else (unless japanese_only) the first listed"""
+    chosen = next((va for va in voices if va.get("language") == "Japanese"), None)
+    if chosen is None and voices and not japanese_only:
+        chosen = voices[0]
+    if chosen and chosen.get("person"):
+        return Person.from_payload(chosen["person"])
+    return None
+
+
+class Appearance(Record):
+    """One animeography entry of a character"""
+
+    __slots__ = ("mal_id", "name", "role")
+
+    def __init__(self, mal_id, name, role):
+        self.mal_id = mal_id
+        self.name = name
+        self.role = role
+
+    @classmethod
+    def from_payload(cls, data):
+        anime = data.get("anime") or {}
+        return cls(
+            data.get("mal_id") or anime.get("mal_id"),
+            data.get("name") or anime.get("title") or "",
+            data.get("role"),
+        )
+
+
+class Character(Record):
+    """/characters/{id}/full, with the voice actor we link already chosen"""
+
+    __slots__ = ("mal_id", "name", "about", "image_url", "voice_actor", "animeography")
+    PAYLOAD_KEYS = ("mal_id", "name", "about", "images", "voices", "animeography")
+
+    def __init__(self, mal_id, name, about="", image_url=None, voice_actor=None, animeography=()):
+        self.mal_id = mal_id
+        self.name = name
+        self.about = about
+        self.image_url = image_url
+        self.voice_actor = voice_actor
+        self.animeography = animeography
+
+    @classmethod
+    def from_payload(cls, data):
+        return cls(
+            data.get("mal_id"),
+            data.get("name"),
+            data.get("about") or "",
+            _image_url(data),
+            _voice_actor(data.get("voices") or [], japanese_only=False),
+            tuple(Appearance.from_payload(entry) for entry in data.get("animeography") or []),
+        )
+
+
+class CastMember(Record):
+    """Entry of /anime/{id}/characters: the character, role and Japanese VA"""
+
+    __slots__ = ("mal_id", "name", "about", "role", "voice_actor")
+
+    def __init__(self, mal_id, name, about=None, role="Supporting", voice_actor=None):
+        self.mal_id = mal_id
+        self.name = name
+        self.about = about
+        self.role = role
+        self.voice_actor = voice_actor
+
+    @classmethod
+    def from_payload(cls, data):
+        character = data["character"]
+        return cls(
+            character.get("mal_id"),
+            character["name"],
+            character.get("about"),
+            data.get("role", "Supporting"),
+            _voice_actor(data.get("voice_actors") or [], japanese_only=True),
+        )
+
+
+class Anime(Record):
+    """/anime/{id}/full, reduced to the columns and links we store"""
+
+    __slots__ = (
+        "mal_id",
+        "title",
+        "approved",
+        "alternative_title",
+        "aired_from",
+        "season",
+        "year",
+        "score",
+        "episodes",
+        "synopsis",
+        "rank",
+        "studio",
+        "genres",
+        "image_url",
+    )
+    PAYLOAD_KEYS = (
+        "mal_id",
+        "title",
+        "approved",
+        "title_english",
+        "title_japanese",
+        "aired",
+        "season",
+        "year",
+        "score",
+        "episodes",
+        "synopsis",
+        "rank",
+        "studios",
+        "genres",
+        "explicit_genres",
+        "themes",
+        "demographics",
+        "images",
+    )
+
+    def __init__(
+        self,
+        mal_id,
+        title,
+        approved=True,
+        alternative_title=None,
+        aired_from=None,
+        season=None,
+        year=None,
+        score=None,
+        episodes=None,
+        synopsis=None,
+        rank=None,
+        studio=None,
+        genres=(),
+        image_url=None,
+    ):
+        self.mal_id = mal_id
+        self.title = title
+        self.approved = approved
+        self.alternative_title = alternative_title
+        self.aired_from = aired_from
+        self.season = season
+        self.year = year
+        self.score = score
+        self.episodes = episodes
+        self.synopsis = synopsis
+        self.rank = rank
+        self.studio = studio  # Name of the first listed studio
+        self.genres = genres  # Genre, theme, demographic and explicit tags
+        self.image_url = image_url
+
+    @classmethod
+    def from_payload(cls, data):
+        studios = data.get("studios") or []
+        genres = []
+        for genre_type in ("genres", "explicit_genres", "themes", "demographics"):
+            genres.extend(Genre.from_payload(g) for g in data.get(genre_type) or [] if g)
+        return cls(
+            data.get("mal_id"),
+            data.get("title"),
+            bool(data.get("approved")),
+            data.get("title_english") or data.get("title_japanese"),
+            (data.get("aired") or {}).get("from"),
+            data.get("season"),
+            data.get("year"),
+            data.get("score"),
+            data.get("episodes"),
+            data.get("synopsis"),
+            data.get("rank"),
+            studios[0].get("name") if studios else None,
+            tuple(genres),
+            _image_url(data),
+        )
@@ -0,0 +1,169 @@
+import bz2
+import gzip
+import json
+import logging
+import lzma
+import os
+
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib parser if orjson isn't installed
+    orjson = None
+
+# Dump files hold one Jikan payload per line:
+#
+#   {"kind": "anime", "data": {...}, "related": {"<url>": {...}, ...}}
+#
+# `data` is what the importer's process_*_from_data function receives and
+# `related` holds every other response fetched while that entity was
+# processed (e.g. /anime/{id}/characters), keyed by URL, so the offline run
+# goes through exactly the same transform and write path as a live one.
+
+_OPENERS = {
+    ".gz": gzip.open,
+    ".bz2": bz2.open,
+    ".xz": lzma.open,
+}
+
+
+def open_dump(path, mode="rb"):
+    """Open a dump file, picking the compression from its extension"""
+    opener = _OPENERS.get(os.path.splitext(path)[1], open)
+    return opener(path, mode)
+
+
+def loads(line):
+    """Decode one JSON document from bytes"""
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+def dumps(obj):
+    """Encode one JSON document to bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def iter_dump(path, kind=None):
+    """Stream records from a dump file one line at a time (constant memory)"""
+    with open_dump(path, "rb") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = loads(line)
+            except ValueError as e:
+                logging.warning(f"Skipping malformed line {line_number} in {path}: {str(e)}")
+                continue
+            if kind is None or record.get("kind") == kind:
+                yield record
+
+
+class DumpWriter:
+    """Append captured payloads to a (compressed) NDJSON dump file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = None
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open_dump(self.path, "ab")
+        return self
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        logging.info(f"Wrote {self.count} records to {self.path}")
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, kind, data, related=None):
+        record = {"kind": kind, "data": data}
+        if related:
+            record["related"] = related
+        self._file.write(dumps(record) + b"\n")
+        self.count += 1
+
+
+class _RecordedResponse:
+    """Minimal stand-in for an aiohttp response serving a recorded payload"""
+
+    def __init__(self, payload):
+        self.status = 404 if payload is None else 200
+        self._payload = payload
+
+    async def json(self):
+        return self._payload
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class OfflineSession:
+    """Session replacement that answers requests from a dump record"""
+
+    def __init__(self, record=None):
+        self.related = (record or {}).get("related") or {}
+
+    def get(self, url, **kwargs):
+        if url not in self.related:
+            logging.debug(f"No recorded payload for {url}")
+        return _RecordedResponse(self.related.get(url))
+
+
+class _RecordingResponse:
+    """Wraps an aiohttp response and captures its decoded JSON body"""
+
+    def __init__(self, session, url, context):
+        self._session = session
+        self._url = url
+        self._context = context
+        self._response = None
+
+    async def __aenter__(self):
+        self._response = await self._context.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc):
+        return await self._context.__aexit__(*exc)
+
+    @property
+    def status(self):
+        return self._response.status
+
+    async def json(self):
+        payload = await self._response.json()
+        self._session.captured[self._url] = payload
+        return payload
+
+
+class RecordingSession:
+    """Wraps an aiohttp session and keeps every JSON payload it returns"""
+
+    def __init__(self, session):
+        self._session = session
+        self.captured = {}
+
+    def get(self, url, **kwargs):
+        return _RecordingResponse(self, url, self._session.get(url, **kwargs))
+
+    def drain(self):
+        """Return and forget everything captured since the last drain"""
+        captured, self.captured = self.captured, {}
+        return captured
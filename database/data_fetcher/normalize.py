@@ -0,0 +1,68 @@
+from datetime import date
+from functools import lru_cache
+
+# Date and season normalization shared by the importers.
+#
+# Jikan sends dates as ISO 8601 timestamps ("2001-04-03T00:00:00+00:00");
+# producer and studio data sometimes only carry "2001-04", "2001" or
+# "2001/04/03". parse_date() reads the leading date fields directly instead
+# of probing strptime formats, and is memoized since the same dates
+# (season starts, common birthdays) come back over and over.
+
+SEASONS = ("winter", "spring", "summer", "fall")
+SEASON_ALIASES = {"autumn": "fall"}
+
+
+@lru_cache(maxsize=16384)
+def parse_date(value):
+    """
+    The date at the start of an ISO-style string, or None.
+
+    Missing month/day default to 1, and any time or UTC offset after the
+    date is ignored, so "1999-07-05T00:00:00+09:00" is 1999-07-05.
+    """
+    if not value or not isinstance(value, str):
+        return None
+    parts = value.strip()[:10].replace("/", "-").split("-")
+    if len(parts[0]) != 4:
+        return None
+    try:
+        year = int(parts[0])
+        month = int(parts[1]) if len(parts) > 1 and parts[1] else 1
+        day = int(parts[2][:2]) if len(parts) > 2 and parts[2][:2] else 1
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def parse_dates(values):
+    """parse_date() for a whole page of values"""
+    return [parse_date(value) for value in values]
+
+
+def normalize_season(season, year):
+    """
+    (season, year) with the season one of SEASONS and the year an int,
+    or (None, None) unless both are usable.
+    """
+    if not season or not year:
+        return None, None
+    season = season.strip().lower()
+    season = SEASON_ALIASES.get(season, season)
+    if season not in SEASONS:
+        return None, None
+    try:
+        return season, int(year)
+    except (TypeError, ValueError):
+        return None, None
+
+
+def season_label(season, year):
+    """The anime.season column value, e.g. 'Spring 2001', or None"""
+    season, year = normalize_season(season, year)
+    return f"{season.capitalize()} {year}" if season else None
+
+
+def normalize_anime(records):
+    """(release_date, season label) for each Anime record of a page"""
+    return [(parse_date(r.aired_from), season_label(r.season, r.year)) for r in records]
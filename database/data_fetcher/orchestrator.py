@@ -0,0 +1,393 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+import asyncpg
+from dotenv import load_dotenv
+
+from budget import REQUEST_BUDGET, dry_run
+from jikan_client import (
+    DEFAULT_RATE,
+    InstrumentedSession,
+    RateLimitedSession,
+    RateLimiter,
+    open_session,
+)
+from log_pipeline import setup_logging
+from metrics import (
+    METRICS_PORT,
+    STAGE_LATENCY,
+    STAGE_RUNS,
+    STAGES_RUNNING,
+    instrument_connection,
+    metrics_server,
+)
+
+load_dotenv()
+
+# Database configuration (shared by every stage through one pool)
+DB_CONFIG = {
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+    "database": os.getenv("DB_NAME"),
+    "host": os.getenv("DB_HOST"),
+    "port": int(os.getenv("DB_PORT", 5432)),
+    "ssl": os.getenv("DB_SSL", "require"),
+}
+
+POOL_MAX_SIZE = 10
+CONCURRENCY = 10  # Per-host connections; anime_images alone runs 10 requests at once
+STAGE_RETRIES = 2
+STAGE_RETRY_DELAY = 30  # Seconds, doubled after every failed attempt
+
+
+class Stage:
+    """One importer in the dependency graph"""
+
+    def __init__(self, name, run, depends_on=()):
+        self.name = name
+        self.run = run
+        self.depends_on = tuple(depends_on)
+
+
+class RunContext:
+    """Resources shared by every stage of a run"""
+
+    def __init__(self, pool, session):
+        self.pool = pool
+        self.session = session
+
+
+class StageFailed(Exception):
+    pass
+
+
+# The importers are imported lazily so that each stage only loads what it
+# runs and their module-level logging setup doesn't override ours.
+#
+# Every importer entry point takes an optional connection (or pool) and
+# session. Those passed in here belong to the run: the importer uses them
+# as-is, leaves them open, and re-raises critical errors after logging
+# them so that run_stage_with_retries can retry the stage.
+
+
+async def run_reference_data(ctx):
+    import reference_loader
+
+    async with ctx.pool.acquire() as conn:
+        await reference_loader.load_reference_data(conn)
+
+
+async def run_genres(ctx):
+    import genre_importer
+
+    async with ctx.pool.acquire() as conn:
+        await genre_importer.import_genre_data(conn=conn, session=ctx.session)
+
+
+async def run_companies(ctx):
+    import company_importer
+
+    async with ctx.pool.acquire() as conn:
+        await company_importer.import_company_data(conn=conn, session=ctx.session)
+
+
+async def run_anime(ctx):
+    import anime_importer
+
+    async with ctx.pool.acquire() as conn:
+        await anime_importer.import_anime_data(conn=conn, session=ctx.session)
+
+
+async def run_characters(ctx):
+    import character_importer
+
+    async with ctx.pool.acquire() as conn:
+        await character_importer.import_character_data(conn=conn, session=ctx.session)
+
+
+async def run_character_images(ctx):
+    import character_image_fetcher
+
+    await character_image_fetcher.fetch_character_images(pool=ctx.pool, session=ctx.session)
+
+
+async def run_voice_actor_images(ctx):
+    import voice_actor_importer
+
+    await voice_actor_importer.fetch_voice_actor_images(pool=ctx.pool, session=ctx.session)
+
+
+async def run_trailers(ctx):
+    import trailer_importer
+
+    await trailer_importer.fetch_anime_trailers(pool=ctx.pool, session=ctx.session)
+
+
+async def run_anime_images(ctx):
+    import images_test
+
+    await images_test.fetch_anime_images(pool=ctx.pool, session=ctx.session)
+
+
+async def run_search_index(ctx):
+    import search_index
+
+    await search_index.build_search_index(pool=ctx.pool)
+
+
+async def run_similar_anime(ctx):
+    import similar_anime
+
+    await similar_anime.compute_similar_anime(pool=ctx.pool)
+
+
+async def run_link_check(ctx):
+    import link_checker
+
+    # HEAD requests go to the image hosts, so this uses its own session too
+    await link_checker.check_links(pool=ctx.pool)
+
+
+async def run_image_mirror(ctx):
+    import image_mirror
+
+    # Downloads go to the image CDN, not Jikan, so the stage opens its own
+    # session instead of sharing the rate-limited one
+    await image_mirror.mirror_images(pool=ctx.pool)
+
+
+async def run_image_variants(ctx):
+    import image_variants
+
+    await image_variants.generate_variants(pool=ctx.pool)
+
+
+async def run_image_dedup(ctx):
+    import image_dedup
+
+    await image_dedup.dedup_images(pool=ctx.pool)
+
+
+# Stages are listed in a valid topological order
+STAGES = [
+    Stage("reference_data", run_reference_data),
+    # Seeds go first so the API importers see the names they already cover
+    Stage("genres", run_genres, depends_on=["reference_data"]),
+    Stage("companies", run_companies, depends_on=["reference_data"]),
+    Stage("anime", run_anime, depends_on=["genres", "companies"]),
+    Stage("characters", run_characters, depends_on=["anime"]),
+    # The importers index names as they write; this catches everything else
+    Stage("search_index", run_search_index, depends_on=["anime", "characters"]),
+    Stage("similar_anime", run_similar_anime, depends_on=["anime"]),
+    # Dead image links are removed before the image stages, which refill them
+    Stage("link_check", run_link_check),
+    Stage("anime_images", run_anime_images, depends_on=["anime", "link_check"]),
+    Stage("trailers", run_trailers, depends_on=["anime"]),
+    Stage("character_images", run_character_images, depends_on=["characters", "link_check"]),
+    Stage("voice_actor_images", run_voice_actor_images, depends_on=["characters", "link_check"]),
+    Stage(
+        "image_mirror",
+        run_image_mirror,
+        depends_on=["anime_images", "character_images", "voice_actor_images"],
+    ),
+    Stage("image_variants", run_image_variants, depends_on=["image_mirror"]),
+    Stage("image_dedup", run_image_dedup, depends_on=["image_mirror"]),
+]
+
+
+def select_stages(stages, only=None, skip=None):
+    """Pick the stages to run; dependencies outside the selection count as done"""
+    known = {stage.name for stage in stages}
+    for name in list(only or []) + list(skip or []):
+        if name not in known:
+            raise ValueError(f"Unknown stage '{name}' (known: {', '.join(sorted(known))})")
+
+    selected = []
+    for stage in stages:
+        if only and stage.name not in only:
+            continue
+        if skip and stage.name in skip:
+            continue
+        selected.append(stage)
+    return selected
+
+
+async def run_stage_with_retries(stage, ctx, retries):
+    """Run one stage, retrying it with exponential backoff when it raises"""
+    for attempt in range(retries + 1):
+        start_time = time.time()
+        STAGES_RUNNING.inc(stage=stage.name)
+        try:
+            logging.info(f"[{stage.name}] starting (attempt {attempt + 1}/{retries + 1})")
+            await stage.run(ctx)
+            logging.info(f"[{stage.name}] finished in {time.time() - start_time:.2f}s")
+            STAGE_RUNS.inc(stage=stage.name, result="ok")
+            return
+        except Exception as e:
+            logging.error(f"[{stage.name}] failed after {time.time() - start_time:.2f}s: {str(e)}")
+            STAGE_RUNS.inc(stage=stage.name, result="error")
+        finally:
+            STAGES_RUNNING.dec(stage=stage.name)
+            STAGE_LATENCY.observe(time.time() - start_time, stage=stage.name)
+        if attempt < retries:
+            delay = STAGE_RETRY_DELAY * (2 ** attempt)
+            logging.info(f"[{stage.name}] retrying in {delay}s")
+            await asyncio.sleep(delay)
+    raise StageFailed(stage.name)
+
+
+async def run_dag(stages, ctx, retries=STAGE_RETRIES):
+    """
+    Run stages as soon as their dependencies have finished.
+
+    Independent stages run concurrently; a failed stage skips everything
+    downstream of it. Returns a dict of stage name -> 'ok', 'failed' or
+    'skipped'.
+    """
+    names = {stage.name for stage in stages}
+    tasks = {}
+    results = {}
+
+    async def run(stage):
+        deps = [tasks[name] for name in stage.depends_on if name in names]
+        dep_results = await asyncio.gather(*deps, return_exceptions=True)
+        if any(isinstance(result, Exception) for result in dep_results):
+            logging.warning(f"[{stage.name}] skipped because a dependency failed")
+            results[stage.name] = "skipped"
+            raise StageFailed(stage.name)
+        try:
+            await run_stage_with_retries(stage, ctx, retries)
+        except StageFailed:
+            results[stage.name] = "failed"
+            raise
+        results[stage.name] = "ok"
+
+    for stage in stages:
+        tasks[stage.name] = asyncio.create_task(run(stage))
+    await asyncio.gather(*tasks.values(), return_exceptions=True)
+    return results
+
+
+async def run_pipeline(
+    only=None, skip=None, rate=DEFAULT_RATE, retries=STAGE_RETRIES, metrics_port=METRICS_PORT
+):
+    """Run the selected stages with one DB pool, one session and one rate budget"""
+    stages = select_stages(STAGES, only, skip)
+    logging.info(f"Running stages: {', '.join(stage.name for stage in stages)}")
+
+    async with metrics_server(metrics_port):
+        pool = await asyncpg.create_pool(
+            **DB_CONFIG, min_size=1, max_size=POOL_MAX_SIZE, init=instrument_connection
+        )
+        logging.info("Connected to database with connection pool")
+        try:
+            async with open_session(CONCURRENCY) as session:
+                limited = RateLimitedSession(InstrumentedSession(session), RateLimiter(rate))
+                results = await run_dag(stages, RunContext(pool, limited), retries)
+        finally:
+            await pool.close()
+            logging.info("Database connection pool closed")
+
+    for stage in stages:
+        logging.info(f"  {stage.name:<20} {results.get(stage.name, 'skipped')}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m data_fetcher", description="Run the data importers"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run importers as a dependency graph")
+    run_parser.add_argument("stages", nargs="*", help="Only run these stages (default: all)")
+    run_parser.add_argument("--skip", nargs="*", default=[], help="Stages to leave out")
+    run_parser.add_argument(
+        "--rate", type=float, default=DEFAULT_RATE,
+        help="Jikan requests per second shared by all stages",
+    )
+    run_parser.add_argument(
+        "--retries", type=int, default=STAGE_RETRIES, help="Retries per failed stage"
+    )
+    run_parser.add_argument(
+        "--metrics-port", type=int, default=METRICS_PORT,
+        help="Serve Prometheus metrics on this local port (0 disables)",
+    )
+    run_parser.add_argument(
+        "--dry-run", action="store_true",
+        help="Estimate requests and time per stage without calling the API",
+    )
+    run_parser.add_argument(
+        "--max-requests", type=int, default=None,
+        help="Stop cleanly once this many requests have been made",
+    )
+    run_parser.add_argument(
+        "--max-minutes", type=float, default=None, help="Stop cleanly after this long"
+    )
+
+    subparsers.add_parser("stages", help="List stages and their dependencies")
+
+    daemon_parser = subparsers.add_parser(
+        "daemon", help="Keep refreshing stale data and filling gaps until stopped"
+    )
+    daemon_parser.add_argument(
+        "--rate", type=float, default=None, help="Steady Jikan requests per second"
+    )
+    daemon_parser.add_argument("--workers", type=int, default=None, help="Concurrent work items")
+    daemon_parser.add_argument(
+        "--metrics-port", type=int, default=METRICS_PORT,
+        help="Serve Prometheus metrics on this local port (0 disables)",
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.command == "stages":
+        for stage in STAGES:
+            deps = ", ".join(stage.depends_on) or "-"
+            print(f"{stage.name:<20} depends on: {deps}")
+        return 0
+
+    setup_logging("data_fetcher.log")
+
+    if args.command == "daemon":
+        import daemon
+
+        logging.info("===== STARTING IMPORTER DAEMON =====")
+        asyncio.run(
+            daemon.run_daemon(
+                rate=args.rate or daemon.DAEMON_RATE,
+                workers=args.workers or daemon.DAEMON_WORKERS,
+                metrics_port=args.metrics_port,
+            )
+        )
+        return 0
+
+    REQUEST_BUDGET.configure(
+        args.max_requests, args.max_minutes * 60 if args.max_minutes else None
+    )
+    if args.dry_run:
+        stages = select_stages(STAGES, args.stages, args.skip)
+        asyncio.run(dry_run([stage.name for stage in stages], DB_CONFIG, rate=args.rate))
+        return 0
+
+    logging.info("===== STARTING IMPORT PIPELINE =====")
+    start_time = time.time()
+    results = asyncio.run(
+        run_pipeline(
+            args.stages,
+            args.skip,
+            rate=args.rate,
+            retries=args.retries,
+            metrics_port=args.metrics_port,
+        )
+    )
+    duration = time.time() - start_time
+    logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
+    return 0 if all(result == "ok" for result in results.values()) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
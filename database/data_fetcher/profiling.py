@@ -0,0 +1,209 @@
+import asyncio
+import collections
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import metrics_server, standalone_summary_path
+
+# Profiling is off unless an importer is started with --profile. Spans are
+# then recorded per stage (fetch, parse, transform, write) and tagged with
+# the entity being processed, and the run can additionally be wrapped in
+# cProfile or a sampling profiler.
+#
+#   --profile            spans only
+#   --profile=cprofile   spans + cProfile  (<name>.prof, for snakeviz/flameprof)
+#   --profile=sample     spans + sampler   (<name>.folded, for flamegraph.pl/speedscope)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", ".")
+SAMPLE_INTERVAL = 0.005  # Seconds between stack samples
+
+PROFILE_MODES = ("spans", "cprofile", "sample")
+
+_enabled = False
+_spans = []
+_current_entity = contextvars.ContextVar("current_entity", default=None)
+_run_start = time.perf_counter()
+
+
+def enabled():
+    return _enabled
+
+
+def set_entity(kind, entity_id):
+    """Tag spans and log lines from now on in this task with an entity"""
+    _current_entity.set(f"{kind}:{entity_id}")
+
+
+def current_entity():
+    return _current_entity.get()
+
+
+def record_span(stage, start, duration):
+    """Record a span measured elsewhere (start is a perf_counter value)"""
+    if _enabled:
+        _spans.append((stage, start, duration, _current_entity.get()))
+
+
+@contextmanager
+def span(stage):
+    """Time a block as one stage of the current entity"""
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _spans.append((stage, start, time.perf_counter() - start, _current_entity.get()))
+
+
+def stage_breakdown():
+    """Per-stage count, total, mean, p95 and max in seconds"""
+    by_stage = collections.defaultdict(list)
+    for stage, _, duration, _ in _spans:
+        by_stage[stage].append(duration)
+    rows = []
+    for stage, durations in by_stage.items():
+        durations.sort()
+        total = sum(durations)
+        rows.append({
+            "stage": stage,
+            "count": len(durations),
+            "total": total,
+            "mean": total / len(durations),
+            "p95": durations[min(len(durations) - 1, int(0.95 * len(durations)))],
+            "max": durations[-1],
+        })
+    rows.sort(key=lambda row: row["total"], reverse=True)
+    return rows
+
+
+def format_breakdown(rows, wall_time):
+    lines = [
+        f"{'stage':<12} {'count':>7} {'total s':>10} {'mean ms':>9} {'p95 ms':>9} {'max ms':>9} {'% wall':>7}",
+    ]
+    for row in rows:
+        lines.append(
+            f"{row['stage']:<12} {row['count']:>7} {row['total']:>10.2f} "
+            f"{row['mean'] * 1000:>9.1f} {row['p95'] * 1000:>9.1f} {row['max'] * 1000:>9.1f} "
+            f"{100 * row['total'] / wall_time if wall_time else 0:>6.1f}%"
+        )
+    return "\n".join(lines)
+
+
+def write_trace(path):
+    """Write spans in Chrome trace event format (chrome://tracing, Perfetto)"""
+    events = []
+    for stage, start, duration, entity in _spans:
+        event = {
+            "name": stage,
+            "ph": "X",
+            "ts": (start - _run_start) * 1e6,
+            "dur": duration * 1e6,
+            "pid": 1,
+            "tid": entity.split(":", 1)[0] if entity else "run",
+        }
+        if entity:
+            event["args"] = {"entity": entity}
+        events.append(event)
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events}, f)
+
+
+class SamplingProfiler:
+    """Samples the main thread's stack from a background thread into folded stacks"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write_folded(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def pop_profile_flag(argv):
+    """Remove --profile[=mode] from argv and return the mode (None if absent)"""
+    for i, arg in enumerate(argv):
+        if arg == "--profile" or arg.startswith("--profile="):
+            del argv[i]
+            mode = arg.partition("=")[2] or "spans"
+            if mode not in PROFILE_MODES:
+                raise SystemExit(f"Unknown profile mode '{mode}' (use one of {', '.join(PROFILE_MODES)})")
+            return mode
+    return None
+
+
+async def _serving_metrics(coro, name):
+    """Await the coroutine behind /metrics (when METRICS_PORT is set), then write its summary"""
+    async with metrics_server(summary_path=standalone_summary_path(name)):
+        return await coro
+
+
+def run(coro, mode=None, name="importer"):
+    """asyncio.run() the coroutine with metrics, profiling it when a mode is given"""
+    global _enabled, _run_start
+    if not mode:
+        return asyncio.run(_serving_metrics(coro, name))
+
+    _enabled = True
+    _spans.clear()
+    _run_start = time.perf_counter()
+    base = os.path.join(PROFILE_DIR, name)
+    profiler = None
+    sampler = None
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif mode == "sample":
+        sampler = SamplingProfiler()
+        sampler.start()
+
+    try:
+        return asyncio.run(_serving_metrics(coro, name))
+    finally:
+        wall_time = time.perf_counter() - _run_start
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(f"{base}.prof")
+            logging.info(f"cProfile stats written to {base}.prof")
+        if sampler:
+            sampler.stop()
+            sampler.write_folded(f"{base}.folded")
+            logging.info(f"Folded stacks written to {base}.folded")
+        write_trace(f"{base}.trace.json")
+        logging.info(f"Span trace written to {base}.trace.json")
+        logging.info(
+            f"Stage breakdown ({wall_time:.2f}s wall, stages overlap when concurrent):\n"
+            + format_breakdown(stage_breakdown(), wall_time)
+        )
+        _enabled = False
@@ -0,0 +1,200 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+
+import asyncpg
+
+# Reference data (major studios, custom genres, other dimension seeds) lives
+# in versioned JSON files under reference_data/ instead of in the importers:
+#
+#   {"version": 1, "table": "company", "key": "name",
+#    "columns": {"name": "text", "country": "text", "founded": "date"},
+#    "rows": [{"name": "Studio Ghibli", "country": "Japan", ...}, ...]}
+#
+# Each file is applied as one bulk statement that inserts the rows whose key
+# is not in the table yet and updates the non-key columns of the rows it
+# inserted on an earlier run (tracked in reference_data_row) where they
+# differ. Rows that already existed (imported from Jikan or added by hand)
+# are left alone. The file's checksum is recorded, so a file that hasn't
+# changed since it was last applied is skipped without touching its table;
+# `version` is informational, any edit to a file is applied.
+
+REFERENCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reference_data")
+
+# Column types a data file may declare; values are sent as text and cast
+COLUMN_TYPES = {"text", "date", "integer", "numeric", "boolean"}
+
+
+class ReferenceDataError(Exception):
+    pass
+
+
+class Dataset:
+    """One reference data file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        with open(path, "rb") as f:
+            raw = f.read()
+        self.checksum = hashlib.sha256(raw).hexdigest()
+        spec = json.loads(raw)
+        self.version = spec.get("version", 1)
+        self.table = spec["table"]
+        self.key = spec["key"]
+        self.columns = spec["columns"]
+        self.rows = spec["rows"]
+        self._validate()
+
+    def _validate(self):
+        identifiers = [self.table, self.key, *self.columns]
+        if not all(name.replace("_", "").isalnum() for name in identifiers):
+            raise ReferenceDataError(f"{self.path}: table and column names must be identifiers")
+        if self.key not in self.columns:
+            raise ReferenceDataError(f"{self.path}: key '{self.key}' is not a declared column")
+        unknown = set(self.columns.values()) - COLUMN_TYPES
+        if unknown:
+            raise ReferenceDataError(f"{self.path}: unsupported column types {sorted(unknown)}")
+        keys = [row.get(self.key) for row in self.rows]
+        if None in keys or len(set(keys)) != len(keys):
+            raise ReferenceDataError(f"{self.path}: every row needs a unique '{self.key}'")
+
+    def upsert_statement(self):
+        """
+        Insert missing rows and refresh the ones this dataset owns.
+
+        Parameters are one text array per column, then the dataset name;
+        returns one row of (inserted, updated).
+        """
+        names = list(self.columns)
+        dataset_param = f"${len(names) + 1}::text"
+        arrays = ", ".join(f"${i + 1}::text[]" for i in range(len(names)))
+        casts = ", ".join(f"u.{name}::{self.columns[name]} AS {name}" for name in names)
+        values = [name for name in names if name != self.key]
+        if values:
+            updated = f"""
+                UPDATE {self.table} t
+                SET {", ".join(f"{name} = s.{name}" for name in values)}
+                FROM source s
+                JOIN reference_data_row r ON r.dataset = {dataset_param} AND r.row_key = s.{self.key}::text
+                WHERE t.{self.key} = s.{self.key}
+                AND ({", ".join(f"t.{name}" for name in values)})
+                    IS DISTINCT FROM ({", ".join(f"s.{name}" for name in values)})
+                RETURNING 1
+            """
+        else:
+            updated = "SELECT 1 WHERE false"
+        return f"""
+            WITH source AS (
+                SELECT {casts}
+                FROM unnest({arrays}) AS u({", ".join(names)})
+            ),
+            updated AS ({updated}),
+            inserted AS (
+                INSERT INTO {self.table} ({", ".join(names)})
+                SELECT {", ".join(names)}
+                FROM source s
+                WHERE NOT EXISTS (SELECT 1 FROM {self.table} t WHERE t.{self.key} = s.{self.key})
+                RETURNING {self.key}
+            ),
+            owned AS (
+                INSERT INTO reference_data_row (dataset, row_key)
+                SELECT {dataset_param}, {self.key}::text FROM inserted
+                ON CONFLICT DO NOTHING
+            )
+            SELECT (SELECT COUNT(*) FROM inserted) AS inserted, (SELECT COUNT(*) FROM updated) AS updated
+        """
+
+    def column_arrays(self):
+        def as_text(value):
+            if value is None or isinstance(value, str):
+                return value
+            return json.dumps(value)
+
+        return [[as_text(row.get(name)) for row in self.rows] for name in self.columns]
+
+
+def discover(directory=REFERENCE_DIR):
+    """Every dataset in the directory, in file name order"""
+    return [Dataset(path) for path in sorted(glob.glob(os.path.join(directory, "*.json")))]
+
+
+async def apply_dataset(conn, dataset, force=False):
+    """
+    Insert the dataset's missing rows and refresh the ones it owns, unless
+    this exact file was applied before. Returns the number of rows inserted
+    or updated, or None when skipped.
+    """
+    async with conn.transaction():
+        stored = await conn.fetchval(
+            "SELECT checksum FROM reference_data_load WHERE dataset = $1 FOR UPDATE", dataset.name
+        )
+        if stored == dataset.checksum and not force:
+            logging.info(f"Reference data '{dataset.name}' unchanged, skipping")
+            return None
+
+        inserted, updated = await conn.fetchrow(
+            dataset.upsert_statement(), *dataset.column_arrays(), dataset.name
+        )
+        await conn.execute(
+            """
+            INSERT INTO reference_data_load (dataset, version, checksum, row_count)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (dataset) DO UPDATE
+            SET version = EXCLUDED.version,
+                checksum = EXCLUDED.checksum,
+                row_count = EXCLUDED.row_count,
+                loaded_at = NOW()
+            """,
+            dataset.name,
+            dataset.version,
+            dataset.checksum,
+            len(dataset.rows),
+        )
+    logging.info(
+        f"Reference data '{dataset.name}' v{dataset.version}: "
+        f"{inserted} of {len(dataset.rows)} rows inserted into {dataset.table}, {updated} updated"
+    )
+    return inserted + updated
+
+
+async def load_reference_data(conn, names=None, force=False, directory=REFERENCE_DIR):
+    """Apply all datasets (or only `names`); returns {dataset: rows written or None}"""
+    datasets = discover(directory)
+    if names:
+        unknown = set(names) - {dataset.name for dataset in datasets}
+        if unknown:
+            raise ReferenceDataError(f"Unknown reference datasets: {', '.join(sorted(unknown))}")
+        datasets = [dataset for dataset in datasets if dataset.name in names]
+
+    results = {}
+    for dataset in datasets:
+        results[dataset.name] = await apply_dataset(conn, dataset, force)
+    return results
+
+
+async def main(names, force=False):
+    from orchestrator import DB_CONFIG
+
+    conn = await asyncpg.connect(**DB_CONFIG)
+    try:
+        await load_reference_data(conn, names, force)
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import profiling
+    from log_pipeline import setup_logging
+
+    parser = argparse.ArgumentParser(description="Load reference data files into the database")
+    parser.add_argument("datasets", nargs="*", help="Only these datasets (default: all)")
+    parser.add_argument("--force", action="store_true", help="Apply files even if unchanged")
+    args = parser.parse_args()
+
+    setup_logging("reference_loader.log")
+    profiling.run(main(args.datasets, args.force), name="reference_loader")
@@ -0,0 +1,198 @@
+import logging
+import time
+
+import asyncpg
+
+from metrics import ENTITIES, SEARCH_ENTRIES, instrument_connection
+
+# Trigram search index over anime titles and character / voice actor names.
+#
+# search_entry holds one row per searchable name, with the name normalized
+# by the search_normalize() SQL function (case folding, accents and
+# romanization variants such as "ou" / "ō" / "o", punctuation) and a pg_trgm
+# GIN index on the result. The normalization lives in the database so the
+# backend can run it on the query text as well:
+#
+#   SELECT entity_type, entity_id FROM search_entry
+#   WHERE normalized % search_normalize($1)
+#   ORDER BY similarity(normalized, search_normalize($1)) DESC
+#
+# upsert_entity() indexes names as the importers write them; the
+# search_index stage backfills whatever was written some other way.
+#
+# The same stage backfills the weighted full-text columns (anime and
+# characters .search_vector). Triggers compute those inside every INSERT or
+# UPDATE of the searched columns, so only rows written before the columns
+# existed are still NULL.
+
+# entity_type -> (table, id column, searchable columns)
+SEARCH_SOURCES = {
+    "anime": ("anime", "anime_id", ("title", "alternative_title")),
+    "character": ("characters", "character_id", ("name",)),
+    "voice_actor": ("voice_actor", "voice_actor_id", ("name",)),
+}
+# entity_type -> (table, id column, vector expression shared with the trigger)
+FULLTEXT_SOURCES = {
+    "anime": ("anime", "anime_id", "anime_search_vector(title, alternative_title, synopsis)"),
+    "character": ("characters", "character_id", "character_search_vector(name, description)"),
+}
+BACKFILL_CHUNK = 5000  # Source ids per backfill statement
+
+UPSERT_ENTRIES = """
+    INSERT INTO search_entry (entity_type, entity_id, field, name, normalized)
+    SELECT $1, $2, u.field, u.name, search_normalize(u.name)
+    FROM unnest($3::text[], $4::text[]) AS u(field, name)
+    ON CONFLICT (entity_type, entity_id, field) DO UPDATE
+    SET name = EXCLUDED.name,
+        normalized = EXCLUDED.normalized,
+        indexed_at = NOW()
+    WHERE search_entry.name IS DISTINCT FROM EXCLUDED.name
+"""
+
+DELETE_ENTRIES = """
+    DELETE FROM search_entry
+    WHERE entity_type = $1 AND entity_id = $2 AND field = ANY($3::text[])
+"""
+
+
+def searched_fields(entity_type):
+    source = SEARCH_SOURCES.get(entity_type)
+    return source[2] if source else ()
+
+
+async def index_entity(conn, entity_type, entity_id, names):
+    """
+    Index the given {field: name} of one entity; blank names are removed.
+
+    Names are trimmed of spaces only, like btrim() in the backfill, so both
+    paths store the same text and the backfill doesn't keep rewriting it.
+    """
+    present = {field: name.strip(" ") for field, name in names.items() if name and name.strip(" ")}
+    blank = [field for field in names if field not in present]
+    if present:
+        await conn.execute(UPSERT_ENTRIES, entity_type, entity_id, list(present), list(present.values()))
+    if blank:
+        await conn.execute(DELETE_ENTRIES, entity_type, entity_id, blank)
+
+
+async def index_changed(conn, entity_type, entity_id, columns, changed):
+    """Re-index the searchable columns of a write that changed"""
+    names = {
+        field: columns[field]
+        for field in searched_fields(entity_type)
+        if field in columns and field in changed
+    }
+    if names:
+        await index_entity(conn, entity_type, entity_id, names)
+
+
+def backfill_statement(entity_type, field):
+    table, id_column, _ = SEARCH_SOURCES[entity_type]
+    return f"""
+        INSERT INTO search_entry (entity_type, entity_id, field, name, normalized)
+        SELECT '{entity_type}', t.{id_column}, '{field}', btrim(t.{field}), search_normalize(t.{field})
+        FROM {table} t
+        LEFT JOIN search_entry s
+            ON s.entity_type = '{entity_type}' AND s.entity_id = t.{id_column} AND s.field = '{field}'
+        WHERE t.{id_column} > $1 AND t.{id_column} <= $2
+        AND btrim(t.{field}) <> ''
+        AND s.name IS DISTINCT FROM btrim(t.{field})
+        ON CONFLICT (entity_type, entity_id, field) DO UPDATE
+        SET name = EXCLUDED.name,
+            normalized = EXCLUDED.normalized,
+            indexed_at = NOW()
+    """
+
+
+def prune_statement(entity_type, field):
+    """Entries whose entity is gone or whose name is now blank"""
+    table, id_column, _ = SEARCH_SOURCES[entity_type]
+    return f"""
+        DELETE FROM search_entry s
+        WHERE s.entity_type = '{entity_type}' AND s.field = '{field}'
+        AND NOT EXISTS (
+            SELECT 1 FROM {table} t
+            WHERE t.{id_column} = s.entity_id AND btrim(t.{field}) <> ''
+        )
+    """
+
+
+async def backfill(conn, entity_types=None, chunk=BACKFILL_CHUNK):
+    """
+    Bring search_entry in line with the source tables, one id range at a
+    time, rewriting only names that are missing or differ. Returns the
+    number of entries written.
+    """
+    total = 0
+    for entity_type in entity_types or SEARCH_SOURCES:
+        table, id_column, fields = SEARCH_SOURCES[entity_type]
+        max_id = await conn.fetchval(f"SELECT MAX({id_column}) FROM {table}") or 0
+        for field in fields:
+            statement = backfill_statement(entity_type, field)
+            written = 0
+            for low in range(0, max_id, chunk):
+                status = await conn.execute(statement, low, low + chunk)
+                written += int(status.split()[-1])
+            status = await conn.execute(prune_statement(entity_type, field))
+            pruned = int(status.split()[-1])
+            indexed = await conn.fetchval(
+                "SELECT COUNT(*) FROM search_entry WHERE entity_type = $1 AND field = $2", entity_type, field
+            )
+            SEARCH_ENTRIES.inc(written, entity_type=entity_type)
+            ENTITIES.inc(written, kind="search_entry", result="imported")
+            ENTITIES.inc(indexed - written, kind="search_entry", result="skipped")
+            logging.info(f"Search index {entity_type}.{field}: {written} written, {pruned} pruned")
+            total += written
+    return total
+
+
+async def backfill_vectors(conn, entity_types=None, chunk=BACKFILL_CHUNK):
+    """Fill search_vector wherever it is NULL, one id range per statement"""
+    total = 0
+    for entity_type in entity_types or FULLTEXT_SOURCES:
+        table, id_column, expression = FULLTEXT_SOURCES[entity_type]
+        max_id = await conn.fetchval(f"SELECT MAX({id_column}) FROM {table}") or 0
+        statement = f"""
+            UPDATE {table} SET search_vector = {expression}
+            WHERE {id_column} > $1 AND {id_column} <= $2 AND search_vector IS NULL
+        """
+        filled = 0
+        for low in range(0, max_id, chunk):
+            status = await conn.execute(statement, low, low + chunk)
+            filled += int(status.split()[-1])
+        logging.info(f"Full-text vectors for {table}: {filled} backfilled")
+        total += filled
+    return total
+
+
+async def build_search_index(pool=None, db_config=None):
+    own_pool = pool is None
+    if own_pool:
+        pool = await asyncpg.create_pool(**db_config, min_size=1, max_size=1, init=instrument_connection)
+    start_time = time.time()
+    try:
+        async with pool.acquire() as conn:
+            total = await backfill(conn)
+            vectors = await backfill_vectors(conn)
+    finally:
+        if own_pool:
+            await pool.close()
+    logging.info(
+        f"Search index: {total} entries written, {vectors} vectors backfilled "
+        f"in {time.time() - start_time:.2f}s"
+    )
+    return total
+
+
+async def main():
+    from orchestrator import DB_CONFIG
+
+    await build_search_index(db_config=DB_CONFIG)
+
+
+if __name__ == "__main__":
+    import profiling
+    from log_pipeline import setup_logging
+
+    setup_logging("search_index.log")
+    profiling.run(main(), name="search_index")
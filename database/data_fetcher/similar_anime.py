@@ -0,0 +1,246 @@
+import hashlib
+import logging
+import os
+import time
+
+import asyncpg
+import numpy as np
+from scipy import sparse
+
+from metrics import ENTITIES, SIMILARITY_ROWS, instrument_connection
+
+# Precomputed "similar titles" from genre co-occurrence.
+#
+# anime_genre is loaded into a sparse anime x genre matrix, each genre
+# weighted by its inverse document frequency (a shared niche genre says more
+# than a shared "Action") and each row scaled to unit length, so one sparse
+# product gives the cosine similarity of a block of anime against all of
+# them. The top SIMILAR_ANIME_TOP_K neighbours per anime are written to
+# anime_similarity with a single COPY.
+#
+# anime_similarity_state keeps a hash of each anime's genre set. Later runs
+# only recompute the anime whose genres changed, the anime that list one of
+# them as a neighbour, and the anime one of them now beats the weakest
+# neighbour of. The IDF weights drift a little between full runs; --full (or
+# more than FULL_RECOMPUTE_RATIO of the catalog changing) recomputes all.
+
+TOP_K = int(os.getenv("SIMILAR_ANIME_TOP_K", 20))
+BLOCK_BYTES = int(os.getenv("SIMILAR_ANIME_BLOCK_MB", 64)) * 1024 * 1024  # Dense block budget
+FULL_RECOMPUTE_RATIO = 0.2
+
+SAVE_STATE = """
+    INSERT INTO anime_similarity_state (anime_id, genre_hash)
+    SELECT * FROM unnest($1::int[], $2::bigint[])
+    ON CONFLICT (anime_id) DO UPDATE
+    SET genre_hash = EXCLUDED.genre_hash,
+        computed_at = NOW()
+"""
+
+
+def genre_hash(genre_ids):
+    """Stable signed 64-bit hash of a sorted genre id array"""
+    digest = hashlib.blake2b(np.asarray(genre_ids, dtype=np.int64).tobytes(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def build_matrix(anime_ids, genre_ids):
+    """
+    Binary CSR matrix from (anime_id, genre_id) pairs.
+
+    Returns (matrix, anime ids of its rows, genre ids of its columns), both
+    in ascending order.
+    """
+    rows_ids, rows = np.unique(anime_ids, return_inverse=True)
+    column_ids, cols = np.unique(genre_ids, return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+        shape=(len(rows_ids), cols.max() + 1 if len(cols) else 0),
+    )
+    matrix.sum_duplicates()
+    matrix.data[:] = 1.0
+    return matrix, rows_ids, column_ids
+
+
+def idf_normalize(matrix):
+    """Weight columns by smoothed IDF and scale rows to unit L2 norm"""
+    document_frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    idf = np.log((1 + matrix.shape[0]) / (1 + document_frequency)) + 1.0
+    weighted = matrix @ sparse.diags(idf.astype(np.float32))
+    norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.csr_matrix(sparse.diags(1.0 / norms) @ weighted, dtype=np.float32)
+
+
+def row_hashes(matrix, genre_ids):
+    """genre_hash() of every row's genre ids"""
+    return np.array(
+        [
+            genre_hash(np.sort(genre_ids[matrix.indices[matrix.indptr[i] : matrix.indptr[i + 1]]]))
+            for i in range(matrix.shape[0])
+        ],
+        dtype=np.int64,
+    )
+
+
+def chunk_rows_for(catalog_size, block_bytes=BLOCK_BYTES):
+    """
+    Anime per dense block so that the float32 block and the int64 partition
+    indices of one block (12 bytes per cell) stay within block_bytes.
+    """
+    return max(1, block_bytes // (12 * max(catalog_size, 1)))
+
+
+def top_neighbours(vectors, rows, k=TOP_K, chunk_rows=None):
+    """
+    Yield (row, neighbour rows, scores) for each of `rows`, best first.
+
+    Similarities are computed one dense block of chunk_rows x catalog at a
+    time, sized from BLOCK_BYTES unless given; the row itself and zero
+    similarities are left out.
+    """
+    k = min(k, vectors.shape[0] - 1)
+    if k <= 0:
+        return
+    chunk_rows = chunk_rows or chunk_rows_for(vectors.shape[0])
+    transposed = vectors.T.tocsc()
+    for start in range(0, len(rows), chunk_rows):
+        block_rows = rows[start : start + chunk_rows]
+        block = (vectors[block_rows] @ transposed).toarray()
+        block[np.arange(len(block_rows)), block_rows] = -1.0
+        # The k largest per row, partitioned in place of a negated copy; only
+        # the k kept columns of the index array outlive this line
+        candidates = np.argpartition(block, -k, axis=1)[:, -k:].copy()
+        scores = np.take_along_axis(block, candidates, axis=1)
+        order = np.argsort(-scores, axis=1, kind="stable")
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        for row, neighbours, row_scores in zip(block_rows, candidates, scores):
+            keep = row_scores > 0
+            yield row, neighbours[keep], row_scores[keep]
+
+
+async def affected_rows(conn, vectors, anime_ids, changed, removed, k=TOP_K):
+    """
+    Rows to recompute when only `changed` rows have new genres (and the
+    `removed` anime have none left): the changed rows, rows listing a
+    changed or removed anime as a neighbour, and rows whose weakest stored
+    neighbour a changed one now beats (or whose list isn't full yet).
+    """
+    affected = set(changed.tolist())
+    referencing = await conn.fetch(
+        "SELECT DISTINCT anime_id FROM anime_similarity WHERE similar_anime_id = ANY($1::int[])",
+        anime_ids[changed].tolist() + removed,
+    )
+    weakest = await conn.fetch(
+        "SELECT anime_id, MIN(score) AS score, COUNT(*) AS neighbours FROM anime_similarity GROUP BY anime_id"
+    )
+    position = {anime_id: row for row, anime_id in enumerate(anime_ids.tolist())}
+    affected.update(position[r["anime_id"]] for r in referencing if r["anime_id"] in position)
+    if not len(changed):
+        return np.array(sorted(affected), dtype=np.int64)
+
+    threshold = np.zeros(len(anime_ids), dtype=np.float32)  # No list yet: any match counts
+    for record in weakest:
+        row = position.get(record["anime_id"])
+        if row is not None and record["neighbours"] >= min(k, len(anime_ids) - 1):
+            threshold[row] = record["score"]
+
+    best_new = np.asarray((vectors @ vectors[changed].T).max(axis=1).todense()).ravel()
+    beaten = np.flatnonzero(best_new > threshold)
+    affected.update(beaten.tolist())
+    return np.array(sorted(affected), dtype=np.int64)
+
+
+async def compute_similar_anime(pool=None, db_config=None, full=False, k=TOP_K):
+    """Recompute the top-k similar anime of every anime whose neighbourhood changed"""
+    own_pool = pool is None
+    if own_pool:
+        pool = await asyncpg.create_pool(**db_config, min_size=1, max_size=1, init=instrument_connection)
+    start_time = time.time()
+    try:
+        async with pool.acquire() as conn:
+            pairs = await conn.fetch("SELECT anime_id, genre_id FROM anime_genre")
+            stored = dict(await conn.fetch("SELECT anime_id, genre_hash FROM anime_similarity_state"))
+            if not pairs:
+                logging.info("Similar anime: no anime_genre links yet")
+                return 0
+
+            matrix, anime_ids, genre_ids = build_matrix(
+                np.fromiter((p["anime_id"] for p in pairs), dtype=np.int64, count=len(pairs)),
+                np.fromiter((p["genre_id"] for p in pairs), dtype=np.int64, count=len(pairs)),
+            )
+            pairs = None
+            vectors = idf_normalize(matrix)
+            hashes = row_hashes(matrix, genre_ids)
+            previous = np.array([stored.get(anime_id, 0) for anime_id in anime_ids.tolist()], dtype=np.int64)
+            known = np.array([anime_id in stored for anime_id in anime_ids.tolist()])
+            changed = np.flatnonzero(~known | (hashes != previous))
+            removed = sorted(set(stored) - set(anime_ids.tolist()))
+
+            if full or not stored or len(changed) > FULL_RECOMPUTE_RATIO * len(anime_ids):
+                rows = np.arange(len(anime_ids))
+                logging.info(f"Similar anime: full recompute of {len(rows)} anime")
+            elif len(changed) or removed:
+                rows = await affected_rows(conn, vectors, anime_ids, changed, removed, k)
+                logging.info(
+                    f"Similar anime: {len(changed)} changed, {len(removed)} removed, "
+                    f"{len(rows)} to recompute"
+                )
+            else:
+                logging.info("Similar anime: no genre changes since the last run")
+                return 0
+
+            records = []
+            for row, neighbours, scores in top_neighbours(vectors, rows, k):
+                anime_id = int(anime_ids[row])
+                records.extend(
+                    (anime_id, int(anime_ids[neighbour]), rank, float(score))
+                    for rank, (neighbour, score) in enumerate(zip(neighbours, scores), 1)
+                )
+
+            async with conn.transaction():
+                await conn.execute(
+                    "DELETE FROM anime_similarity WHERE anime_id = ANY($1::int[])",
+                    anime_ids[rows].tolist() + removed,
+                )
+                await conn.copy_records_to_table(
+                    "anime_similarity",
+                    records=records,
+                    columns=["anime_id", "similar_anime_id", "rank", "score"],
+                )
+                await conn.execute(SAVE_STATE, anime_ids[changed].tolist(), hashes[changed].tolist())
+                if removed:
+                    await conn.execute(
+                        "DELETE FROM anime_similarity_state WHERE anime_id = ANY($1::int[])", removed
+                    )
+    finally:
+        if own_pool:
+            await pool.close()
+
+    SIMILARITY_ROWS.inc(len(records))
+    ENTITIES.inc(len(rows), kind="similar_anime", result="imported")
+    logging.info(
+        f"Similar anime: {len(records)} neighbours for {len(rows)} anime "
+        f"written in {time.time() - start_time:.2f}s"
+    )
+    return len(rows)
+
+
+async def main(full=False):
+    from orchestrator import DB_CONFIG
+
+    await compute_similar_anime(db_config=DB_CONFIG, full=full)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import profiling
+    from log_pipeline import setup_logging
+
+    parser = argparse.ArgumentParser(description="Precompute similar anime from shared genres")
+    parser.add_argument("--full", action="store_true", help="Recompute every anime")
+    args = parser.parse_args()
+
+    setup_logging("similar_anime.log")
+    profiling.run(main(full=args.full), name="similar_anime")
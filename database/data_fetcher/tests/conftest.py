@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The importers import their siblings as top-level modules (see __main__.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,50 @@
+import pytest
+
+from attribute_extractor import COUNTRIES, AttributeExtractor, infer_country
+
+EXTRACTOR = AttributeExtractor({
+    "Japan": {"japan": 1.0, "tokyo": 0.5},
+    "United States": {"usa": 1.0, "united states": 1.0},
+    "United Kingdom": {"uk": 1.0, "united kingdom": 1.0},
+})
+
+
+def test_extract_ranks_values_by_share_of_weight():
+    assert EXTRACTOR.extract("Founded in Tokyo, Japan, with a branch in the USA") == [
+        ("Japan", 0.6),
+        ("United States", 0.4),
+    ]
+
+
+@pytest.mark.parametrize("text", ["Its usage grew", "Pukka studio", "Japanese", "tokyoites"])
+def test_extract_only_matches_whole_words(text):
+    assert EXTRACTOR.extract(text) == []
+
+
+def test_extract_matches_at_punctuation_and_ignores_case():
+    assert EXTRACTOR.extract("A TOKYO-based studio") == [("Japan", 1.0)]
+
+
+def test_extract_prefers_the_longest_keyword():
+    assert EXTRACTOR.matches("the United Kingdom") == [("United Kingdom", "United Kingdom", 4)]
+
+
+def test_extract_breaks_ties_by_vocabulary_order():
+    assert EXTRACTOR.extract("UK and Japan") == [("Japan", 0.5), ("United Kingdom", 0.5)]
+
+
+@pytest.mark.parametrize("text", [None, ""])
+def test_extract_handles_missing_text(text):
+    assert EXTRACTOR.extract(text) == []
+    assert EXTRACTOR.best(text, default="Japan") == ("Japan", 0.0)
+
+
+def test_extract_many_matches_extract():
+    texts = ["Based in Tokyo", None, "usa", "japan\nusa", "Osaka and Seoul"]
+    assert COUNTRIES.extract_many(texts) == [COUNTRIES.extract(text) for text in texts]
+
+
+def test_infer_country_falls_back_to_the_name():
+    assert infer_country("A Korean studio", "Toei") == ("South Korea", 1.0)
+    assert infer_country("", "Walt Disney Pictures") == ("United States", 0.5)
+    assert infer_country(None, "Unknown Co.") == ("Japan", 0.0)
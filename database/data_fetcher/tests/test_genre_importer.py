@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+from models import Genre
+
+
+@pytest.fixture(scope="module")
+def genre_importer(tmp_path_factory):
+    # The importer sets up its log file in the working directory on import
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("logs"))
+    try:
+        import genre_importer
+    finally:
+        os.chdir(cwd)
+    return genre_importer
+
+
+def test_merge_genres_prefers_anime_genres_by_name(genre_importer):
+    anime = [{"mal_id": 1, "name": "Action", "count": 5000}, {"mal_id": 4, "name": "Comedy", "count": 7000}]
+    manga = [{"mal_id": 1, "name": "Action", "count": 9000}, {"mal_id": 41, "name": "Josei", "count": 800}]
+    assert genre_importer.merge_genres(anime, manga) == [
+        ("genre", Genre(1, "Action", 5000)),
+        ("genre", Genre(4, "Comedy", 7000)),
+        ("manga_genre", Genre(41, "Josei", 800)),
+    ]
+
+
+def test_merge_genres_keeps_the_first_entry_of_a_name(genre_importer):
+    anime = [{"mal_id": 1, "name": "Action"}, {"mal_id": 99, "name": "Action"}]
+    assert genre_importer.merge_genres(anime, []) == [("genre", Genre(1, "Action"))]
+
+
+def test_merge_genres_skips_unnamed_and_missing_lists(genre_importer):
+    anime = [{"mal_id": 1, "name": ""}, {"mal_id": 2}, None]
+    assert genre_importer.merge_genres(anime, None) == []
@@ -0,0 +1,38 @@
+import pytest
+
+from image_dedup import HAMMING_THRESHOLD, hamming, near_duplicates
+
+
+@pytest.mark.parametrize(
+    "a, b, expected",
+    [
+        (0, 0, 0),
+        (0b1011, 0b0001, 2),
+        (0, 0xFFFFFFFFFFFFFFFF, 64),
+        # Hashes are stored as signed BIGINTs; -1 is all 64 bits set
+        (-1, 0, 64),
+        (-1, 0x7FFFFFFFFFFFFFFF, 1),
+    ],
+)
+def test_hamming(a, b, expected):
+    assert hamming(a, b) == expected
+    assert hamming(b, a) == expected
+
+
+def test_near_duplicates_keeps_the_oldest_of_each_group():
+    close = (1 << HAMMING_THRESHOLD) - 1  # Differs from 0 in HAMMING_THRESHOLD bits
+    far = (1 << (HAMMING_THRESHOLD + 1)) - 1
+    images = [(10, 0), (11, close), (12, far), (13, far ^ 1)]
+    assert near_duplicates(images) == [11, 13]
+
+
+def test_near_duplicates_compares_against_kept_images_only():
+    # 2 is a duplicate of 1; 3 is within the threshold of 2 but not of 1,
+    # and 2 is dropped, so 3 stays
+    images = [(1, 0b000), (2, 0b001), (3, 0b011)]
+    assert near_duplicates(images, threshold=1) == [2]
+    assert near_duplicates(images, threshold=0) == []
+
+
+def test_near_duplicates_of_nothing():
+    assert near_duplicates([]) == []
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from link_checker import (
+    DEAD_AFTER,
+    DEAD_MIN_AGE,
+    MAX_RECHECK,
+    MIN_RECHECK,
+    RECHECK_AGE_FACTOR,
+    RETRY_AFTER,
+    next_state,
+    recheck_after,
+)
+
+NOW = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def record(failures=0, first_ok_at=None, first_failed_at=None, dead_since=None):
+    return {
+        "failures": failures,
+        "first_ok_at": first_ok_at,
+        "first_failed_at": first_failed_at,
+        "dead_since": dead_since,
+    }
+
+
+def test_recheck_after_grows_with_the_age_of_a_live_link():
+    assert recheck_after("alive", None, 0, None, NOW) == MIN_RECHECK
+    age = timedelta(days=30)
+    assert recheck_after("alive", NOW - age, 0, None, NOW) == pytest.approx(
+        age.total_seconds() * RECHECK_AGE_FACTOR
+    )
+    assert recheck_after("alive", NOW - timedelta(days=3650), 0, None, NOW) == MAX_RECHECK
+
+
+def test_recheck_after_backs_off_a_failing_link():
+    assert recheck_after("gone", None, 1, None, NOW) == RETRY_AFTER
+    assert recheck_after("failed", None, 2, None, NOW) == 2 * RETRY_AFTER
+    assert recheck_after("gone", None, 50, None, NOW) == MIN_RECHECK
+    assert recheck_after("gone", None, 50, NOW, NOW) == MAX_RECHECK
+
+
+def test_next_state_of_a_live_link_keeps_its_first_success():
+    since = NOW - timedelta(days=10)
+    assert next_state("alive", record(first_ok_at=since), NOW) == (0, since, None, None)
+    assert next_state("alive", record(failures=2, first_failed_at=since), NOW) == (0, NOW, None, None)
+
+
+def test_next_state_counts_failures_from_the_first_one():
+    since = NOW - timedelta(hours=1)
+    assert next_state("gone", record(first_ok_at=NOW), NOW) == (1, None, NOW, None)
+    assert next_state("gone", record(failures=1, first_failed_at=since), NOW) == (2, None, since, None)
+
+
+def test_next_state_marks_dead_after_enough_failures_over_enough_time():
+    recent = NOW - timedelta(seconds=DEAD_MIN_AGE - 1)
+    old = NOW - timedelta(seconds=DEAD_MIN_AGE)
+    # Enough failures, but all within DEAD_MIN_AGE
+    state = next_state("gone", record(failures=DEAD_AFTER - 1, first_failed_at=recent), NOW)
+    assert state[3] is None
+    # Long enough, but not enough failures yet
+    state = next_state("gone", record(failures=DEAD_AFTER - 2, first_failed_at=old), NOW)
+    assert state[3] is None
+    state = next_state("gone", record(failures=DEAD_AFTER - 1, first_failed_at=old), NOW)
+    assert state == (DEAD_AFTER, None, old, NOW)
+
+
+def test_next_state_keeps_the_time_a_link_died():
+    died = NOW - timedelta(days=5)
+    state = next_state("gone", record(failures=9, first_failed_at=died, dead_since=died), NOW)
+    assert state == (10, None, died, died)
+    assert next_state("alive", record(failures=9, dead_since=died), NOW) == (0, NOW, None, None)
@@ -0,0 +1,22 @@
+import pytest
+
+from metrics import endpoint_label
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("https://api.jikan.moe/v4/anime/5114/full", "/anime/{id}/full"),
+        ("https://api.jikan.moe/v4/anime?page=3&limit=25", "/anime"),
+        ("https://api.jikan.moe/v4/characters/417/full", "/characters/{id}/full"),
+        ("https://api.jikan.moe/v4/people/118", "/people/{id}"),
+        ("https://api.jikan.moe/v4/genres/anime", "/genres/anime"),
+        ("http://localhost:8080/v4/producers/1", "/producers/{id}"),
+        ("/v4/anime/1/characters", "/anime/{id}/characters"),
+        # Only whole numeric segments are ids
+        ("https://api.jikan.moe/v4/top/anime/v2", "/top/anime/v2"),
+        ("https://api.jikan.moe/v4/seasons/2001/spring", "/seasons/{id}/spring"),
+    ],
+)
+def test_endpoint_label(url, expected):
+    assert endpoint_label(url) == expected
@@ -0,0 +1,54 @@
+from datetime import date
+
+import pytest
+
+from models import Anime
+from normalize import normalize_anime, parse_date, parse_dates, season_label
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("2001-04-03T00:00:00+00:00", date(2001, 4, 3)),
+        ("1999-07-05T00:00:00+09:00", date(1999, 7, 5)),
+        ("2001/04/03", date(2001, 4, 3)),
+        ("2001-04", date(2001, 4, 1)),
+        ("2001", date(2001, 1, 1)),
+        ("  2001-04-03 ", date(2001, 4, 3)),
+    ],
+)
+def test_parse_date(value, expected):
+    assert parse_date(value) == expected
+
+
+@pytest.mark.parametrize("value", [None, "", 2001, "01-04-03", "2001-13-01", "2001-02-30", "unknown"])
+def test_parse_date_rejects_unusable_values(value):
+    assert parse_date(value) is None
+
+
+def test_parse_dates_keeps_page_order():
+    assert parse_dates(["2001", None, "1999-07"]) == [date(2001, 1, 1), None, date(1999, 7, 1)]
+
+
+@pytest.mark.parametrize(
+    "season, year, expected",
+    [
+        ("spring", 2001, "Spring 2001"),
+        (" Fall ", "1998", "Fall 1998"),
+        ("autumn", 2010, "Fall 2010"),
+        ("monsoon", 2010, None),
+        ("winter", None, None),
+        (None, 2001, None),
+        ("summer", "n/a", None),
+    ],
+)
+def test_season_label(season, year, expected):
+    assert season_label(season, year) == expected
+
+
+def test_normalize_anime():
+    records = [
+        Anime(1, "Cowboy Bebop", aired_from="1998-04-03T00:00:00+00:00", season="spring", year=1998),
+        Anime(2, "Unaired"),
+    ]
+    assert normalize_anime(records) == [(date(1998, 4, 3), "Spring 1998"), (None, None)]
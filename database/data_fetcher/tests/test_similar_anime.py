@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+from similar_anime import build_matrix, chunk_rows_for, idf_normalize, top_neighbours
+
+
+def test_build_matrix_sorts_ids_and_collapses_duplicate_pairs():
+    matrix, anime_ids, genre_ids = build_matrix([30, 10, 10, 30, 10], [7, 2, 7, 7, 2])
+    assert anime_ids.tolist() == [10, 30]
+    assert genre_ids.tolist() == [2, 7]
+    assert matrix.toarray().tolist() == [[1.0, 1.0], [0.0, 1.0]]
+
+
+def test_idf_normalize_weights_rare_genres_and_scales_rows():
+    matrix = sparse.csr_matrix(
+        np.array([[1, 1], [1, 0], [1, 0], [0, 0]], dtype=np.float32)
+    )
+    vectors = idf_normalize(matrix).toarray()
+    norms = np.linalg.norm(vectors, axis=1)
+    assert norms[:3] == pytest.approx([1.0, 1.0, 1.0])
+    assert norms[3] == 0.0  # No genres, no direction
+    # Genre 1 is rarer than genre 0, so it dominates the row that has both
+    assert vectors[0, 1] > vectors[0, 0]
+
+
+def _dense_top(vectors, k):
+    similarities = (vectors @ vectors.T).toarray()
+    np.fill_diagonal(similarities, -1.0)
+    expected = {}
+    for row, scores in enumerate(similarities):
+        order = np.argsort(-scores, kind="stable")[:k]
+        expected[row] = [(int(i), scores[i]) for i in order if scores[i] > 0]
+    return expected
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 3, 64])
+def test_top_neighbours_matches_a_dense_computation(chunk_rows):
+    rng = np.random.default_rng(0)
+    matrix = sparse.csr_matrix((rng.random((40, 12)) < 0.25).astype(np.float32))
+    vectors = idf_normalize(matrix)
+    expected = _dense_top(vectors, k=5)
+
+    rows = np.arange(vectors.shape[0])
+    seen = set()
+    for row, neighbours, scores in top_neighbours(vectors, rows, k=5, chunk_rows=chunk_rows):
+        seen.add(int(row))
+        assert row not in neighbours
+        assert list(scores) == sorted(scores, reverse=True)
+        assert scores.tolist() == pytest.approx([score for _, score in expected[row]])
+        # Ties may come back in either order, so compare the scores per neighbour
+        assert all(
+            scores[i] == pytest.approx(vectors[row].multiply(vectors[n]).sum())
+            for i, n in enumerate(neighbours)
+        )
+    assert seen == set(rows.tolist())
+
+
+def test_top_neighbours_of_a_single_anime():
+    vectors = idf_normalize(sparse.csr_matrix(np.ones((1, 3), dtype=np.float32)))
+    assert list(top_neighbours(vectors, np.arange(1))) == []
+
+
+def test_chunk_rows_for_fits_the_block():
+    assert chunk_rows_for(1000, block_bytes=12 * 1000 * 50) == 50
+    assert chunk_rows_for(10**9, block_bytes=1024) == 1
+    assert chunk_rows_for(0, block_bytes=120) == 10
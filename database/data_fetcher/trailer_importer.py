@@ -6,17 +6,16 @@ import logging
 import os
 from dotenv import load_dotenv
 
+from budget import REQUEST_BUDGET
+from jikan_client import client_session, entity_deadline
+from log_pipeline import setup_logging
+from metrics import instrument_connection
+import profiling
+
 load_dotenv()
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('trailer_importer.log'),
-        logging.StreamHandler()
-    ]
-)
+setup_logging('trailer_importer.log')
 
 # Database configuration
 DB_CONFIG = {
@@ -57,7 +56,9 @@ async def fetch_with_retry(session, url, retries=MAX_RETRIES):
 
 async def process_anime_trailer(pool, session, anime_record):
     """Process a single anime to fetch and store its YouTube trailer ID"""
-    async with pool.acquire() as conn:
+    if REQUEST_BUDGET.exhausted():
+        return
+    async with pool.acquire() as conn, entity_deadline():
         anime_id = anime_record['anime_id']
         anime_title = anime_record['title']
         logging.info(f"Processing anime: {anime_title} (ID: {anime_id})")
@@ -108,12 +109,13 @@ async def process_anime_trailer(pool, session, anime_record):
         # Respect rate limits
         await asyncio.sleep(REQUEST_DELAY)
 
-async def fetch_anime_trailers():
-    """Main function to fetch YouTube trailer IDs for all anime that are missing them"""
-    pool = None
+async def fetch_anime_trailers(pool=None, session=None):
+    """Main function to fetch YouTube trailer IDs for all anime that are missing them."""
+    own_pool = pool is None
     try:
-        pool = await asyncpg.create_pool(**DB_CONFIG, min_size=1, max_size=1)
-        logging.info("Connected to database with connection pool")
+        if own_pool:
+            pool = await asyncpg.create_pool(**DB_CONFIG, min_size=1, max_size=1, init=instrument_connection)
+            logging.info("Connected to database with connection pool")
 
         # Get all anime without a trailer_url_yt_id
         async with pool.acquire() as conn:
@@ -132,21 +134,26 @@ async def fetch_anime_trailers():
 
         logging.info(f"Found {len(anime_records)} anime without trailer YouTube IDs")
 
-        async with aiohttp.ClientSession() as session:
+        async with client_session(session) as session:
             for anime_record in anime_records:
                 await process_anime_trailer(pool, session, anime_record)
                 await asyncio.sleep(REQUEST_DELAY)
 
     except Exception as e:
         logging.critical(f"Critical error: {str(e)}", exc_info=True)
+        if not own_pool:
+            raise
     finally:
-        if pool:
+        if pool and own_pool:
             await pool.close()
             logging.info("Database connection pool closed")
 
 if __name__ == "__main__":
+    import sys
+
+    profile_mode = profiling.pop_profile_flag(sys.argv)
     start_time = time.time()
     logging.info("===== STARTING ANIME TRAILER FETCH =====")
-    asyncio.run(fetch_anime_trailers())
+    profiling.run(fetch_anime_trailers(), profile_mode, "trailer_importer")
     duration = time.time() - start_time
     logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
\ No newline at end of file
@@ -9,17 +9,18 @@ import json
 from datetime import datetime
 from dotenv import load_dotenv
 
+from budget import REQUEST_BUDGET
+from content_hash import replace_entity_image
+from jikan_client import client_session, entity_deadline
+from log_pipeline import setup_logging
+from metrics import instrument_connection
+from models import Person
+import profiling
+
 load_dotenv()
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('voice_actor_importer.log'),
-        logging.StreamHandler()
-    ]
-)
+setup_logging('voice_actor_importer.log')
 
 # Database configuration
 DB_CONFIG = {
@@ -60,12 +61,14 @@ async def fetch_with_retry(session, url, retries=MAX_RETRIES):
 
 async def process_voice_actor(pool, session, va_record, semaphore=None):
     """Process a single voice actor to fetch and store their image"""
+    if REQUEST_BUDGET.exhausted():
+        return
     # If semaphore is provided, use it, otherwise just proceed
     if semaphore is not None:
-        async with semaphore, pool.acquire() as conn:
+        async with semaphore, pool.acquire() as conn, entity_deadline():
             return await _process_voice_actor_data(conn, session, va_record)
     else:
-        async with pool.acquire() as conn:
+        async with pool.acquire() as conn, entity_deadline():
             return await _process_voice_actor_data(conn, session, va_record)
 
 async def _process_voice_actor_data(conn, session, va_record):
@@ -77,7 +80,7 @@ async def _process_voice_actor_data(conn, session, va_record):
     # Check if image already exists
     existing_image = await conn.fetchval(
         """
-        SELECT 1 FROM media 
+        SELECT 1 FROM live_media 
         WHERE entity_type = 'voice_actor' 
         AND entity_id = $1 
         AND media_type = 'image'
@@ -109,11 +112,11 @@ async def _process_voice_actor_data(conn, session, va_record):
     if not person_details or not person_details.get('data'):
         logging.warning(f"No details found for person ID: {person_id}")
         return
+    person = Person.from_payload(person_details['data'])
+    person_details = None
 
     # Get image URL
-    image_url = None
-    if person_details['data'].get('images') and person_details['data']['images'].get('jpg'):
-        image_url = person_details['data']['images']['jpg'].get('image_url')
+    image_url = person.image_url
     
     if not image_url:
         logging.warning(f"No image found for voice actor: {va_name}")
@@ -121,14 +124,7 @@ async def _process_voice_actor_data(conn, session, va_record):
 
     # Insert into media table
     try:
-        await conn.execute(
-            """
-            INSERT INTO media (url, entity_type, entity_id, media_type)
-            VALUES ($1, 'voice_actor', $2, 'image')
-            ON CONFLICT DO NOTHING
-            """,
-            image_url, va_id
-        )
+        await replace_entity_image(conn, 'voice_actor', va_id, image_url)
         logging.info(f"Inserted image for voice actor {va_name}: {image_url}")
     except Exception as e:
         logging.error(f"Error inserting image for voice actor {va_name}: {str(e)}")
@@ -136,13 +132,14 @@ async def _process_voice_actor_data(conn, session, va_record):
     # Respect rate limits - ensure delay between requests
     await asyncio.sleep(REQUEST_DELAY)
 
-async def fetch_voice_actor_images():
-    """Main function to fetch images for all voice actors without images"""
-    pool = None
+async def fetch_voice_actor_images(pool=None, session=None):
+    """Main function to fetch images for all voice actors without images."""
+    own_pool = pool is None
     try:
-        # Create database connection pool with minimal connections
-        pool = await asyncpg.create_pool(**DB_CONFIG, min_size=1, max_size=1)
-        logging.info("Connected to database with connection pool")
+        if own_pool:
+            # Create database connection pool with minimal connections
+            pool = await asyncpg.create_pool(**DB_CONFIG, min_size=1, max_size=1, init=instrument_connection)
+            logging.info("Connected to database with connection pool")
 
         # Get all voice actors without images
         async with pool.acquire() as conn:
@@ -151,7 +148,7 @@ async def fetch_voice_actor_images():
                 SELECT v.voice_actor_id, v.name
                 FROM voice_actor v
                 WHERE NOT EXISTS (
-                    SELECT 1 FROM media m
+                    SELECT 1 FROM live_media m
                     WHERE m.entity_type = 'voice_actor'
                     AND m.entity_id = v.voice_actor_id
                     AND m.media_type = 'image'
@@ -168,7 +165,7 @@ async def fetch_voice_actor_images():
         logging.info(f"Found {len(va_records)} voice actors without images")
 
         # Process voice actors one at a time to respect rate limits
-        async with aiohttp.ClientSession() as session:
+        async with client_session(session) as session:
             for va_record in va_records:
                 await process_voice_actor(pool, session, va_record, None)
                 # Add a small delay between starting each voice actor to avoid bursts
@@ -176,14 +173,19 @@ async def fetch_voice_actor_images():
 
     except Exception as e:
         logging.critical(f"Critical error: {str(e)}", exc_info=True)
+        if not own_pool:
+            raise
     finally:
-        if pool:
+        if pool and own_pool:
             await pool.close()
             logging.info("Database connection pool closed")
 
 if __name__ == "__main__":
+    import sys
+
+    profile_mode = profiling.pop_profile_flag(sys.argv)
     start_time = time.time()
     logging.info("===== STARTING VOICE ACTOR IMAGE FETCH =====")
-    asyncio.run(fetch_voice_actor_images())
+    profiling.run(fetch_voice_actor_images(), profile_mode, "voice_actor_importer")
     duration = time.time() - start_time
     logging.info(f"===== COMPLETED IN {duration:.2f} SECONDS =====")
@@ -0,0 +1,377 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from datetime import date, timedelta
+
+import asyncpg
+
+from benchmark import BENCH_ADMIN_DSN, BENCH_DATABASE, prepare_database
+
+# Micro-benchmark of the ways the importers can write rows. Each strategy
+# inserts the same generated rows into a scratch database built from
+# schema.sql, at several batch sizes and with an artificial delay per round
+# trip standing in for the distance to a hosted Postgres.
+
+BATCH_SIZES = (1, 10, 100, 1000)
+ROUND_TRIP_TIMES = (0.0, 0.001, 0.01)  # Seconds added per round trip
+ROWS_PER_RUN = 1000
+RESULTS_FILE = "write_benchmark_results.json"
+MAX_QUERY_PARAMS = 32767  # Postgres bind parameter limit per statement
+SEED = 1234
+
+
+class TableSpec:
+    """A target table, its insert columns (with Postgres types) and a row generator"""
+
+    def __init__(self, name, id_column, columns, make_row):
+        self.name = name
+        self.id_column = id_column  # None when there is no generated id to return
+        self.columns = columns
+        self.make_row = make_row
+
+    @property
+    def column_list(self):
+        return ", ".join(name for name, _ in self.columns)
+
+    @property
+    def returning(self):
+        return f" RETURNING {self.id_column}" if self.id_column else ""
+
+
+def _anime_row(rng, i, ctx):
+    return (
+        f"Benchmark Anime {i}",
+        f"Alternative Title {i}",
+        date(1990, 1, 1) + timedelta(days=rng.randint(0, 12000)),
+        f"{rng.choice(['Winter', 'Spring', 'Summer', 'Fall'])} {rng.randint(1990, 2023)}",
+        rng.randint(1, 64),
+        "A synthetic synopsis sentence. " * rng.randint(10, 60),
+        i + 1,
+        round(rng.uniform(2.5, 5.0), 2),
+        1,
+    )
+
+
+def _character_row(rng, i, ctx):
+    return (f"Character {i}", "Character biography text. " * rng.randint(3, 40), None)
+
+
+def _media_row(rng, i, ctx):
+    return (f"https://cdn.example.invalid/images/anime/{i}.jpg", "anime", i + 1, "image")
+
+
+def _anime_genre_row(rng, i, ctx):
+    # Every (anime, genre) pair is used once per run so the primary key holds
+    genres = ctx["genre_ids"]
+    return (ctx["anime_ids"][i // len(genres)], genres[i % len(genres)])
+
+
+TABLES = {
+    "anime": TableSpec("anime", "anime_id", [
+        ("title", "text"),
+        ("alternative_title", "text"),
+        ("release_date", "date"),
+        ("season", "text"),
+        ("episodes", "int4"),
+        ("synopsis", "text"),
+        ("rank", "int4"),
+        ("seed_rating", "float8"),
+        ("seed_count", "int4"),
+    ], _anime_row),
+    "anime_genre": TableSpec("anime_genre", None, [
+        ("anime_id", "int4"),
+        ("genre_id", "int4"),
+    ], _anime_genre_row),
+    "characters": TableSpec("characters", "character_id", [
+        ("name", "text"),
+        ("description", "text"),
+        ("voice_actor_id", "int4"),
+    ], _character_row),
+    "media": TableSpec("media", "media_id", [
+        ("url", "text"),
+        ("entity_type", "text"),
+        ("entity_id", "int4"),
+        ("media_type", "text"),
+    ], _media_row),
+}
+
+
+class DelayedConnection:
+    """Connection wrapper adding a fixed delay to every round trip it makes"""
+
+    def __init__(self, conn, rtt):
+        self._conn = conn
+        self.rtt = rtt
+        self.round_trips = 0
+
+    async def _round_trip(self):
+        self.round_trips += 1
+        if self.rtt:
+            await asyncio.sleep(self.rtt)
+
+    async def execute(self, *args, **kwargs):
+        await self._round_trip()
+        return await self._conn.execute(*args, **kwargs)
+
+    async def executemany(self, *args, **kwargs):
+        # asyncpg pipelines the whole batch, so it is one round trip
+        await self._round_trip()
+        return await self._conn.executemany(*args, **kwargs)
+
+    async def fetch(self, *args, **kwargs):
+        await self._round_trip()
+        return await self._conn.fetch(*args, **kwargs)
+
+    async def fetchval(self, *args, **kwargs):
+        await self._round_trip()
+        return await self._conn.fetchval(*args, **kwargs)
+
+    async def copy_records_to_table(self, *args, **kwargs):
+        await self._round_trip()
+        return await self._conn.copy_records_to_table(*args, **kwargs)
+
+
+# Strategies take (conn, table, rows) and return the generated ids (or []
+# when the strategy can't report them)
+
+
+async def write_row_returning(conn, table, rows):
+    """One INSERT ... RETURNING per row, as the importers do today"""
+    placeholders = ", ".join(f"${i}" for i in range(1, len(table.columns) + 1))
+    query = f"INSERT INTO {table.name} ({table.column_list}) VALUES ({placeholders}){table.returning}"
+    ids = []
+    for row in rows:
+        ids.append(await conn.fetchval(query, *row))
+    return ids
+
+
+async def write_executemany(conn, table, rows):
+    """One prepared INSERT executed for the whole batch (no ids back)"""
+    placeholders = ", ".join(f"${i}" for i in range(1, len(table.columns) + 1))
+    await conn.executemany(
+        f"INSERT INTO {table.name} ({table.column_list}) VALUES ({placeholders})", rows
+    )
+    return []
+
+
+async def write_multi_values(conn, table, rows):
+    """A single INSERT with one VALUES tuple per row"""
+    width = len(table.columns)
+    per_statement = max(1, MAX_QUERY_PARAMS // width)
+    ids = []
+    for start in range(0, len(rows), per_statement):
+        chunk = rows[start:start + per_statement]
+        tuples = ", ".join(
+            "(" + ", ".join(f"${n * width + i}::{pg_type}" for i, (_, pg_type) in enumerate(table.columns, 1)) + ")"
+            for n in range(len(chunk))
+        )
+        params = [value for row in chunk for value in row]
+        records = await conn.fetch(
+            f"INSERT INTO {table.name} ({table.column_list}) VALUES {tuples}{table.returning}", *params
+        )
+        if table.id_column:
+            ids.extend(record[0] for record in records)
+    return ids
+
+
+async def write_copy_merge(conn, table, rows):
+    """COPY into a staging table, then move the rows across in one statement"""
+    staging = f"{table.name}_staging"
+    await conn.copy_records_to_table(staging, records=rows, columns=[name for name, _ in table.columns])
+    records = await conn.fetch(
+        f"""
+        WITH moved AS (DELETE FROM {staging} RETURNING {table.column_list})
+        INSERT INTO {table.name} ({table.column_list})
+        SELECT {table.column_list} FROM moved
+        ON CONFLICT DO NOTHING{table.returning}
+        """
+    )
+    return [record[0] for record in records] if table.id_column else []
+
+
+async def write_unnest(conn, table, rows):
+    """A single INSERT ... SELECT FROM unnest() over one array per column"""
+    arrays = [list(column) for column in zip(*rows)]
+    casts = ", ".join(f"${i}::{pg_type}[]" for i, (_, pg_type) in enumerate(table.columns, 1))
+    records = await conn.fetch(
+        f"INSERT INTO {table.name} ({table.column_list}) "
+        f"SELECT * FROM unnest({casts}){table.returning}",
+        *arrays,
+    )
+    return [record[0] for record in records] if table.id_column else []
+
+
+STRATEGIES = {
+    "row_returning": write_row_returning,
+    "executemany": write_executemany,
+    "multi_values": write_multi_values,
+    "copy_merge": write_copy_merge,
+    "unnest": write_unnest,
+}
+
+
+async def reset_table(conn, table, rows_needed):
+    """Empty the target (and rebuild what it references) so every run starts equal"""
+    ctx = {}
+    if table.name == "anime_genre":
+        await conn.execute("TRUNCATE anime, genre RESTART IDENTITY CASCADE")
+        ctx["genre_ids"] = [
+            record[0] for record in await conn.fetch(
+                "INSERT INTO genre (name) SELECT 'Genre ' || g FROM generate_series(1, 40) g RETURNING genre_id"
+            )
+        ]
+        ctx["anime_ids"] = [
+            record[0] for record in await conn.fetch(
+                "INSERT INTO anime (title) SELECT 'Anime ' || a FROM generate_series(1, $1) a RETURNING anime_id",
+                -(-rows_needed // len(ctx["genre_ids"])),
+            )
+        ]
+    else:
+        await conn.execute(f"TRUNCATE {table.name} RESTART IDENTITY CASCADE")
+    await conn.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS {table.name}_staging AS "
+        f"SELECT {table.column_list} FROM {table.name} WITH NO DATA"
+    )
+    await conn.execute(f"TRUNCATE {table.name}_staging")
+    return ctx
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+async def run_case(conn, table, strategy_name, batch_size, rtt, rows_per_run, seed=SEED):
+    """Insert rows_per_run rows in batches with one strategy and measure it"""
+    ctx = await reset_table(conn, table, rows_per_run)
+    rng = random.Random(seed)
+    rows = [table.make_row(rng, i, ctx) for i in range(rows_per_run)]
+    strategy = STRATEGIES[strategy_name]
+    delayed = DelayedConnection(conn, rtt)
+
+    latencies = []
+    start_time = time.perf_counter()
+    for start in range(0, len(rows), batch_size):
+        batch_start = time.perf_counter()
+        await strategy(delayed, table, rows[start:start + batch_size])
+        latencies.append(time.perf_counter() - batch_start)
+    elapsed = time.perf_counter() - start_time
+
+    written = await conn.fetchval(f"SELECT COUNT(*) FROM {table.name}")
+    latencies.sort()
+    return {
+        "table": table.name,
+        "strategy": strategy_name,
+        "batch_size": batch_size,
+        "rtt_ms": rtt * 1000,
+        "rows": written,
+        "seconds": elapsed,
+        "rows_per_second": written / elapsed if elapsed else 0.0,
+        "round_trips": delayed.round_trips,
+        "batch_p50_ms": _percentile(latencies, 0.50) * 1000,
+        "batch_p95_ms": _percentile(latencies, 0.95) * 1000,
+        "batch_p99_ms": _percentile(latencies, 0.99) * 1000,
+        "returns_ids": strategy is not write_executemany and table.id_column is not None,
+    }
+
+
+def fastest(results):
+    """Best strategy by rows/s per (table, rtt) at the largest batch size measured"""
+    picks = {}
+    for row in results:
+        # Tables with generated ids need them back to write dependent rows
+        if TABLES[row["table"]].id_column and not row["returns_ids"]:
+            continue
+        key = f"{row['table']}@{row['rtt_ms']:g}ms"
+        best = picks.get(key)
+        if best is None or (row["batch_size"], row["rows_per_second"]) > (best["batch_size"], best["rows_per_second"]):
+            picks[key] = row
+    return {key: {"strategy": row["strategy"], "batch_size": row["batch_size"],
+                  "rows_per_second": row["rows_per_second"]} for key, row in picks.items()}
+
+
+def format_results(results):
+    lines = [
+        f"{'table':<12} {'strategy':<14} {'batch':>6} {'rtt ms':>7} {'rows/s':>10} "
+        f"{'trips':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}",
+    ]
+    for row in results:
+        lines.append(
+            f"{row['table']:<12} {row['strategy']:<14} {row['batch_size']:>6} {row['rtt_ms']:>7.1f} "
+            f"{row['rows_per_second']:>10.0f} {row['round_trips']:>6} {row['batch_p50_ms']:>8.2f} "
+            f"{row['batch_p95_ms']:>8.2f} {row['batch_p99_ms']:>8.2f}"
+        )
+    return "\n".join(lines)
+
+
+async def run_write_benchmark(
+    tables=None,
+    strategies=None,
+    batch_sizes=BATCH_SIZES,
+    rtts=ROUND_TRIP_TIMES,
+    rows_per_run=ROWS_PER_RUN,
+    admin_dsn=BENCH_ADMIN_DSN,
+    database=BENCH_DATABASE,
+):
+    """Run every (table, strategy, batch size, rtt) combination once"""
+    dsn = await prepare_database(admin_dsn, database)
+    conn = await asyncpg.connect(dsn)
+    results = []
+    try:
+        for table_name in tables or TABLES:
+            table = TABLES[table_name]
+            for strategy_name in strategies or STRATEGIES:
+                for batch_size in batch_sizes:
+                    for rtt in rtts:
+                        result = await run_case(conn, table, strategy_name, batch_size, rtt, rows_per_run)
+                        logging.info(
+                            f"{table.name:<12} {strategy_name:<14} batch={batch_size:<5} rtt={rtt * 1000:g}ms "
+                            f"-> {result['rows_per_second']:.0f} rows/s"
+                        )
+                        results.append(result)
+    finally:
+        await conn.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare DB write strategies for the importers")
+    parser.add_argument("--tables", nargs="*", choices=sorted(TABLES), help="Tables to write (default: all)")
+    parser.add_argument("--strategies", nargs="*", choices=sorted(STRATEGIES), help="Strategies (default: all)")
+    parser.add_argument("--batch-sizes", nargs="*", type=int, default=list(BATCH_SIZES))
+    parser.add_argument("--rtt-ms", nargs="*", type=float, default=[rtt * 1000 for rtt in ROUND_TRIP_TIMES],
+                        help="Simulated network round trip times in milliseconds")
+    parser.add_argument("--rows", type=int, default=ROWS_PER_RUN, help="Rows written per case")
+    parser.add_argument("--admin-dsn", default=BENCH_ADMIN_DSN, help="DSN allowed to create databases")
+    parser.add_argument("--database", default=BENCH_DATABASE, help="Scratch database (dropped and recreated)")
+    parser.add_argument("--output", default=RESULTS_FILE, help="Where to write the JSON results")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    results = asyncio.run(run_write_benchmark(
+        args.tables,
+        args.strategies,
+        batch_sizes=args.batch_sizes,
+        rtts=[rtt / 1000 for rtt in args.rtt_ms],
+        rows_per_run=args.rows,
+        admin_dsn=args.admin_dsn,
+        database=args.database,
+    ))
+
+    picks = fastest(results)
+    logging.info("Write benchmark results:\n" + format_results(results))
+    for key, pick in sorted(picks.items()):
+        logging.info(f"Fastest for {key}: {pick['strategy']} ({pick['rows_per_second']:.0f} rows/s)")
+    with open(args.output, "w") as f:
+        json.dump({"settings": vars(args), "results": results, "fastest": picks}, f, indent=2)
+    logging.info(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,4 +1,5 @@
 -- Drop all tables if they exist (in reverse dependency order)
+DROP VIEW IF EXISTS live_media;
 DROP TABLE IF EXISTS continue_watching CASCADE;
 DROP TABLE IF EXISTS watch_history CASCADE;
 DROP TABLE IF EXISTS episode CASCADE;
@@ -18,6 +19,16 @@ DROP TABLE IF EXISTS voice_actor CASCADE;
 DROP TABLE IF EXISTS genre CASCADE;
 DROP TABLE IF EXISTS company CASCADE;
 DROP TABLE IF EXISTS users CASCADE;
+DROP TABLE IF EXISTS import_fingerprint CASCADE;
+DROP TABLE IF EXISTS reference_data_load CASCADE;
+DROP TABLE IF EXISTS reference_data_row CASCADE;
+DROP TABLE IF EXISTS media_link_check CASCADE;
+DROP TABLE IF EXISTS search_entry CASCADE;
+DROP TABLE IF EXISTS anime_similarity CASCADE;
+DROP TABLE IF EXISTS anime_similarity_state CASCADE;
+DROP TABLE IF EXISTS media_variant CASCADE;
+DROP TABLE IF EXISTS media_mirror CASCADE;
+DROP TABLE IF EXISTS media_file CASCADE;
 
 -- DROP all indices if they exist (this helps to reset database more than once)
 DROP INDEX IF EXISTS idx_anime_title;
@@ -29,6 +40,13 @@ DROP INDEX IF EXISTS idx_review_user;
 DROP INDEX IF EXISTS idx_review_anime;
 DROP INDEX IF EXISTS idx_character_va;
 DROP INDEX IF EXISts idx_anime_rating;
+DROP INDEX IF EXISTS idx_genre_name;
+DROP INDEX IF EXISTS idx_media_mirror_url;
+DROP INDEX IF EXISTS idx_search_entry_trgm;
+DROP INDEX IF EXISTS idx_anime_search_vector;
+DROP INDEX IF EXISTS idx_characters_search_vector;
+DROP INDEX IF EXISTS idx_anime_similarity_similar;
+DROP INDEX IF EXISTS idx_media_link_check_next;
 
 -- visibility_level type
 DROP TYPE IF EXISTS visibility_type CASCADE;
@@ -89,7 +107,8 @@ CREATE TABLE anime
     trailer_url_yt_id VARCHAR(20),
     streaming_available BOOLEAN NOT NULL DEFAULT FALSE,
     seed_rating double precision,
-    seed_count integer
+    seed_count integer,
+    search_vector tsvector
 );
 
 CREATE TABLE characters
@@ -97,7 +116,8 @@ CREATE TABLE characters
     character_id   SERIAL PRIMARY KEY,
     name           VARCHAR(255) NOT NULL,
     description    TEXT,
-    voice_actor_id INTEGER
+    voice_actor_id INTEGER,
+    search_vector  tsvector
 );
 
 CREATE TABLE media
@@ -370,6 +390,8 @@ CREATE INDEX idx_review_user ON review (user_id);
 CREATE INDEX idx_review_anime ON review (anime_id);
 CREATE INDEX idx_anime_rating ON anime (rating DESC);
 CREATE INDEX idx_character_va ON characters (voice_actor_id);
+-- Genres are looked up and upserted by name
+CREATE UNIQUE INDEX idx_genre_name ON genre (name);
 CREATE INDEX idx_transaction_history_user_id ON transaction_history(user_id);
 CREATE INDEX idx_user_subscription_expiry ON users (subscription_status, subscription_end_date);
 
@@ -659,4 +681,255 @@ $$ LANGUAGE plpgsql;
 CREATE TRIGGER tr_after_transaction_update
 AFTER UPDATE ON transaction_history
 FOR EACH ROW
-EXECUTE FUNCTION fn_update_user_subscription();
\ No newline at end of file
+EXECUTE FUNCTION fn_update_user_subscription();
+
+-- ─────────────────────────────────────────────
+-- Import fingerprints: per-field content hashes of what each importer
+-- persisted, keyed by the Jikan (MAL) id, so refresh runs can skip
+-- unchanged entities and update only the columns that differ
+-- ─────────────────────────────────────────────
+CREATE TABLE import_fingerprint
+(
+    entity_type  VARCHAR(50) NOT NULL,
+    source_id    INTEGER     NOT NULL,
+    entity_id    INTEGER     NOT NULL,
+    content_hash CHAR(40)    NOT NULL,
+    field_hashes JSONB       NOT NULL DEFAULT '{}',
+    updated_at   TIMESTAMPTZ DEFAULT NOW(),
+    checked_at   TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (entity_type, source_id)
+);
+
+CREATE INDEX idx_import_fingerprint_entity ON import_fingerprint (entity_type, entity_id);
+-- Lets the importer daemon find the stalest entities of a type quickly
+CREATE INDEX idx_import_fingerprint_checked ON import_fingerprint (entity_type, checked_at);
+
+-- ─────────────────────────────────────────────
+-- Reference data loads: checksum of each data_fetcher/reference_data file
+-- as last applied, so unchanged files are skipped
+-- ─────────────────────────────────────────────
+CREATE TABLE reference_data_load
+(
+    dataset   VARCHAR(100) PRIMARY KEY,
+    version   INTEGER      NOT NULL,
+    checksum  CHAR(64)     NOT NULL,
+    row_count INTEGER      NOT NULL,
+    loaded_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Rows a reference dataset inserted itself (by key), so later versions of
+-- the file may update them without touching imported rows
+CREATE TABLE reference_data_row
+(
+    dataset VARCHAR(100) NOT NULL,
+    row_key TEXT         NOT NULL,
+    PRIMARY KEY (dataset, row_key)
+);
+
+-- ─────────────────────────────────────────────
+-- Local image mirror: files stored content-addressed by SHA-256 under the
+-- mirror directory (one row per distinct file), and the file each image
+-- media row was mirrored to, with the URL it was downloaded from
+-- ─────────────────────────────────────────────
+CREATE TABLE media_file
+(
+    sha256     CHAR(64) PRIMARY KEY,
+    local_path VARCHAR(255) NOT NULL,
+    byte_size  INTEGER      NOT NULL,
+    format     VARCHAR(10),
+    width      INTEGER,
+    height     INTEGER,
+    phash      BIGINT, -- 64-bit difference hash, compared per entity by image_dedup
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE media_mirror
+(
+    media_id    INTEGER PRIMARY KEY REFERENCES media (media_id) ON DELETE CASCADE,
+    url         VARCHAR(512) NOT NULL,
+    sha256      CHAR(64)     NOT NULL REFERENCES media_file (sha256),
+    mirrored_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Finds an already mirrored copy of a URL without downloading it again
+CREATE INDEX idx_media_mirror_url ON media_mirror (url);
+
+-- Resized copies of mirrored files, e.g. variant 'thumb.160.webp', for the
+-- backend to serve at the size a page needs
+CREATE TABLE media_variant
+(
+    sha256     CHAR(64)     NOT NULL REFERENCES media_file (sha256) ON DELETE CASCADE,
+    variant    VARCHAR(50)  NOT NULL,
+    local_path VARCHAR(255) NOT NULL,
+    format     VARCHAR(10)  NOT NULL,
+    width      INTEGER      NOT NULL,
+    height     INTEGER      NOT NULL,
+    byte_size  INTEGER      NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (sha256, variant)
+);
+
+-- ─────────────────────────────────────────────
+-- Media link health: last check of each media URL (status is NULL when
+-- no response came back) and when it is due again. Links that answered
+-- since first_ok_at are re-checked less often the older they get; links
+-- failing since first_failed_at are marked dead_since once the failures
+-- have lasted long enough, and live_media leaves them out so the image
+-- fetchers look for a replacement
+-- ─────────────────────────────────────────────
+CREATE TABLE media_link_check
+(
+    media_id        INTEGER PRIMARY KEY REFERENCES media (media_id) ON DELETE CASCADE,
+    url             VARCHAR(512) NOT NULL,
+    status          SMALLINT,
+    error           VARCHAR(100),
+    failures        INTEGER      NOT NULL DEFAULT 0,
+    first_ok_at     TIMESTAMPTZ,
+    first_failed_at TIMESTAMPTZ,
+    dead_since      TIMESTAMPTZ,
+    checked_at      TIMESTAMPTZ  NOT NULL DEFAULT NOW(),
+    next_check_at   TIMESTAMPTZ  NOT NULL
+);
+
+CREATE INDEX idx_media_link_check_next ON media_link_check (next_check_at);
+
+CREATE VIEW live_media AS
+SELECT m.*
+FROM media m
+WHERE NOT EXISTS (
+    SELECT 1 FROM media_link_check c
+    WHERE c.media_id = m.media_id
+    AND c.url = m.url
+    AND c.dead_since IS NOT NULL
+);
+
+-- ─────────────────────────────────────────────
+-- Name search: anime titles and character / voice actor names, normalized
+-- by search_normalize() and trigram indexed. Queries normalize their text
+-- the same way, e.g.
+--   WHERE normalized % search_normalize('shounen')
+-- ─────────────────────────────────────────────
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Lower case without accents, with romanization variants folded together
+-- (ou/oo/ō -> o, uu/ū -> u, m before b/p -> n) and punctuation turned into
+-- single spaces
+CREATE OR REPLACE FUNCTION search_normalize(input TEXT)
+RETURNS TEXT
+LANGUAGE sql IMMUTABLE PARALLEL SAFE
+AS $$
+    SELECT btrim(regexp_replace(
+        regexp_replace(
+            regexp_replace(
+                regexp_replace(
+                    regexp_replace(
+                        translate(
+                            lower(input),
+                            'āēīōūâêîôûäëïöüáéíóúàèìòùñç',
+                            'aeiouaeiouaeiouaeiouaeiounc'
+                        ),
+                        '[''’]', '', 'g'
+                    ),
+                    'o[ou]', 'o', 'g'
+                ),
+                'uu', 'u', 'g'
+            ),
+            'm([bp])', 'n\1', 'g'
+        ),
+        '[^[:alnum:]]+', ' ', 'g'
+    ))
+$$;
+
+CREATE TABLE search_entry
+(
+    entity_type VARCHAR(50) NOT NULL,
+    entity_id   INTEGER     NOT NULL,
+    field       VARCHAR(50) NOT NULL,
+    name        TEXT        NOT NULL,
+    normalized  TEXT        NOT NULL,
+    indexed_at  TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (entity_type, entity_id, field)
+);
+
+CREATE INDEX idx_search_entry_trgm ON search_entry USING gin (normalized gin_trgm_ops);
+
+-- ─────────────────────────────────────────────
+-- Full-text search: weighted tsvectors (title > alternative title >
+-- synopsis / description), kept current by triggers as rows are written.
+-- Rows from before the columns existed are backfilled by the importer's
+-- search_index stage. Rank with e.g.
+--   WHERE search_vector @@ websearch_to_tsquery('english', $1)
+--   ORDER BY ts_rank(search_vector, websearch_to_tsquery('english', $1)) DESC
+-- ─────────────────────────────────────────────
+CREATE OR REPLACE FUNCTION anime_search_vector(title TEXT, alternative_title TEXT, synopsis TEXT)
+RETURNS tsvector
+LANGUAGE sql IMMUTABLE PARALLEL SAFE
+AS $$
+    SELECT setweight(to_tsvector('english', coalesce(title, '')), 'A')
+        || setweight(to_tsvector('english', coalesce(alternative_title, '')), 'B')
+        || setweight(to_tsvector('english', coalesce(synopsis, '')), 'C')
+$$;
+
+CREATE OR REPLACE FUNCTION character_search_vector(name TEXT, description TEXT)
+RETURNS tsvector
+LANGUAGE sql IMMUTABLE PARALLEL SAFE
+AS $$
+    SELECT setweight(to_tsvector('english', coalesce(name, '')), 'A')
+        || setweight(to_tsvector('english', coalesce(description, '')), 'C')
+$$;
+
+CREATE OR REPLACE FUNCTION fn_anime_search_vector()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_vector := anime_search_vector(NEW.title, NEW.alternative_title, NEW.synopsis);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION fn_character_search_vector()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_vector := character_search_vector(NEW.name, NEW.description);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Only the searched columns: rating and rank updates don't recompute it
+DROP TRIGGER IF EXISTS tr_anime_search_vector ON anime;
+CREATE TRIGGER tr_anime_search_vector
+    BEFORE INSERT OR UPDATE OF title, alternative_title, synopsis
+    ON anime
+    FOR EACH ROW EXECUTE FUNCTION fn_anime_search_vector();
+
+DROP TRIGGER IF EXISTS tr_character_search_vector ON characters;
+CREATE TRIGGER tr_character_search_vector
+    BEFORE INSERT OR UPDATE OF name, description
+    ON characters
+    FOR EACH ROW EXECUTE FUNCTION fn_character_search_vector();
+
+CREATE INDEX idx_anime_search_vector ON anime USING gin (search_vector);
+CREATE INDEX idx_characters_search_vector ON characters USING gin (search_vector);
+
+-- ─────────────────────────────────────────────
+-- Similar anime: top neighbours of each anime by IDF-weighted cosine
+-- similarity of their genres, precomputed by the similar_anime job, and
+-- the genre set hash each anime's neighbours were last computed from
+-- ─────────────────────────────────────────────
+CREATE TABLE anime_similarity
+(
+    anime_id         INTEGER  NOT NULL REFERENCES anime (anime_id) ON DELETE CASCADE,
+    rank             SMALLINT NOT NULL,
+    similar_anime_id INTEGER  NOT NULL REFERENCES anime (anime_id) ON DELETE CASCADE,
+    score            REAL     NOT NULL,
+    PRIMARY KEY (anime_id, rank)
+);
+
+-- Finds the lists an anime appears in when its genres change
+CREATE INDEX idx_anime_similarity_similar ON anime_similarity (similar_anime_id);
+
+CREATE TABLE anime_similarity_state
+(
+    anime_id    INTEGER PRIMARY KEY REFERENCES anime (anime_id) ON DELETE CASCADE,
+    genre_hash  BIGINT NOT NULL,
+    computed_at TIMESTAMPTZ DEFAULT NOW()
+);